@@ -1,3 +1,4 @@
+-- Base schema, later changes are applied by the scripts in migrations/.
 CREATE TABLE IF NOT EXISTS document (
     document_id INTEGER PRIMARY KEY,
     document_name TEXT NOT NULL UNIQUE
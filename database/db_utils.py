@@ -2,10 +2,12 @@
 import sqlite3
 from pathlib import Path
 import json
-from typing import List
+import zlib
+from typing import List, Optional
 
 db_path = Path(__file__).parent / "db.sqlite"
 schema_path = Path(__file__).parent / "db_schema.sql"
+migrations_path = Path(__file__).parent / "migrations"
 
 
 def get_variables(db):
@@ -16,7 +18,7 @@ def get_variables(db):
 
 def connect_db(db_path: Path = db_path) -> sqlite3.Connection:
     """
-    Connect to the database. Build the tables if they don't exist.
+    Connect to the database. Build the tables if they don't exist, and apply outstanding migrations.
 
     :param db_path: Path to the database.
 
@@ -25,8 +27,10 @@ def connect_db(db_path: Path = db_path) -> sqlite3.Connection:
     if not db_path.exists():
         db = sqlite3.connect(db_path, check_same_thread=False)
         build_tables(db, schema_path)
-        return db
-    return sqlite3.connect(db_path, check_same_thread=False)
+    else:
+        db = sqlite3.connect(db_path, check_same_thread=False)
+    migrate(db)
+    return db
 
 
 def query_db(db, query, args=(), one=False) -> list:
@@ -62,18 +66,43 @@ def build_tables(db, sql_file: Path) -> None:
         db.commit()
 
 
-def get_next_id(db, table: str) -> int:
+def schema_version(db) -> int:
     """
-    Get the next ID.
+    Get the schema version of the database, i.e. the number of the last applied migration.
 
     :param db: Connection to the database.
-    :param table: Table to get the next ID for.
 
-    :return: Next ID for the table.
+    :return: Schema version.
     """
-    query = f"SELECT MAX({table}_id) FROM {table} LIMIT 1"
-    val = query_db(db, query)[0][0]
-    return val + 1 if val is not None else 0
+    return query_db(db, "PRAGMA user_version", one=True)[0]
+
+
+def migrate(db, migrations_dir: Path = migrations_path) -> int:
+    """
+    Upgrade the database in place.
+    Migrations are the `<version>_<name>.sql` files in `migrations_dir`, each applied in its own
+    transaction, in version order, if newer than the database's schema version.
+
+    :param db: Connection to the database.
+    :param migrations_dir: Directory containing the migrations.
+
+    :return: Schema version after migrating.
+    """
+    version = schema_version(db)
+    for migration in sorted(migrations_dir.glob("*.sql"), key=lambda p: int(p.name.split("_")[0])):
+        migration_version = int(migration.name.split("_")[0])
+        if migration_version <= version:
+            continue
+        with open(migration, 'r') as f:
+            script = f.read()
+        try:
+            db.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {migration_version};\nCOMMIT;")
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        version = migration_version
+    return version
 
 
 def get_doc_id(db, doc_name: str) -> int:
@@ -85,9 +114,9 @@ def get_doc_id(db, doc_name: str) -> int:
 
     :return: ID of the document.
     """
-    query = f"SELECT document_id FROM document WHERE document_name = '{doc_name}' LIMIT 1"
+    query = "SELECT document_id FROM document WHERE document_name = ? LIMIT 1"
     try:
-        return int(query_db(db, query)[0][0])
+        return int(query_db(db, query, (doc_name,))[0][0])
     except IndexError:
         return -1
 
@@ -103,9 +132,9 @@ def get_variable_id(db, var_name: str, variable_value: str, document_id: int) ->
 
     :return: ID of the variable.
     """
-    query = f"SELECT variable_id FROM variable WHERE variable_name = '{var_name}' AND variable_value = '{variable_value}' AND document_id = '{document_id}' LIMIT 1"
+    query = "SELECT variable_id FROM variable WHERE variable_name = ? AND variable_value = ? AND document_id = ? LIMIT 1"
     try:
-        return int(query_db(db, query)[0][0])
+        return int(query_db(db, query, (var_name, variable_value, document_id))[0][0])
     except IndexError:
         return -1
 
@@ -122,8 +151,56 @@ def get_extraction_id(db, extraction_method: str, var_id: int, document_id: int)
 
     :return: ID of the extraction.
     """
-    query = f"SELECT extraction_id FROM extraction WHERE method = '{extraction_method}' AND variable_id = '{var_id}' AND document_id = '{document_id}' LIMIT 1"
+    query = "SELECT extraction_id FROM extraction WHERE method = ? AND variable_id = ? AND document_id = ? LIMIT 1"
     try:
-        return int(query_db(db, query)[0][0])
+        return int(query_db(db, query, (extraction_method, var_id, document_id))[0][0])
     except IndexError:
         return -1
+
+
+def _scalar(db, query, args=()):
+    # plain tuple rows, whatever the connection's row factory
+    cursor = db.cursor()
+    cursor.row_factory = None
+    row = cursor.execute(query, args).fetchone()
+    cursor.close()
+    return row[0] if row is not None else None
+
+
+def get_document_text_hash(db, document_id: int) -> Optional[str]:
+    """
+    Get the hash of the stored text of a document.
+
+    :param db: Connection to the database.
+    :param document_id: ID of the document.
+
+    :return: Hash of the text, or None if the text isn't stored.
+    """
+    return _scalar(db, "SELECT text_hash FROM document_text WHERE document_id = ?", (document_id,))
+
+
+def get_document_text(db, document_id: int) -> Optional[str]:
+    """
+    Get the stored text of a document.
+
+    :param db: Connection to the database.
+    :param document_id: ID of the document.
+
+    :return: Text of the document, or None if it isn't stored.
+    """
+    text = _scalar(
+        db, "SELECT text FROM document_text WHERE document_id = ?", (document_id,))
+    return zlib.decompress(text).decode("utf-8") if text is not None else None
+
+
+def put_document_text(db, document_id: int, text: str, text_hash: str) -> None:
+    """
+    Store the text of a document, replacing any previous text. Doesn't commit.
+
+    :param db: Connection to the database.
+    :param document_id: ID of the document.
+    :param text: Text of the document.
+    :param text_hash: Hash of the text.
+    """
+    db.execute("INSERT OR REPLACE INTO document_text (document_id, text_hash, text) VALUES (?, ?, ?)",
+               (document_id, text_hash, zlib.compress(text.encode("utf-8"))))
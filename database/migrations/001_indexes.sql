@@ -0,0 +1,22 @@
+-- Indexes for the lookups performed while pushing extractions.
+-- variable_id / extraction_id are rowid aliases, so they are implicitly part of every index.
+
+-- get_variable_id
+CREATE INDEX IF NOT EXISTS idx_variable_name_value_document
+    ON variable (variable_name, variable_value, document_id);
+
+-- variables of a document (push_variables, the UI)
+CREATE INDEX IF NOT EXISTS idx_variable_document
+    ON variable (document_id);
+
+-- find_matching_evidence, the UI evidence queries
+CREATE INDEX IF NOT EXISTS idx_extraction_variable_document
+    ON extraction (variable_id, document_id);
+
+-- extractions of a document (push_variables)
+CREATE INDEX IF NOT EXISTS idx_extraction_document
+    ON extraction (document_id);
+
+-- _check_duplicate, covering the confidence it reads
+CREATE INDEX IF NOT EXISTS idx_raw_extraction_extraction_method
+    ON raw_extraction (extraction_id, method, confidence);
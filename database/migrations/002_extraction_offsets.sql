@@ -0,0 +1,5 @@
+-- Character offsets of the exact context in the document text, and a hash of that text.
+-- NULL for evidence which isn't a single span of a document (manual, from_string, from_spacy_multiple).
+ALTER TABLE extraction ADD COLUMN start_char INTEGER;
+ALTER TABLE extraction ADD COLUMN end_char INTEGER;
+ALTER TABLE extraction ADD COLUMN document_hash TEXT;
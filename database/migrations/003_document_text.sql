@@ -0,0 +1,11 @@
+-- One zlib compressed copy of each document's text, contexts of extractions stored
+-- as offsets only are sliced from it on read.
+CREATE TABLE IF NOT EXISTS document_text (
+    document_id INTEGER PRIMARY KEY,
+    text_hash TEXT NOT NULL,
+    text BLOB NOT NULL,
+    CONSTRAINT fk_document
+        FOREIGN KEY (document_id)
+        REFERENCES document(document_id)
+        ON DELETE CASCADE
+);
@@ -0,0 +1,44 @@
+-- (variable, value) partitions whose meta-classifier inputs changed since they were last scored:
+-- new validations, or new (or changed) raw extractions. Marking a dirty partition again bumps its version,
+-- so partitions marked while a rescore is running stay dirty.
+CREATE TABLE IF NOT EXISTS dirty_partition (
+    variable_name TEXT NOT NULL,
+    variable_value TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (variable_name, variable_value)
+);
+
+CREATE TRIGGER IF NOT EXISTS mark_dirty_validation
+AFTER UPDATE OF valid ON extraction
+WHEN NEW.valid IS NOT OLD.valid
+BEGIN
+    INSERT INTO dirty_partition (variable_name, variable_value)
+        SELECT variable_name, variable_value FROM variable WHERE variable_id = NEW.variable_id
+        ON CONFLICT (variable_name, variable_value) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS mark_dirty_raw_extraction
+AFTER INSERT ON raw_extraction
+BEGIN
+    INSERT INTO dirty_partition (variable_name, variable_value)
+        SELECT variable.variable_name, variable.variable_value
+        FROM extraction JOIN variable ON variable.variable_id = extraction.variable_id
+        WHERE extraction.extraction_id = NEW.extraction_id
+        ON CONFLICT (variable_name, variable_value) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS mark_dirty_raw_confidence
+AFTER UPDATE OF confidence ON raw_extraction
+WHEN NEW.confidence IS NOT OLD.confidence
+BEGIN
+    INSERT INTO dirty_partition (variable_name, variable_value)
+        SELECT variable.variable_name, variable.variable_value
+        FROM extraction JOIN variable ON variable.variable_id = extraction.variable_id
+        WHERE extraction.extraction_id = NEW.extraction_id
+        ON CONFLICT (variable_name, variable_value) DO UPDATE SET version = version + 1;
+END;
+
+-- existing partitions have never been scored incrementally
+INSERT OR IGNORE INTO dirty_partition (variable_name, variable_value)
+    SELECT DISTINCT variable.variable_name, variable.variable_value
+    FROM extraction JOIN variable ON variable.variable_id = extraction.variable_id;
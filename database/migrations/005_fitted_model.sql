@@ -0,0 +1,13 @@
+-- Models fitted by the last sort, reloaded to score new extractions without refitting, and to warm start the next fit.
+-- kind is "extraction" for the confidence model of a (variable, value) partition, "value" for the value
+-- meta-classifier of a variable (variable_value is empty). data_version is a hash of the data the model was fitted to.
+CREATE TABLE IF NOT EXISTS fitted_model (
+    kind TEXT NOT NULL,
+    variable_name TEXT NOT NULL,
+    variable_value TEXT NOT NULL DEFAULT '',
+    method TEXT NOT NULL,
+    data_version TEXT NOT NULL,
+    model BLOB NOT NULL,
+    fitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, variable_name, variable_value)
+);
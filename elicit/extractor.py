@@ -3,8 +3,10 @@ Main extraction launch-point.
 Controlls document execution through registered labelling functions.
 
 """
+from concurrent.futures import ProcessPoolExecutor
 import functools
-from typing import Callable, List, Optional, Set, Type, Union
+import inspect
+from typing import Callable, Hashable, List, Optional, Set, Tuple, Type, Union
 
 from pathlib import Path
 from typing_extensions import Literal
@@ -15,22 +17,48 @@ from elicit.interface import ElicitLogger, Extraction, LabellingFunctionBase
 from elicit.performance import performance
 
 
-from elicit.utils.loading import load_document
+from elicit.utils.cache import PlaintextCache
+from elicit.utils.loading import iter_documents
+from elicit.utils.registry import ModelRegistry
+from elicit.utils.sentence_index import SentenceIndex
 
 from tqdm import tqdm
 
-from user_interface.server.sorting import learn_meta_classifier, update_confidence
+from user_interface.server.sorting import rescore, score_unscored
 
 
 class Extractor:
-    def __init__(self, db_path: Path, model_path: Path = Path(__file__).parent / "models", device: int = 0, top_k: int = 3):
-        self.logger = ElicitLogger(db_path)
+    def __init__(self, db_path: Path, model_path: Path = Path(__file__).parent / "models", device: int = 0, top_k: int = 3, workers: int = 0, prefetch: int = 8, cache_dir: Optional[Path] = None, commit_every: int = 1, store_contexts: bool = True, sentence_index: bool = False):
+        """
+        :param db_path: Path to the extraction database.
+        :param model_path: Directory where (fine-tuned) models are stored.
+        :param device: Device to run models on.
+        :param top_k: Number of extractions each labelling function may push per variable.
+        :param workers: Number of processes used to parse documents ahead of the labelling functions. 0 parses in the main process.
+        :param prefetch: Maximum number of parsed documents waiting for the labelling functions.
+        :param cache_dir: Directory for the plaintext cache of parsed PDFs. None disables the cache.
+        :param commit_every: Number of documents whose extractions are written in a single transaction.
+        :param store_contexts: Whether to store extraction contexts, rather than offsets into a stored copy of the document text.
+        :param sentence_index: Whether to build a corpus sentence index, stored next to the database, as documents are extracted.
+            Passed to the labelling functions which accept a `sentence_index`.
+        """
+        self.logger = ElicitLogger(db_path, store_contexts=store_contexts)
         self.model_path = model_path
         model_path.mkdir(parents=True, exist_ok=True)
         self.device = device
         self.lfs = []
         self.schemas = {}
         self.top_k = top_k
+        self.workers = workers
+        self.prefetch = prefetch
+        self.cache = PlaintextCache(cache_dir) if cache_dir is not None else None
+        # ingestion workers, shared by every pass over the documents of a run
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.commit_every = commit_every
+        self.sentence_index = SentenceIndex.for_database(
+            db_path) if sentence_index else None
+        # models (and their results) shared by the labelling functions
+        self.model_registry = ModelRegistry()
 
     def register_schema(self, schema: Union[Path, dict], schema_name: str) -> None:
         if len(self.lfs) > 0:
@@ -50,6 +78,11 @@ class Extractor:
         if self.schemas == {}:
             raise ValueError(
                 "Must register schemas before registering labelling functions.")
+        shared = {"sentence_index": self.sentence_index,
+                  "model_registry": self.model_registry}
+        parameters = inspect.signature(labelling_function).parameters
+        function_kwargs = {**{name: value for name, value in shared.items()
+                              if value is not None and name in parameters}, **function_kwargs}
         obj = labelling_function(schemas=self.schemas,
                                  logger=self.logger,
                                  top_k=self.top_k,
@@ -66,44 +99,148 @@ class Extractor:
         return list(self.schemas["categories"].keys())
 
     def _prepare_db(self, documents) -> None:
-        for doc in documents:
-            if self.logger.doc_in(doc.stem):
-                continue
-            for variable in self.variables:
-                for value in self.schemas["categories"][variable]:
-                    self.logger.push_variable(doc.stem, variable, value)
-                self.logger.push_variable(doc.stem, variable, "ABSTAIN")
+        values = [(variable, value) for variable in self.variables
+                  for value in [*self.schemas["categories"][variable], "ABSTAIN"]]
+        with self.logger.transaction():
+            for i, doc in enumerate(documents):
+                if self.logger.doc_in(doc.stem):
+                    continue
+                self.logger.push_variables(doc.stem, values)
+                self._checkpoint(i)
+
+    def _checkpoint(self, i: int) -> None:
+        """Commit the open transaction after every `commit_every` documents."""
+        if (i + 1) % self.commit_every == 0:
+            self.logger.commit()
 
     def _var_type(self, variable: str) -> str:
         var_schema = self.schemas["categories"][variable]
         return var_schema if not isinstance(var_schema, list) else "categorical"
 
-    def run(self, documents: List[Path]) -> None:
+    def _extract_document(self, lf_obj: LabellingFunctionBase, document_name: str, text: str, pbar: Optional[tqdm] = None) -> None:
+        """Run a single labelling function over every variable of its type in a document."""
+        self.logger.push_document_text(document_name, text)
+        variables = [variable for variable in self.variables
+                     if lf_obj.type == self._var_type(variable)]
+        if not variables:
+            return
+        if pbar is not None:
+            pbar.set_description(
+                f"Extracting {len(variables)} variables: {lf_obj.labelling_method}")
+        lf_obj.extract_many(document_name, variables, text)
+
+    def _shared_groups(self) -> List[List[LabellingFunctionBase]]:
+        """
+        Group the registered labelling functions which share a model (see `LabellingFunctionBase.shared_models`),
+        so the model stays loaded, and its results are reused, across them.
+        Groups are ordered by their first labelling function, labelling functions sharing nothing are alone.
+
+        :return: List of labelling function groups.
+        """
+        groups: List[Tuple[Set[Hashable], List[LabellingFunctionBase]]] = []
+        for lf_obj in self.lfs:
+            keys = set(lf_obj.shared_models(self.model_path, self.device))
+            joined = [group for group in groups if group[0] & keys]
+            if not joined:
+                groups.append((keys, [lf_obj]))
+                continue
+            # a labelling function may join groups which didn't share a model until now
+            group_keys, members = joined[0]
+            for other in joined[1:]:
+                group_keys |= other[0]
+                members += other[1]
+                groups.remove(other)
+            group_keys |= keys
+            members.append(lf_obj)
+            members.sort(key=self.lfs.index)
+        return [members for _, members in groups]
+
+    def _resident_groups(self, memory_budget: Optional[float]) -> List[List[LabellingFunctionBase]]:
+        """
+        Group the registered labelling functions into sets which fit in memory together.
+        Groups are filled greedily in registration order, labelling functions sharing a model are kept together.
+
+        :param memory_budget: Memory (MB) available for loaded labelling functions. None keeps all resident.
+
+        :return: List of labelling function groups.
+        """
+        if memory_budget is None:
+            return [self.lfs] if self.lfs else []
+        groups = []
+        current, current_size = [], 0.0
+        for shared in self._shared_groups():
+            footprint = sum(lf_obj.memory_footprint for lf_obj in shared)
+            if current and current_size + footprint > memory_budget:
+                groups.append(current)
+                current, current_size = [], 0.0
+            current += shared
+            current_size += footprint
+        if current:
+            groups.append(current)
+        return groups
+
+    def _load_documents(self, documents: List[Path]) -> tqdm:
+        """Iterate over (path, text) of the documents, parsed by the ingestion workers."""
+        return tqdm(iter_documents(documents, workers=self.workers, prefetch=self.prefetch, cache=self.cache, pool=self._pool), total=len(documents))
+
+    def _run_group(self, group: List[LabellingFunctionBase], documents: List[Path]) -> None:
+        """Load a group of labelling functions, pass each document to all of them, then unload them."""
+        for lf_obj in group:
+            print(f"Loading Resources for LF: {lf_obj.labelling_method}")
+            lf_obj.load(self.model_path, self.device)
+        pbar = self._load_documents(documents)
+        with self.logger.transaction():
+            for i, (doc, text) in enumerate(pbar):
+                for lf_obj in group:
+                    self._extract_document(lf_obj, doc.stem, text, pbar)
+                self._checkpoint(i)
+        # free up memory from models and stuff
+        for lf_obj in group:
+            lf_obj.unload()
+
+    def _run_lf_major(self, documents: List[Path]) -> None:
+        for group in self._shared_groups():
+            print(f"Running LF: {', '.join(lf_obj.labelling_method for lf_obj in group)}")
+            self._run_group(group, documents)
+
+    def _run_document_major(self, documents: List[Path], memory_budget: Optional[float]) -> None:
+        for group in self._resident_groups(memory_budget):
+            self._run_group(group, documents)
+
+    def run(self, documents: List[Path], schedule: Literal["lf", "document"] = "lf", memory_budget: Optional[float] = None) -> None:
         """
         Run all labelling functions on the given documents.
 
         :param documents: List of paths to documents to be labelled.
+        :param schedule: "lf" runs each labelling function over the whole corpus in turn,
+            labelling functions sharing a model are run together so the model is only loaded (and run) once.
+            "document" loads each document once and passes it to every resident labelling function.
+        :param memory_budget: Only used by the "document" schedule. Memory (MB) available for resident
+            labelling functions, those which don't fit are run in further passes. None keeps all resident.
+
+        Each pass over the documents (one per labelling function, or group sharing a model, for "lf", one per resident group for "document")
+        loads every document again. The ingestion workers are kept for the whole run, but uncached PDFs are
+        parsed again on every pass, so set `cache_dir` when running several passes over PDFs.
 
         :return: None
         """
         self._prepare_db(documents)
 
-        lf_obj: Type[LabellingFunctionBase]
-        for lf_obj in self.lfs:
-            print(f"Running LF: {lf_obj.labelling_method}")
-            print("Loading Resources.")
-            lf_obj.load(self.model_path, self.device)
-            pbar = tqdm(documents)
-            for doc in pbar:
-                text = load_document(doc)
-                for variable in self.variables:
-                    if not lf_obj.type == self._var_type(variable):
-                        continue
-                    pbar.set_description(
-                        f"Extracting variable: {variable}")
-                    lf_obj.extract(doc.stem, variable, text)
-            # free up memory from models and stuff
-            del lf_obj
+        if self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            if schedule == "lf":
+                self._run_lf_major(documents)
+            elif schedule == "document":
+                self._run_document_major(documents, memory_budget)
+            else:
+                raise ValueError("schedule must be `lf` or `document`")
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+        # new extractions are scored by the models of the last sort, until the next sort refits them
+        score_unscored(self.logger.db)
 
     def get_validated_documents(self, variable: str, include_negatives: bool) -> List[Path]:
         document_names = self.logger.get_validated_document_names(
@@ -141,10 +278,15 @@ class Extractor:
                     data[variable] = extraction_set
             lf_obj.train(data)
 
-    def sort(self, method: Literal["weasul", "lr"], **kwargs):
+    def sort(self, method: Literal["weasul", "lr"], full: bool = False, **kwargs):
+        """
+        Update the confidence scores of the extractions with new validations or raw extractions.
+
+        :param method: Method scoring the extractions.
+        :param full: Rescore every extraction, not only those which changed.
+        """
         print("Updating confidence scores.")
-        update_confidence(self.logger.db, method=method, **kwargs)
-        learn_meta_classifier(self.logger.db, **kwargs)
+        rescore(self.logger.db, method=method, full=full, **kwargs)
 
     def performance(self, performance_type: Literal["agreement", "confidence"] = "agreement"):
         return performance(self.logger.db, performance_type)
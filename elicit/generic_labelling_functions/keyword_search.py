@@ -1,14 +1,76 @@
 """Script which searches for keywords (from a schema) in a document."""
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import spacy
+from spacy.language import Language
 from spacy.matcher import PhraseMatcher
+from spacy.tokens import Doc
 
 from elicit.interface import CategoricalLabellingFunction, Extraction
+from elicit.utils import text_hash
+from elicit.utils.utils import LRUCache
 
+# matching lowercase phrases only needs the tokenizer
+UNUSED_PIPES = ["tok2vec", "tagger", "parser", "senter",
+                "attribute_ruler", "lemmatizer", "ner"]
 
-def exact_match(doc: str, keywords: Dict[str, List[str]]) -> List[Tuple[str, Extraction]]:
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model: str = "en_core_web_sm") -> Language:
+    """
+    Load a spaCy pipeline without the components which aren't needed to match phrases.
+
+    :param model: Name of the spaCy pipeline.
+
+    :return: The pipeline.
+    """
+    return spacy.load(model, exclude=UNUSED_PIPES)
+
+
+def build_matcher(nlp: Language, keywords: Dict[str, Dict[str, List[str]]]) -> Tuple[PhraseMatcher, Dict[int, Tuple[str, str]]]:
+    """
+    Compile a single matcher for the keywords of every variable.
+
+    :param nlp: The spaCy pipeline.
+    :param keywords: The keywords to search for. Form is: {variable: {category: [keywords]}}
+
+    :return: The matcher, and a mapping of match ids to (variable, category).
+    """
+    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+    labels = {}
+    for variable, categories in keywords.items():
+        for category, phrases in categories.items():
+            key = f"{variable}::{category}"
+            matcher.add(key, list(nlp.tokenizer.pipe(phrases)))
+            labels[nlp.vocab.strings[key]] = (variable, category)
+    return matcher, labels
+
+
+def match_document(doc: Doc, matcher: PhraseMatcher, labels: Dict[int, Tuple[str, str]]) -> Dict[str, List[Extraction]]:
+    """
+    Match the keywords of every variable in a tokenised document.
+
+    :param doc: The tokenised document.
+    :param matcher: The compiled matcher.
+    :param labels: Mapping of match ids to (variable, category).
+
+    :return: The extractions of each variable, grouped by category in order of first match.
+    """
+    exact_matches: Dict[str, Dict[str, List[Tuple[int, int]]]] = {}
+    for match_id, start, end in matcher(doc):
+        variable, category = labels[match_id]
+        exact_matches.setdefault(variable, {}).setdefault(
+            category, []).append((start, end))
+    return {
+        variable: [Extraction.from_spacy(doc=doc, value=category, confidence=0.1, start=start, end=end)
+                   for category, spans in categories.items() for start, end in spans]
+        for variable, categories in exact_matches.items()
+    }
+
+
+def exact_match(doc: str, keywords: Dict[str, List[str]]) -> List[Extraction]:
     """
     Extracts the keywords from the document for a single field.
 
@@ -17,43 +79,42 @@ def exact_match(doc: str, keywords: Dict[str, List[str]]) -> List[Tuple[str, Ext
 
     :return: A list of CaseFields.
     """
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(doc)
-    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
-    for k in keywords.keys():
-        patterns = [nlp.make_doc(text) for text in keywords[k]]
-        matcher.add(k, patterns)
-    matches = matcher(doc)
-    exact_matches = {}
-    for match_id, start, end in matches:
-        match = doc.vocab.strings[match_id]
-        span = doc[start:end]
-        if match not in exact_matches:
-            exact_matches[match] = [(span.text, start, end)]
-        else:
-            exact_matches[match] += [(span.text, start, end)]
-    extractions = []
-    for match in exact_matches.keys():
-        for m in exact_matches[match]:
-            extractions.append(Extraction.from_spacy(
-                doc=doc, value=match, confidence=0.1, start=m[1], end=m[2]))
-    return extractions
+    nlp = load_tokenizer()
+    matcher, labels = build_matcher(nlp, {"field": keywords})
+    return match_document(nlp.make_doc(doc), matcher, labels).get("field", [])
 
 
 class KeywordMatchLF(CategoricalLabellingFunction):
     """
     Labelling function which searches for keywords (from a schema) in a document.
+    The keywords of all variables are matched in a single pass over each document.
     """
 
+    spacy_model = "en_core_web_sm"
+
     def __init__(self, schemas, logger, **kwargs):
         super().__init__(schemas, logger, **kwargs)
+        self.nlp: Optional[Language] = None
+        self.matcher: Optional[PhraseMatcher] = None
+        self.labels: Dict[int, Tuple[str, str]] = {}
+        # matches of the documents being extracted, shared by their variables
+        self._document_matches = LRUCache(4)
+
+    def _match(self, document_name: str, document_text: str) -> Dict[str, List[Extraction]]:
+        key = (document_name, text_hash(document_text))
+        matches = self._document_matches.get(key)
+        if matches is None:
+            matches = match_document(self.nlp.make_doc(
+                document_text), self.matcher, self.labels)
+            self._document_matches[key] = matches
+        return matches
 
     def extract(self, document_name: str, variable_name: str, document_text: str) -> str:
-        matches = exact_match(
-            document_text,
-            self.get_schema("keywords", variable_name)
-        )
-        self.push_many(document_name, variable_name, matches)
+        # raises for variables missing from the keywords schema
+        self.get_schema("keywords", variable_name)
+        matches = self._match(document_name, document_text)
+        self.push_many(document_name, variable_name,
+                       matches.get(variable_name, []))
 
     @property
     def labelling_method(self):
@@ -63,5 +124,13 @@ class KeywordMatchLF(CategoricalLabellingFunction):
         pass
 
     def load(self, model_directory: Path, device: Union[int, str]):
+        self.nlp = load_tokenizer(self.spacy_model)
+        self.matcher, self.labels = build_matcher(
+            self.nlp, self.get_schema("keywords"))
         self.loaded = True
-        pass
+
+    def unload(self) -> None:
+        self.matcher = None
+        self.labels = {}
+        self._document_matches.clear()
+        super().unload()
@@ -7,7 +7,7 @@ from transformers import pipeline
 
 from elicit.interface import CategoricalLabellingFunction
 
-from elicit.utils.utils import split_doc
+from elicit.utils.chunking import chunk_characters
 
 unmasker = pipeline('fill-mask', model='bert-base-uncased')
 
@@ -18,9 +18,9 @@ def mask_variable(doc: str, masks: List[str], threshold: float = 0.3) -> List[Do
     norm = 0
     for mask in masks:
         mask_length = len(mask)
-        for sentence in split_doc(doc, max_length= 512 - (mask_length + 1)):
+        for chunk in chunk_characters(doc, max_length=512 - (mask_length + 1), separators=["."]):
             norm += 1
-            sentence = sentence + " " + mask
+            sentence = chunk.text + " " + mask
             unmasker_output = unmasker(sentence)
             for output in unmasker_output:
                 if output["score"] < threshold:
@@ -12,8 +12,11 @@ from typing import DefaultDict, Dict, List, Optional, Tuple, Union
 import warnings
 
 from elicit.interface import CategoricalLabellingFunction, Extraction
-from elicit.generic_labelling_functions.qa_transformer import RobertaForQuestionAnsweringWithNegatives, extract_answers, load_qa_model, train_qa
+from elicit.generic_labelling_functions.qa_transformer import RobertaForQuestionAnsweringWithNegatives, SharedQAMixin, train_qa
 from elicit.utils.dl_utils import QADataset, SequenceDataset
+from elicit.utils.profiles import PROFILES, ModelProfile, get_profile, quantize
+from elicit.utils.registry import ModelRegistry
+from elicit.utils.utils import LRUCache
 
 from tqdm.auto import tqdm
 
@@ -43,7 +46,46 @@ def compress(candidates: List[Tuple[str, float, int, int]]) -> Dict[str, float]:
     return {k: v / prob_sum for k, v in prob_dict.items()}, max_context
 
 
-def match_classify(answers: List[Tuple[str, float]], document_text: str, levels: List[str], classification_model: Pipeline, filter_threshold: float, threshold: float) -> Tuple[str, float]:
+def classify_answers(answers: List[str], levels: List[str], classification_model: Pipeline, batch_size: int = 16, cache: Optional[LRUCache] = None) -> Dict[str, List[Tuple[str, float]]]:
+    """
+    Zero-shot classify answers against the levels of a variable (and the empty level).
+    Identical answers are classified once, and the (answer, level) pairs of every answer go through the model together.
+
+    :param answers: Answers from the Q&A Transformer.
+    :param levels: List of levels for the variable.
+    :param classification_model: The zero-shot classification pipeline.
+    :param batch_size: Number of (answer, level) pairs passed through the model at once.
+    :param cache: Cache of (answer, labels) scores, kept across documents.
+
+    :return: Dictionary of answer: [(label, score)], best label first.
+    """
+    labels = (*levels, "")
+    cache = cache if cache is not None else {}
+    scores = {}
+    missing = []
+    for answer in dict.fromkeys(answers):
+        found = cache.get((answer, labels))
+        if found is None:
+            missing.append(answer)
+        else:
+            scores[answer] = found
+    if missing:
+        outputs = classification_model(
+            missing,
+            list(labels),
+            multi_label=True,
+            batch_size=batch_size
+        )
+        # a single sequence isn't wrapped in a list
+        if isinstance(outputs, dict):
+            outputs = [outputs]
+        for answer, output in zip(missing, outputs):
+            scores[answer] = list(zip(output["labels"], output["scores"]))
+            cache[(answer, labels)] = scores[answer]
+    return scores
+
+
+def match_classify(answers: List[Tuple[str, float]], document_text: str, levels: List[str], classification_model: Pipeline, filter_threshold: float, threshold: float, batch_size: int = 16, cache: Optional[LRUCache] = None) -> Tuple[str, float]:
     """
     Match answers from the Q&A Transformer to the levels of the variable.
 
@@ -51,21 +93,20 @@ def match_classify(answers: List[Tuple[str, float]], document_text: str, levels:
     :param doc: Document string.
     :param levels: List of levels for the variable.
     :param threshold: Threshold for the Q&A Transformer. Only answers above this threshold are considered.
+    :param batch_size: Number of (answer, level) pairs passed through the classification model at once.
+    :param cache: Cache of (answer, labels) scores, kept across documents.
 
     :return: Tuple of the matched level and the confidence of the match.
     """
+    scores = classify_answers([answer for answer, *_ in answers if answer not in levels],
+                              levels, classification_model, batch_size, cache)
     candidates = []
     for answer, score, start, end in answers:
         if answer in levels:
             candidates.append((answer, score, start, end))
         else:
-            output = classification_model(
-                answer,
-                [*levels, ""],
-                multi_label=True
-            )
-            candidates += [(output["labels"][i], output["scores"][i] * score, start, end)
-                           for i in range(len(output["labels"])) if output["scores"][i] > filter_threshold]
+            candidates += [(label, label_score * score, start, end)
+                           for label, label_score in scores[answer] if label_score > filter_threshold]
     if not candidates:
         return [Extraction.abstain()]
     candidates = [(cat, sc, st, end)
@@ -90,6 +131,31 @@ def match_classify(answers: List[Tuple[str, float]], document_text: str, levels:
         return extractions
 
 
+def match_classify_many(answers: Dict[str, List[Tuple[str, float, int, int]]], document_text: str, levels: Dict[str, List[str]], classification_model: Pipeline, filter_threshold: float, threshold: float, batch_size: int = 16, cache: Optional[LRUCache] = None) -> Dict[str, List[Extraction]]:
+    """
+    Match the answers of many variables to their levels, classifying the answers of variables
+    which share levels in the same batches.
+
+    :param answers: Answers from the Q&A Transformer. Form is: {variable: [(answer, score, start, end)]}
+    :param document_text: Document string.
+    :param levels: Levels of each variable.
+    :param batch_size: Number of (answer, level) pairs passed through the classification model at once.
+    :param cache: Cache of (answer, labels) scores, kept across documents.
+
+    :return: Dictionary of variable: extractions.
+    """
+    cache = cache if cache is not None else {}
+    label_sets = DefaultDict(list)
+    for variable in answers:
+        label_sets[tuple(levels[variable])].append(variable)
+    for label_set, variables in label_sets.items():
+        classify_answers([answer for variable in variables for answer, *_ in answers[variable] if answer not in label_set],
+                         list(label_set), classification_model, batch_size, cache)
+    return {variable: match_classify(variable_answers, document_text, levels[variable], classification_model,
+                                     filter_threshold, threshold, batch_size, cache)
+            for variable, variable_answers in answers.items()}
+
+
 class BartForSequenceClassificationWithNegatives(BartForSequenceClassification):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -193,74 +259,105 @@ class BartForSequenceClassificationWithNegatives(BartForSequenceClassification):
         )
 
 
-def load_seq_model(model_directory: str) -> tuple[RobertaForQuestionAnsweringWithNegatives, BartTokenizerFast]:
-    if (model_directory / "seq_model").exists():
+def load_seq_model(model_directory: str, profile: ModelProfile = PROFILES["default"]) -> tuple[RobertaForQuestionAnsweringWithNegatives, BartTokenizerFast]:
+    tokenizer = BartTokenizerFast.from_pretrained(
+        profile.seq_checkpoint)
+    fine_tuned = profile.fine_tuned(model_directory, "seq_model")
+    if fine_tuned.exists():
         print("Fine tuned Sequence Classifier model found, loading...")
-        tokenizer = BartTokenizerFast.from_pretrained(
-            "facebook/bart-large-mnli")
         model = BartForSequenceClassificationWithNegatives.from_pretrained(
-            model_directory / "seq_model")
+            fine_tuned)
     else:
-        print("No fine tuned Sequence Classifier model found, loading generic model...")
-        tokenizer = BartTokenizerFast.from_pretrained(
-            "facebook/bart-large-mnli")
+        print(f"No fine tuned Sequence Classifier model found, loading generic model ({profile.seq_checkpoint})...")
         model = BartForSequenceClassificationWithNegatives.from_pretrained(
-            "facebook/bart-large-mnli")
+            profile.seq_checkpoint)
+    if profile.quantize:
+        model = quantize(model)
     return model, tokenizer
 
 
-class NLILabellingFunction(CategoricalLabellingFunction):
-    def __init__(self, schemas, logger, **kwargs):
+class NLILabellingFunction(SharedQAMixin, CategoricalLabellingFunction):
+    def __init__(self, schemas, logger, qa_batch_size: int = 16, chunk_stride: int = 64, model_registry: Optional[ModelRegistry] = None, classification_batch_size: int = 16, classification_cache_size: int = 65536, model_profile: Union[str, ModelProfile] = "default", **kwargs):
+        """
+        :param qa_batch_size: Number of (question, chunk) pairs passed through the Q&A model at once.
+        :param chunk_stride: Number of tokens consecutive windows of a document overlap by.
+        :param model_registry: Registry sharing the Q&A model, and its answers, with other labelling functions.
+        :param classification_batch_size: Number of (answer, level) pairs passed through the classification model at once.
+        :param classification_cache_size: Number of (answer, labels) classifications kept across documents.
+        :param model_profile: Profile (see `elicit.utils.profiles`) of the Q&A and classification models, e.g. "distilled-quantized" on the CPU.
+        """
         super().__init__(schemas, logger, **kwargs)
         self.match_threshold = 0.5
         self.qna_threshold = 0.1
+        self.qa_batch_size = qa_batch_size
+        self.chunk_stride = chunk_stride
+        self.model_registry = model_registry or ModelRegistry()
+        self.classification_batch_size = classification_batch_size
+        self.model_profile = get_profile(model_profile)
+        # answers such as "the defendant" recur across documents
+        self.classification_cache = LRUCache(classification_cache_size)
 
     def load(self, model_directory: Path, device: Union[int, str]) -> None:
         self.device = device
         self.model_directory = model_directory
-        self.seq_model, self.seq_tokenizer = load_seq_model(model_directory)
-        self.qna_model, self.qna_tokenizer = load_qa_model(model_directory)
-        self.qna_pipeline = pipeline(
-            task='question-answering',
-            model=self.qna_model,
-            tokenizer=self.qna_tokenizer,
-            device=device
-        )
+        self.seq_model, self.seq_tokenizer = load_seq_model(
+            model_directory, self.model_profile)
+        self._load_qa(model_directory, device)
         self.classifier = pipeline(
             task='zero-shot-classification',
             model=self.seq_model,
             tokenizer=self.seq_tokenizer,
-            device=device
+            # quantised models only run on the CPU
+            device=-1 if self.model_profile.quantize else device
         )
         self.loaded = True
 
+    def unload(self) -> None:
+        self.seq_model = self.seq_tokenizer = self.classifier = None
+        self._unload_qa()
+        super().unload()
+
+    @property
+    def memory_footprint(self) -> float:
+        return self.model_profile.qa_footprint + self.model_profile.seq_footprint
+
     def extract(self, document_name: str, variable_name: str, document_text: str) -> None:
-        questions = self.get_schema("questions", variable_name)
-        categories = self.get_schema("categories", variable_name)
+        self.extract_many(document_name, [variable_name], document_text)
+
+    def extract_many(self, document_name: str, variables: List[str], document_text: str) -> None:
         final_threshold = 0.1
-        answers = extract_answers(
-            document_text,
-            questions=questions,
-            qna_model=self.qna_pipeline,
-            threshold=self.qna_threshold
-        )
-        extractions = match_classify(
+        answers = self._answers(document_text, variables)
+        extractions = match_classify_many(
             answers=answers,
             document_text=document_text,
-            levels=categories,
+            levels={variable_name: self.get_schema("categories", variable_name)
+                    for variable_name in variables},
             classification_model=self.classifier,
             filter_threshold=self.match_threshold,
-            threshold=final_threshold)
-        self.push_many(document_name, variable_name, extractions)
+            threshold=final_threshold,
+            batch_size=self.classification_batch_size,
+            cache=self.classification_cache)
+        for variable_name in variables:
+            self.push_many(document_name, variable_name,
+                           extractions[variable_name])
 
     def train(self, data: dict[str, List["Extraction"]]):
+        if self.model_profile.quantize:
+            raise ValueError(
+                "Quantised models can't be fine-tuned, train with the unquantised profile, whose fine-tuned weights quantised profiles load.")
         print("Training Q&A model")
         qa_dataset = QADataset(data, self.get_schema(
             "questions"), self.qna_tokenizer)
         self.qna_model = train_qa(qa_dataset, self.qna_model, self.device)
-        print(f"Saving Trained Model to {self.model_directory / 'qna_model'}")
-        self.qna_model.save_pretrained(self.model_directory / "qna_model")
+        qna_directory = self.model_profile.fine_tuned(
+            self.model_directory, "qna_model")
+        print(f"Saving Trained Model to {qna_directory}")
+        self.qna_model.save_pretrained(qna_directory)
+        # answers of the previous model are stale
+        self.model_registry.invalidate(self.qa_key)
         print("Training Seq. Classification Model")
+        seq_directory = self.model_profile.fine_tuned(
+            self.model_directory, "seq_model")
         for var in data.keys():
             dataset = SequenceDataset(data[var], self.get_schema(
                 "categories", var), self.classifier.tokenizer)
@@ -270,7 +367,7 @@ class NLILabellingFunction(CategoricalLabellingFunction):
             train_set, val_set = torch.utils.data.random_split(
                 dataset, [N - (N // 10), N // 10])
             training_args = TrainingArguments(
-                output_dir=self.model_directory / 'seq_model',
+                output_dir=seq_directory,
                 num_train_epochs=3,              # total number of training epochs
                 per_device_train_batch_size=16,  # batch size per device during training
                 per_device_eval_batch_size=64,   # batch size for evaluation
@@ -287,8 +384,9 @@ class NLILabellingFunction(CategoricalLabellingFunction):
             )
             trainer.train()
             print(
-                f"Saving Trained Model to {self.model_directory / 'seq_model'}")
-        self.seq_model.save_pretrained(self.model_directory / "seq_model")
+                f"Saving Trained Model to {seq_directory}")
+        self.seq_model.save_pretrained(seq_directory)
+        self.classification_cache.clear()
 
     @property
     def labelling_method(self) -> str:
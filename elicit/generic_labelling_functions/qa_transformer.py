@@ -1,11 +1,12 @@
 """Script to extract answers from a document using a Q&A Transformer model."""
 from transformers import Pipeline, RobertaTokenizerFast
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
 import itertools
 import warnings
 
-from transformers import Pipeline, RobertaForQuestionAnswering, RobertaTokenizer, get_linear_schedule_with_warmup
+from transformers import Pipeline, RobertaForQuestionAnswering, RobertaTokenizer, get_linear_schedule_with_warmup, pipeline
 from transformers.modeling_outputs import QuestionAnsweringModelOutput
 from transformers.pipelines.question_answering import MODEL_FOR_QUESTION_ANSWERING_MAPPING
 import torch
@@ -15,7 +16,11 @@ from tqdm.auto import tqdm
 
 from elicit.interface import Extraction
 from elicit.utils.loading import load_schema
+from elicit.utils.chunking import TokenChunker, chunk_characters
 from elicit.utils.dl_utils import QADataset
+from elicit.utils.profiles import PROFILES, ModelProfile, quantize
+from elicit.utils.registry import ModelRegistry
+from elicit.utils.utils import text_hash
 
 warnings.filterwarnings("ignore")
 
@@ -48,52 +53,22 @@ def _filter_candidates(answers: List[dict], threshold: float = 0.5) -> str:
     return [(a["answer"], a["score"], a["start"], a["end"]) for a in answers if a["score"] > threshold]
 
 
-def split_question(question: str, context: str, max_length: int = 512) -> Tuple[List[dict[str, str]], int]:
-    if len(context) < max_length:
-        return [{"question": question, "context": context}]
-    else:
-        contexts = []
-        while len(context) > max_length:
-            idx = max(context[:max_length].rfind(i) for i in [".", "\n"])
-            if idx == -1:
-                idx = max_length
-            contexts.append(context[:idx])
-            context = context[idx:]
-        contexts.append(context)
-        return [{"question": question, "context": c} for c in contexts]
-
-
 def split_context(context: str, max_length: int = 512, min_length: int = 100) -> List[Tuple[str, int]]:
     """
-    Split a context into max_length (or smaller) chunks. Splitting on periods or commas.
+    Split a context into max_length (or smaller) character chunks. Splitting on periods or commas.
     Additionally, returns the start index of the chunk in the original context.
+    Used when no tokenizer is available, see `TokenChunker`.
 
     :param context: Context to split.
     :param max_length: Maximum length of each chunk.
+    :param min_length: Minimum length of a chunk ending at a period or comma.
 
     :return: List of tuples of (chunk, start_index).
-
     """
-    if len(context) < max_length:
-        return [(context, 0)]
-    else:
-        contexts = []
-        start = 0
-        while len(context) > max_length:
-            idx = max(context[:max_length].rfind(i)
-                      for i in [".", ",", "\n"])
-            if idx < min_length:
-                idx = max_length
-            contexts.append((context[:idx], start))
-            context = context[idx:]
-            start += idx
-        contexts.append((context, start))
-    # contexts = [(context[start_idx:end_idx], start_idx) for start_idx, end_idx in zip(
-    #     range(0, len(context), max_length), range(max_length, len(context), max_length))]
-    return contexts
-
-
-def extract_answers(document_text: str, questions: List[str], qna_model: Pipeline, topk: int = 5, threshold: float = 0.3) -> Dict[str, Tuple[str, float, int, int]]:
+    return [(chunk.text, chunk.start) for chunk in chunk_characters(context, max_length, min_length)]
+
+
+def extract_answers(document_text: str, questions: List[str], qna_model: Pipeline, topk: int = 5, threshold: float = 0.3, batch_size: int = 16, chunker: Optional[TokenChunker] = None) -> Dict[str, Tuple[str, float, int, int]]:
     """
     Extract answers from a document using a Q&A Transformer model.
 
@@ -101,18 +76,100 @@ def extract_answers(document_text: str, questions: List[str], qna_model: Pipelin
     :param questions: List of questions to extract answers for.
     :param topk: Number of answers to return.
     :param threshold: Threshold for filtering.
+    :param batch_size: Number of (question, chunk) pairs passed through the model at once.
+    :param chunker: Splits documents into token windows, documents are split into character chunks if None.
 
     :return: Dictionary of answers.
     """
-    results = []
-    for c, start in split_context(document_text):
-        local_questions = [{"question": question, "context": c}
-                           for question in questions]
-        res = qna_model(local_questions, top_k=topk)
-        res = _flatten_answers(res)
-        results += [{"answer": r["answer"], "score": r["score"], "start": r["start"] +
-                     start, "end": r["end"] + start} for r in res]
-    return _filter_candidates(results, threshold=threshold)
+    return extract_answers_many(document_text, {None: questions}, qna_model, topk, threshold, batch_size, chunker)[None]
+
+
+def extract_answers_many(document_text: str, questions: Dict[str, List[str]], qna_model: Pipeline, topk: int = 5, threshold: float = 0.3, batch_size: int = 16, chunker: Optional[TokenChunker] = None) -> Dict[str, List[Tuple[str, float, int, int]]]:
+    """
+    Extract answers for the questions of many variables from a document, splitting the document once
+    and passing every (question, chunk) pair to the Q&A Transformer model together.
+
+    :param document_text: Text Document to extract answers from.
+    :param questions: Questions to extract answers for. Form is: {variable: [questions]}
+    :param topk: Number of answers to return.
+    :param threshold: Threshold for filtering.
+    :param batch_size: Number of (question, chunk) pairs passed through the model at once.
+    :param chunker: Splits documents into token windows, documents are split into character chunks if None.
+
+    :return: Dictionary of variable: answers.
+    """
+    return extract_answers_documents([document_text], questions, qna_model, topk, threshold, batch_size, chunker)[0]
+
+
+def extract_answers_documents(document_texts: List[str], questions: Dict[str, List[str]], qna_model: Pipeline, topk: int = 5, threshold: float = 0.3, batch_size: int = 16, chunker: Optional[TokenChunker] = None) -> List[Dict[str, List[Tuple[str, float, int, int]]]]:
+    """
+    Extract answers for the questions of many variables from many documents,
+    passing the (question, chunk) pairs of every document through the model in the same batches.
+
+    :param document_texts: Text Documents to extract answers from.
+    :param questions: Questions to extract answers for. Form is: {variable: [questions]}
+    :param topk: Number of answers to return.
+    :param threshold: Threshold for filtering.
+    :param batch_size: Number of (question, chunk) pairs passed through the model at once.
+    :param chunker: Splits documents into token windows, documents are split into character chunks if None.
+
+    :return: Dictionary of variable: answers, for each document.
+    """
+    inputs, owners = [], []
+    for document, document_text in enumerate(document_texts):
+        chunks = chunker.chunks(document_text) if chunker is not None \
+            else chunk_characters(document_text)
+        for chunk in chunks:
+            for variable, variable_questions in questions.items():
+                inputs += [{"question": question, "context": chunk.text}
+                           for question in variable_questions]
+                owners += [(document, variable, chunk.start)] * \
+                    len(variable_questions)
+    results = [{variable: {} for variable in questions}
+               for _ in document_texts]
+    for (document, variable, start), answers in zip(owners, answer_questions(inputs, qna_model, topk, batch_size, chunker)):
+        for r in answers:
+            # offsets are relative to the chunk, overlapping windows may find the same answer
+            span = (r["start"] + start, r["end"] + start)
+            found = results[document][variable].get(span)
+            if found is None or found["score"] < r["score"]:
+                results[document][variable][span] = {"answer": r["answer"], "score": r["score"],
+                                                     "start": span[0], "end": span[1]}
+    return [{variable: _filter_candidates(list(answers.values()), threshold=threshold) for variable, answers in result.items()}
+            for result in results]
+
+
+def answer_questions(inputs: List[Dict[str, str]], qna_model: Pipeline, topk: int = 5, batch_size: int = 16, chunker: Optional[TokenChunker] = None) -> List[List[dict]]:
+    """
+    Answer (question, context) pairs with a Q&A pipeline.
+    Pairs are sorted by length so each batch holds pairs of similar size, reducing padding,
+    and the answers are returned in the order of the inputs.
+
+    :param inputs: List of {"question": question, "context": context}.
+    :param qna_model: The Q&A pipeline.
+    :param topk: Number of answers per pair.
+    :param batch_size: Number of pairs passed through the model at once.
+    :param chunker: Chunker the contexts were windowed by. The pipeline is given its budget, so it doesn't
+        split the windows again (by default the pipeline splits contexts into 384 token features).
+
+    :return: List of answers for each pair.
+    """
+    if not inputs:
+        return []
+    order = sorted(range(len(inputs)), key=lambda i: len(
+        inputs[i]["question"]) + len(inputs[i]["context"]))
+    window_kwargs = {} if chunker is None else {"max_seq_len": chunker.max_length,
+                                                "max_question_len": chunker.question_tokens,
+                                                "doc_stride": chunker.stride}
+    res = qna_model([inputs[i] for i in order],
+                    top_k=topk, batch_size=batch_size, **window_kwargs)
+    # a single input, or a single answer for an input, isn't wrapped in a list
+    if len(inputs) == 1:
+        res = [res]
+    answers = [None] * len(inputs)
+    for i, r in zip(order, res):
+        answers[i] = [r] if isinstance(r, dict) else r
+    return answers
 
 
 class RobertaForQuestionAnsweringWithNegatives(RobertaForQuestionAnswering):
@@ -218,19 +275,115 @@ def train_qa(dataset: QADataset, qna_model: RobertaForQuestionAnsweringWithNegat
     return qna_model
 
 
-def load_qa_model(model_directory: str) -> tuple[RobertaForQuestionAnsweringWithNegatives, RobertaTokenizerFast]:
-    if (model_directory / "qna_model").exists():
+def load_qa_model(model_directory: str, profile: ModelProfile = PROFILES["default"]) -> tuple[RobertaForQuestionAnsweringWithNegatives, RobertaTokenizerFast]:
+    MODEL_FOR_QUESTION_ANSWERING_MAPPING["neg_roberta"] = "RobertaForQuestionAnsweringWithNegatives"
+    qna_tokenizer = RobertaTokenizerFast.from_pretrained(
+        profile.qa_checkpoint)
+    fine_tuned = profile.fine_tuned(model_directory, "qna_model")
+    if fine_tuned.exists():
         print("Fine tuned Q&A model found, loading...")
-        MODEL_FOR_QUESTION_ANSWERING_MAPPING["neg_roberta"] = "RobertaForQuestionAnsweringWithNegatives"
-        qna_tokenizer = RobertaTokenizerFast.from_pretrained(
-            "deepset/roberta-base-squad2")
         qna_model = RobertaForQuestionAnsweringWithNegatives.from_pretrained(
-            model_directory / "qna_model")
+            fine_tuned)
     else:
-        print("No fine tuned Q&A model found, loading generic model...")
-        MODEL_FOR_QUESTION_ANSWERING_MAPPING["neg_roberta"] = "RobertaForQuestionAnsweringWithNegatives"
-        qna_tokenizer = RobertaTokenizerFast.from_pretrained(
-            "deepset/roberta-base-squad2")
+        print(f"No fine tuned Q&A model found, loading generic model ({profile.qa_checkpoint})...")
         qna_model = RobertaForQuestionAnsweringWithNegatives.from_pretrained(
-            "deepset/roberta-base-squad2")
+            profile.qa_checkpoint)
+    if profile.quantize:
+        qna_model = quantize(qna_model)
     return qna_model, qna_tokenizer
+
+
+@dataclass
+class QAModel:
+    """Q&A model of a checkpoint, with its pipeline and document chunker."""
+    model: RobertaForQuestionAnsweringWithNegatives
+    tokenizer: RobertaTokenizerFast
+    pipeline: Pipeline
+    chunker: TokenChunker
+
+
+def load_qa_pipeline(model_directory: Path, device: Union[int, str], chunk_stride: int = 64, profile: ModelProfile = PROFILES["default"]) -> QAModel:
+    """
+    Load the (fine-tuned) Q&A model with its pipeline and chunker.
+
+    :param model_directory: Directory where (fine-tuned) models are stored.
+    :param device: Device to run the model on.
+    :param chunk_stride: Number of tokens consecutive windows of a document overlap by.
+    :param profile: Model profile to load.
+
+    :return: The Q&A model.
+    """
+    qna_model, qna_tokenizer = load_qa_model(model_directory, profile)
+    if profile.quantize:
+        # quantised models only run on the CPU
+        device = -1
+    qna_pipeline = pipeline(
+        task='question-answering',
+        model=qna_model,
+        tokenizer=qna_tokenizer,
+        device=device
+    )
+    return QAModel(qna_model, qna_tokenizer, qna_pipeline, TokenChunker(qna_tokenizer, stride=chunk_stride))
+
+
+class SharedQAMixin:
+    """
+    Mixin for labelling functions which answer the questions schema with the Q&A model.
+    The model is acquired from a model registry, so labelling functions using the same checkpoint share it,
+    and the answers for a (document, variable) are memoised in the registry, so they're only computed once.
+    The extractor runs labelling functions sharing the model over each document together (see `shared_models`),
+    so the memo only has to hold the answers of the current document.
+    Expects `model_registry`, `model_profile`, `chunk_stride`, `qna_threshold` and `qa_batch_size` attributes.
+    """
+
+    model_registry: ModelRegistry
+    qa_key: Optional[Hashable] = None
+
+    def _qa_model_key(self, model_directory: Path, device: Union[int, str]) -> Hashable:
+        return ("qa", str(model_directory), device, self.chunk_stride, self.model_profile)
+
+    def shared_models(self, model_directory: Path, device: Union[int, str]) -> Set[Hashable]:
+        return {self._qa_model_key(model_directory, device)}
+
+    def _load_qa(self, model_directory: Path, device: Union[int, str]) -> None:
+        self.qa_key = self._qa_model_key(model_directory, device)
+        qa = self.model_registry.acquire(self.qa_key, lambda: load_qa_pipeline(
+            model_directory, device, self.chunk_stride, self.model_profile))
+        self.qna_model, self.qna_tokenizer = qa.model, qa.tokenizer
+        self.qna_pipeline, self.qna_chunker = qa.pipeline, qa.chunker
+
+    def _unload_qa(self) -> None:
+        if self.qa_key is not None:
+            self.model_registry.release(self.qa_key)
+        self.qna_model = self.qna_tokenizer = self.qna_pipeline = self.qna_chunker = None
+
+    def _answers(self, document_text: str, variables: List[str]) -> Dict[str, List[Tuple[str, float, int, int]]]:
+        """
+        Answers to the questions of each variable, only computing those which aren't memoised.
+
+        :param document_text: Text of the document.
+        :param variables: The variables.
+
+        :return: Dictionary of variable: answers.
+        """
+        document_hash = text_hash(document_text)
+        questions = {variable: self.get_schema("questions", variable)
+                     for variable in variables}
+        keys = {variable: (self.qa_key, ("answers", document_hash, variable, tuple(variable_questions), self.qna_threshold))
+                for variable, variable_questions in questions.items()}
+        answers = {variable: self.model_registry.results.get(keys[variable])
+                   for variable in variables}
+        missing = {variable: questions[variable]
+                   for variable, found in answers.items() if found is None}
+        if missing:
+            answers.update(extract_answers_many(
+                document_text,
+                questions=missing,
+                qna_model=self.qna_pipeline,
+                threshold=self.qna_threshold,
+                batch_size=self.qa_batch_size,
+                chunker=self.qna_chunker
+            ))
+            for variable in missing:
+                self.model_registry.results[keys[variable]] = answers[variable]
+        return answers
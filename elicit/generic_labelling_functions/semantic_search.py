@@ -1,71 +1,102 @@
 """Script to extract answers from a document using a Sentence Similarity Transformer model trained on Q&A pairs."""
 from pathlib import Path
-from typing import Union
-from sentence_transformers import SentenceTransformer, util
+from typing import Optional, Union
+import numpy as np
+from sentence_transformers import SentenceTransformer
 from elicit.interface import CategoricalLabellingFunction, Extraction
+from elicit.utils import text_hash
+from elicit.utils.embeddings import EmbeddingCache, model_identity
+from elicit.utils.sentence_index import SentenceIndex
+from elicit.utils.utils import LRUCache
 
-def sentence_similarities(queries: list[str], sentences: list[str], model: SentenceTransformer, k: int = 5) -> dict[str, float]:
+def sentence_similarities(queries: list[str], sentences: list[str], model: SentenceTransformer, k: int = 5, sentence_embeddings: Optional[np.ndarray] = None, query_embeddings: Optional[np.ndarray] = None) -> dict[str, float]:
     """
-    Get the similarity score of each sentence in the document to each query.
+    Get the similarity score of each sentence in the document to each query,
+    averaged over the queries. Scores of repeated sentences are summed.
 
     :param queries: The queries to compare to the document.
     :param sentences: The sentences to compare to the queries.
     :param k: The number of sentences to return.
+    :param sentence_embeddings: Embeddings of the sentences, if already encoded.
+    :param query_embeddings: Embeddings of the queries, if already encoded.
 
     :return: Dictionary of sentence: score.
     """
-    #Encode query and documents
-    sentence_scores = {}
-    for query in queries:
-        query_emb = model.encode(query)
-        doc_emb = model.encode(sentences)
-
-        #Compute dot score between query and all document embeddings
-        scores = util.dot_score(query_emb, doc_emb)[0].cpu().tolist()
-
-        #Combine docs & scores
-        doc_score_pairs = list(zip(sentences, scores))
-
-        for sentence, score in doc_score_pairs:
-            if sentence in sentence_scores:
-                sentence_scores[sentence] += score
-            else:
-                sentence_scores[sentence] = score
-    for sentence in sentence_scores:
-        sentence_scores[sentence] /= len(queries)
-    return dict(sorted(sentence_scores.items(), key=lambda x: x[1], reverse=True)[:k])
-
-def doc_similarities(queries: list[str], doc: str, model: SentenceTransformer) -> dict[str, float]:
+    if sentence_embeddings is None:
+        sentence_embeddings = model.encode(sentences)
+    if query_embeddings is None:
+        query_embeddings = model.encode(queries)
+    # dot score between all queries and all sentences, in one multiply
+    scores = (np.asarray(query_embeddings) @ np.asarray(sentence_embeddings).T).mean(axis=0)
+    unique = {}
+    positions = np.fromiter((unique.setdefault(sentence, len(unique)) for sentence in sentences),
+                            dtype=np.int64, count=len(sentences))
+    totals = np.bincount(positions, weights=scores, minlength=len(unique))
+    unique_sentences = list(unique)
+    # stable, so ties keep document order
+    top = np.argsort(-totals, kind="stable")[:k]
+    return {unique_sentences[i]: float(totals[i]) for i in top}
+
+def split_sentences(doc: str) -> list[str]:
+    """
+    :param doc: The document to split.
+
+    Returns the sentences of the document.
+    """
+    return doc.split(".") # should find a better way to split sentences - this is very basic
+
+
+def sentence_spans(sentences: list[str]) -> list[tuple[int, int]]:
+    """
+    :param sentences: The sentences of a document, from `split_sentences`.
+
+    Returns the start and end index of each sentence in the document.
+    """
+    spans = []
+    start = 0
+    for sentence in sentences:
+        spans.append((start, start + len(sentence)))
+        start += len(sentence) + 1
+    return spans
+
+
+def doc_similarities(queries: list[str], doc: str, model: SentenceTransformer, sentence_embeddings: Optional[np.ndarray] = None) -> dict[str, float]:
     """
     :param query: The query to compare to the document.
     :param doc: The document to compare to the query.
+    :param sentence_embeddings: Embeddings of the document's sentences, if already encoded.
 
     Returns the most similar sentence and its similarity score.
     """
-    sentences = doc.split(".") # should find a better way to split sentences - this is very basic
-    return sentence_similarities(queries, sentences, model)
+    sentences = split_sentences(doc)
+    return sentence_similarities(queries, sentences, model, sentence_embeddings=sentence_embeddings)
 
 
-def match_levels(sentence_score: dict[str, float], levels: list[str], model: SentenceTransformer, threshold: float) -> tuple[str, str, float]:
+def match_levels(sentence_score: dict[str, float], levels: list[str], model: SentenceTransformer, threshold: float, sentence_embeddings: Optional[np.ndarray] = None, level_embeddings: Optional[np.ndarray] = None) -> tuple[str, str, float]:
     """
     Find closest level to a sentence, must pass threshold.
 
     :param sentence_score: Dictionary of sentence: score.
     :param levels: List of levels to search for.
     :param threshold: Threshold for filtering.
+    :param sentence_embeddings: Embeddings of the sentences in `sentence_score`, if already encoded.
+    :param level_embeddings: Embeddings of the levels, if already encoded.
 
     :return: Tuple of level, sentence, score.
     """
-    sentences = []
-    scores = []
-    found_levels = []
-    for sentence, score in sentence_score.items():
-        level, level_score = sentence_similarities([sentence], levels, model, k=1).popitem()
-        if level_score * score > threshold:
-            sentences.append(sentence)
-            found_levels.append(level)
-            scores.append(level_score * score)
-    return found_levels, sentences, scores
+    if not sentence_score:
+        return [], [], []
+    sentences = list(sentence_score)
+    if sentence_embeddings is None:
+        sentence_embeddings = model.encode(sentences)
+    if level_embeddings is None:
+        level_embeddings = model.encode(levels)
+    level_scores = np.asarray(sentence_embeddings) @ np.asarray(level_embeddings).T
+    best = level_scores.argmax(axis=1)
+    scores = level_scores[np.arange(len(sentences)), best] * np.fromiter(
+        sentence_score.values(), dtype=np.float64, count=len(sentences))
+    keep = np.flatnonzero(scores > threshold)
+    return [levels[best[i]] for i in keep], [sentences[i] for i in keep], [float(scores[i]) for i in keep]
 
 def get_sentence_start_end(doc:str, sentence: str) -> tuple[int, int]:
     """
@@ -80,17 +111,30 @@ def get_sentence_start_end(doc:str, sentence: str) -> tuple[int, int]:
             
 
 class SemanticSearchLF(CategoricalLabellingFunction):
-    def __init__(self, schemas, logger, **kwargs):
+    def __init__(self, schemas, logger, embedding_cache: Optional[EmbeddingCache] = None, sentence_index: Optional[SentenceIndex] = None, **kwargs):
+        """
+        :param embedding_cache: On-disk cache of embeddings, so text embedded in previous runs isn't re-embedded.
+        :param sentence_index: Corpus sentence index, extracted documents are added to it and `search_corpus` queries it.
+        """
         super().__init__(schemas, logger, **kwargs)
         self.sim_threshold = 0.1
+        self.embedding_cache = embedding_cache
+        self.sentence_index = sentence_index
+        self.model_id = None
+        # sentences, embeddings and first position of each sentence, per document text
+        self._document_embeddings = LRUCache(4)
+        # embeddings of the schema's questions and categories
+        self._schema_embeddings = LRUCache(1024)
 
     def _load_similarity_model(self, model_directory: str, device: Union[int, str]) -> SentenceTransformer:
         if (model_directory / "sim_model").exists():
             print("Fine tuning similarity model found, loading...")
+            self.model_id = model_identity(model_directory / "sim_model")
             return SentenceTransformer(
                 model_directory / "sim_model")
         else:
             print("No fine tuning similarity model found, using default...")
+            self.model_id = model_identity('all-MiniLM-L6-v2')
             return SentenceTransformer(
                 'all-MiniLM-L6-v2',
                 device=device
@@ -98,16 +142,82 @@ class SemanticSearchLF(CategoricalLabellingFunction):
     
     def load(self, model_directory: str, device: Union[int, str]) -> None:
         self.model = self._load_similarity_model(model_directory, device)
+        self.loaded = True
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        if self.embedding_cache is None:
+            return self.model.encode(texts)
+        return self.embedding_cache.encode(self.model_id, texts, self.model.encode)
+
+    def unload(self) -> None:
+        if self.sentence_index is not None:
+            self.sentence_index.save()
+        self.model = None
+        self._document_embeddings.clear()
+        self._schema_embeddings.clear()
+        super().unload()
+
+    @property
+    def memory_footprint(self) -> float:
+        # all-MiniLM-L6-v2
+        return 100
 
     def extract(self, document_name: str, variable_name: str, document_text: str) -> None:
-        questions = self.get_schema("questions", variable_name)
-        categories = self.get_schema("categories", variable_name)
-        doc_sims = doc_similarities(questions, document_text, self.model)
-        matched_level, matched_sentence, matched_score = match_levels(doc_sims, categories, self.model, self.sim_threshold)
-        if len(matched_level) > 0:
-            for level, sentence, score in zip(matched_level, matched_sentence, matched_score):
-                start, end = get_sentence_start_end(document_text, sentence)
-                self.push(document_name, variable_name, Extraction.from_character_startend(document_text, level, score, start, end))
+        self.extract_many(document_name, [variable_name], document_text)
+
+    def _encode_document(self, document_text: str) -> tuple[list[str], np.ndarray, dict[str, int]]:
+        key = text_hash(document_text)
+        encoded = self._document_embeddings.get(key)
+        if encoded is None:
+            sentences = split_sentences(document_text)
+            positions = {}
+            for i, sentence in enumerate(sentences):
+                positions.setdefault(sentence, i)
+            encoded = (sentences, self._encode(sentences), positions)
+            self._document_embeddings[key] = encoded
+        return encoded
+
+    def _encode_schema(self, texts: list[str]) -> np.ndarray:
+        key = tuple(texts)
+        embeddings = self._schema_embeddings.get(key)
+        if embeddings is None:
+            embeddings = self._encode(texts)
+            self._schema_embeddings[key] = embeddings
+        return embeddings
+
+    def extract_many(self, document_name: str, variables: list[str], document_text: str) -> None:
+        # the document is encoded once, for all variables
+        sentences, sentence_embeddings, positions = self._encode_document(document_text)
+        if self.sentence_index is not None:
+            self.sentence_index.add(document_name, text_hash(document_text), sentences,
+                                    sentence_spans(sentences), sentence_embeddings)
+        for variable_name in variables:
+            questions = self.get_schema("questions", variable_name)
+            categories = self.get_schema("categories", variable_name)
+            doc_sims = sentence_similarities(questions, sentences, self.model,
+                                             sentence_embeddings=sentence_embeddings,
+                                             query_embeddings=self._encode_schema(questions))
+            matched_level, matched_sentence, matched_score = match_levels(
+                doc_sims, categories, self.model, self.sim_threshold,
+                sentence_embeddings=sentence_embeddings[[positions[sentence] for sentence in doc_sims]],
+                level_embeddings=self._encode_schema(categories))
+            if len(matched_level) > 0:
+                for level, sentence, score in zip(matched_level, matched_sentence, matched_score):
+                    start, end = get_sentence_start_end(document_text, sentence)
+                    self.push(document_name, variable_name, Extraction.from_character_startend(document_text, level, score, start, end))
+
+    def search_corpus(self, queries: list[str], k: int = 10) -> list[tuple[str, str, int, int, float]]:
+        """
+        Find the sentences of the indexed corpus most similar to the queries.
+
+        :param queries: The queries, e.g. the questions of a variable.
+        :param k: The number of sentences to return.
+
+        :return: List of (document name, sentence, start, end, score), best first.
+        """
+        if self.sentence_index is None:
+            raise ValueError("No sentence index to search, pass one as `sentence_index`.")
+        return self.sentence_index.search(self._encode(queries), k)
 
     def train(self, document_name: str, variable_name: str, extraction: Extraction):
         pass
@@ -1,40 +1,79 @@
 """Script which uses a Sentence Similarity transformer model to assign extracted Q&A pairs to provided categories."""
-from sentence_transformers import SentenceTransformer, util, losses
-from transformers import pipeline
+from sentence_transformers import SentenceTransformer, losses
 import torch
 
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import warnings
 
+import numpy as np
+
 from elicit.interface import CategoricalLabellingFunction, Extraction
-from elicit.generic_labelling_functions.qa_transformer import extract_answers, load_qa_model
+from elicit.generic_labelling_functions.qa_transformer import SharedQAMixin
 from elicit.generic_labelling_functions.nli_transformer import compress
-from elicit.utils.dl_utils import extraction_to_input_examples
+from elicit.utils.dl_utils import extraction_to_input_examples, torch_device
+from elicit.utils.embeddings import EmbeddingCache, model_identity
+from elicit.utils.profiles import ModelProfile, get_profile
+from elicit.utils.registry import ModelRegistry
 
 
 warnings.filterwarnings("ignore")
 
 
-def similarity(answer: str, levels: List[str], similarity_model: SentenceTransformer):
+def _add_prefix(texts: List[str]) -> List[str]:
+    return [f"this is a {t}" for t in texts]
+
+
+def _normalise(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def encode_levels(levels: List[str], encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    """
+    Embed the levels of a variable (and the empty level), to compare answers against.
+
+    :param levels: The levels of the variable.
+    :param encoder: Function embedding a list of texts.
+
+    :return: Array of normalised embeddings, a row per level with the empty level last.
+    """
+    return _normalise(encoder(_add_prefix([*levels, ""])))
+
+
+def similarity_matrix(answers: List[str], level_embeddings: np.ndarray, encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    """
+    Cosine similarity of every answer to every level, encoding the answers in a single batch.
+
+    :param answers: The answers to compare to the levels.
+    :param level_embeddings: Normalised level embeddings, see `encode_levels`.
+    :param encoder: Function embedding a list of texts.
+
+    :return: Array of answers x levels similarities.
+    """
+    if not answers:
+        return np.zeros((0, len(level_embeddings)), dtype=np.float32)
+    return _normalise(encoder(_add_prefix(answers))) @ level_embeddings.T
+
+
+def similarity(answer: str, levels: List[str], similarity_model: SentenceTransformer, encoder: Optional[Callable[[List[str]], np.ndarray]] = None):
     """
     Get the similarity score of each level to the answer.
 
     :param answer: The answer to compare to the levels.
     :param levels: The levels to compare to the answer.
+    :param encoder: Function embedding a list of texts, defaults to encoding with the similarity model.
 
     :return: List of (level, similarity score).
     """
-    def _add_prefix(level: List[str]) -> str:
-        return [f"this is a {l}" for l in level]
-    embeddings = similarity_model.encode(
-        _add_prefix([answer, *levels]), device=0)
-    sims = [float(util.pytorch_cos_sim(embeddings[0], embeddings[i]))
-            for i in range(1, len(embeddings))]
-    return [(levels[i], s) for i, s in enumerate(sims)]
+    encoder = encoder or similarity_model.encode
+    sims = similarity_matrix(
+        [answer], _normalise(encoder(_add_prefix(levels))), encoder)[0]
+    return [(level, float(s)) for level, s in zip(levels, sims)]
 
 
-def match_similarity(answers: List[Tuple[str, float]], doc: str, levels: List[str], similarity_model: SentenceTransformer, filter_threshold: float, threshold: float) -> List[Extraction]:
+def match_similarity(answers: List[Tuple[str, float]], doc: str, levels: List[str], similarity_model: SentenceTransformer, filter_threshold: float, threshold: float, encoder: Optional[Callable[[List[str]], np.ndarray]] = None, level_embeddings: Optional[np.ndarray] = None, answer_embeddings: Optional[Dict[str, np.ndarray]] = None) -> List[Extraction]:
     """
     Find closest level to an answer, must pass threshold.
 
@@ -42,18 +81,26 @@ def match_similarity(answers: List[Tuple[str, float]], doc: str, levels: List[st
     :param doc: The document answers are extracted from - used to form evidence.
     :param levels: List of levels to compare to the answers.
     :param threshold: Threshold for filtering.
+    :param encoder: Function embedding a list of texts, defaults to encoding with the similarity model.
+    :param level_embeddings: Precomputed level embeddings, see `encode_levels`.
+    :param answer_embeddings: Precomputed normalised embeddings of the answers.
 
     :return: List of CaseFields.
     """
+    encoder = encoder or similarity_model.encode
+    if level_embeddings is None:
+        level_embeddings = encode_levels(levels, encoder)
+    unique = list(dict.fromkeys(answer for answer, *_ in answers))
+    if answer_embeddings is None or not unique:
+        matrix = similarity_matrix(unique, level_embeddings, encoder)
+    else:
+        matrix = np.stack([answer_embeddings[answer]
+                          for answer in unique]) @ level_embeddings.T
+    sims = dict(zip(unique, matrix.tolist()))
     candidates = []
     for answer, score, start, end in answers:
-        output = similarity(
-            answer,
-            [*levels, ""],
-            similarity_model=similarity_model
-        )
         candidates += [(o, s * score, start, end)
-                       for o, s in output if s > filter_threshold]
+                       for o, s in zip([*levels, ""], sims[answer]) if s > filter_threshold]
     if not candidates:
         return [Extraction.abstain()]
     # get all candidates that are above the threshold
@@ -78,20 +125,63 @@ def match_similarity(answers: List[Tuple[str, float]], doc: str, levels: List[st
         return extractions
 
 
-class SimilarityLabellingFunction(CategoricalLabellingFunction):
+def match_similarity_many(answers: Dict[str, List[Tuple[str, float, int, int]]], doc: str, levels: Dict[str, List[str]], similarity_model: SentenceTransformer, filter_threshold: float, threshold: float, encoder: Optional[Callable[[List[str]], np.ndarray]] = None, level_embeddings: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, List[Extraction]]:
+    """
+    Find the closest levels to the answers of many variables, encoding the answers of every variable in a single batch.
 
-    def __init__(self, schemas, logger, **kwargs):
+    :param answers: Answers from the Q&A Transformer. Form is: {variable: [(answer, score, start, end)]}
+    :param doc: The document answers are extracted from - used to form evidence.
+    :param levels: Levels of each variable.
+    :param threshold: Threshold for filtering.
+    :param encoder: Function embedding a list of texts, defaults to encoding with the similarity model.
+    :param level_embeddings: Precomputed level embeddings of each variable, see `encode_levels`.
+
+    :return: Dictionary of variable: extractions.
+    """
+    encoder = encoder or similarity_model.encode
+    level_embeddings = level_embeddings or {}
+    unique = list(dict.fromkeys(answer for variable_answers in answers.values()
+                                for answer, *_ in variable_answers))
+    answer_embeddings = dict(
+        zip(unique, _normalise(encoder(_add_prefix(unique))))) if unique else {}
+    return {variable: match_similarity(variable_answers, doc, levels[variable], similarity_model, filter_threshold, threshold,
+                                       encoder, level_embeddings.get(variable), answer_embeddings)
+            for variable, variable_answers in answers.items()}
+
+
+class SimilarityLabellingFunction(SharedQAMixin, CategoricalLabellingFunction):
+
+    def __init__(self, schemas, logger, embedding_cache: Optional[EmbeddingCache] = None, qa_batch_size: int = 16, chunk_stride: int = 64, model_registry: Optional[ModelRegistry] = None, model_profile: Union[str, ModelProfile] = "default", **kwargs):
+        """
+        :param embedding_cache: On-disk cache of embeddings, so text embedded in previous runs isn't re-embedded.
+        :param qa_batch_size: Number of (question, chunk) pairs passed through the Q&A model at once.
+        :param chunk_stride: Number of tokens consecutive windows of a document overlap by.
+        :param model_registry: Registry sharing the Q&A model, and its answers, with other labelling functions.
+        :param model_profile: Profile (see `elicit.utils.profiles`) of the Q&A model, e.g. "distilled-quantized" on the CPU.
+        """
         super().__init__(schemas, logger, **kwargs)
         self.filter_threshold = 0.5
         self.qna_threshold = 0.1
+        self.qa_batch_size = qa_batch_size
+        self.chunk_stride = chunk_stride
+        self.model_registry = model_registry or ModelRegistry()
+        self.model_profile = get_profile(model_profile)
+        self.embedding_cache = embedding_cache
+        self.model_id = None
+        self.level_embeddings: Dict[str, np.ndarray] = {}
 
     def _load_similarity_model(self, model_directory: str, device: Union[int, str]) -> SentenceTransformer:
+        device = torch_device(device)
         if (model_directory / "sim_model").exists():
             print("Fine tuning similarity model found, loading...")
+            self.model_id = model_identity(model_directory / "sim_model")
             return SentenceTransformer(
-                model_directory / "sim_model")
+                model_directory / "sim_model",
+                device=device
+            )
         else:
             print("No fine tuning similarity model found, loading default.")
+            self.model_id = model_identity('all-MiniLM-L6-v2')
             return SentenceTransformer(
                 'all-MiniLM-L6-v2',
                 device=device
@@ -101,33 +191,53 @@ class SimilarityLabellingFunction(CategoricalLabellingFunction):
         self.model_directory = model_directory
         self.similarity_model = self._load_similarity_model(
             model_directory, device)
-        self.qna_model, self.qna_tokenizer = load_qa_model(model_directory)
-        self.qna_pipeline = pipeline(
-            task='question-answering',
-            model=self.qna_model,
-            tokenizer=self.qna_tokenizer,
-            device=device
-        )
+        self._load_qa(model_directory, device)
+        self._encode_levels()
+        self.loaded = True
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        # the model runs on the device it was loaded on
+        encode = self.similarity_model.encode
+        if self.embedding_cache is None:
+            return encode(texts)
+        return self.embedding_cache.encode(self.model_id, texts, encode)
+
+    def _encode_levels(self) -> None:
+        self.level_embeddings = {variable: encode_levels(levels, self._encode)
+                                 for variable, levels in self.get_schema("categories").items()
+                                 if isinstance(levels, list)}
+
+    def unload(self) -> None:
+        self.similarity_model = None
+        self.level_embeddings = {}
+        self._unload_qa()
+        super().unload()
+
+    @property
+    def memory_footprint(self) -> float:
+        # all-MiniLM-L6-v2 + Q&A model
+        return 100 + self.model_profile.qa_footprint
 
     def extract(self, document_name: str, variable_name: str, document_text: str) -> None:
-        questions = self.get_schema("questions", variable_name)
-        categories = self.get_schema("categories", variable_name)
+        self.extract_many(document_name, [variable_name], document_text)
+
+    def extract_many(self, document_name: str, variables: List[str], document_text: str) -> None:
         final_threshold = 0.1
-        answers = extract_answers(
-            document_text,
-            questions=questions,
-            qna_model=self.qna_pipeline,
-            threshold=self.qna_threshold
-        )
-        extractions = match_similarity(
+        answers = self._answers(document_text, variables)
+        extractions = match_similarity_many(
             answers,
             doc=document_text,
-            levels=categories,
+            levels={variable_name: self.get_schema("categories", variable_name)
+                    for variable_name in variables},
             similarity_model=self.similarity_model,
             filter_threshold=self.filter_threshold,
-            threshold=final_threshold
+            threshold=final_threshold,
+            encoder=self._encode,
+            level_embeddings=self.level_embeddings
         )
-        self.push_many(document_name, variable_name, extractions)
+        for variable_name in variables:
+            self.push_many(document_name, variable_name,
+                           extractions[variable_name])
 
     def train(self, data: dict[str, List["Extraction"]]):
         dataset = []
@@ -146,6 +256,11 @@ class SimilarityLabellingFunction(CategoricalLabellingFunction):
         )
         self.similarity_model.save(
             str(self.model_directory / "sim_model"), "sim_model")
+        # embeddings of the previous model are stale
+        if self.embedding_cache is not None:
+            self.embedding_cache.invalidate(self.model_id)
+        self.model_id = model_identity(self.model_directory / "sim_model")
+        self._encode_levels()
 
     @property
     def labelling_method(self) -> str:
@@ -5,24 +5,22 @@
     also has various classmethods for easily extracting evidence.
 """
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from pathlib import Path
 from sqlite3 import IntegrityError
-from typing import List, Optional, Tuple, Union
+from typing import Hashable, Iterator, List, Optional, Set, Tuple, Type, Union
 from dataclasses import dataclass
 from numpy import var
-from difflib import SequenceMatcher
 
 
 from spacy.language import Language
 
 
 from elicit.utils.loading import load_schema
-from database.db_utils import connect_db, get_next_id, get_doc_id, get_variable_id, get_extraction_id, query_db
-from elicit.utils import context_from_doc_char
-
-
-def similar(a, b):
-    return SequenceMatcher(None, a, b).ratio()
+from database.db_utils import connect_db, get_doc_id, get_document_text, get_document_text_hash, get_variable_id, get_extraction_id, put_document_text, query_db
+from elicit.utils import contexts_from_span, text_hash
+from elicit.utils.dedup import ContextEvidenceIndex, EvidenceIndex, SpanEvidenceIndex
+from elicit.utils.utils import LRUCache
 
 
 class ElicitLogger:
@@ -30,11 +28,69 @@ class ElicitLogger:
     Class which pushes an extraction, evidence, and label to the database.
     """
 
-    def __init__(self, db_path: Path):
+    def __init__(self, db_path: Path, evidence_index: Optional[Type[EvidenceIndex]] = None, index_cache_size: int = 1024, store_contexts: bool = True):
+        """
+        :param db_path: Path to the extraction database.
+        :param evidence_index: Index used to find previously stored evidence for a document variable.
+            Defaults to matching contexts, or spans when contexts aren't stored.
+        :param index_cache_size: Number of (document, variable) evidence indexes kept in memory.
+        :param store_contexts: Whether to store the local and wider contexts of extractions.
+            If False, extractions with offsets into a document pushed with `push_document_text` only store
+            their exact context, the others are sliced from the document text on read.
+        """
         self.db_path = db_path
         self.db = connect_db(db_path)
+        self.store_contexts = store_contexts
+        if evidence_index is None:
+            evidence_index = ContextEvidenceIndex if store_contexts else SpanEvidenceIndex
+        self.evidence_index = evidence_index
+        self._evidence_indexes = LRUCache(index_cache_size)
+        self._document_texts = LRUCache(8)
+        self._transaction_depth = 0
+        self._pending_raw_extractions = {}
         print(f"Connected to Extraction Database: {db_path}")
 
+    @contextmanager
+    def transaction(self) -> Iterator["ElicitLogger"]:
+        """
+        Unit of work: everything pushed inside the block is written in a single transaction.
+        Raw extractions are buffered and inserted with one `executemany` when the outermost block exits.
+        If the block raises, the uncommitted writes are rolled back.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            if self._transaction_depth == 1:
+                self._pending_raw_extractions = {}
+                self._evidence_indexes.clear()
+                self._document_texts.clear()
+                self.db.rollback()
+            raise
+        else:
+            if self._transaction_depth == 1:
+                self.commit()
+        finally:
+            self._transaction_depth -= 1
+
+    def flush(self) -> None:
+        """Write the buffered raw extractions to the database, without committing."""
+        if not self._pending_raw_extractions:
+            return
+        self.db.executemany(
+            "INSERT INTO raw_extraction (extraction_id, method, confidence) VALUES (?, ?, ?)",
+            [(extraction_id, method, confidence) for (extraction_id, method), confidence in self._pending_raw_extractions.items()])
+        self._pending_raw_extractions = {}
+
+    def commit(self) -> None:
+        """Flush the buffered writes and commit, can be used to checkpoint inside a transaction."""
+        self.flush()
+        self.db.commit()
+
+    def _commit(self) -> None:
+        if self._transaction_depth == 0:
+            self.commit()
+
     def doc_in(self, document_name: str) -> bool:
         return get_doc_id(self.db, document_name) >= 0
 
@@ -43,10 +99,58 @@ class ElicitLogger:
         if doc_id >= 0:
             return doc_id
         else:
-            doc_id = get_next_id(self.db, 'document')
-            self.db.execute(
-                "INSERT INTO document (document_id, document_name) VALUES (?, ?)", (doc_id, document_name))
-            return doc_id
+            return self.db.execute(
+                "INSERT INTO document (document_name) VALUES (?)", (document_name,)).lastrowid
+
+    def push_document_text(self, document_name: str, text: str) -> None:
+        """
+        Store the text of a document, from which the contexts of its extractions are sliced.
+        Only stored when the logger doesn't store contexts.
+        :param document_name: The name of the document.
+        :param text: The text of the document.
+        """
+        if self.store_contexts:
+            return
+        doc_id = self._get_doc(document_name)
+        document_hash = text_hash(text)
+        if get_document_text_hash(self.db, doc_id) != document_hash:
+            put_document_text(self.db, doc_id, text, document_hash)
+        self._document_texts[doc_id] = text
+        self._commit()
+
+    def _document_text(self, document_id: int) -> Optional[str]:
+        text = self._document_texts.get(document_id)
+        if text is None:
+            text = get_document_text(self.db, document_id)
+            if text is not None:
+                self._document_texts[document_id] = text
+        return text
+
+    def _stored_contexts(self, document_id: int, extraction: "Extraction") -> Tuple[Optional[str], Optional[str]]:
+        """
+        Local and wider contexts to store for an extraction,
+        None when they can be sliced from the stored document text.
+        """
+        local, wider = extraction.local_context, extraction.wider_context
+        if self.store_contexts or extraction.start is None:
+            return local, wider
+        text = self._document_text(document_id)
+        if text is None or text_hash(text) != extraction.document_hash:
+            return local, wider
+        if contexts_from_span(text, extraction.start, extraction.end)[1:] != (local, wider):
+            return local, wider
+        return None, None
+
+    def _materialise(self, document_id: int, extraction: "Extraction") -> "Extraction":
+        """Slice the contexts which weren't stored from the document text."""
+        if extraction.local_context is not None or extraction.start is None:
+            return extraction
+        text = self._document_text(document_id)
+        if text is None or text_hash(text) != extraction.document_hash:
+            return extraction
+        _, extraction.local_context, extraction.wider_context = contexts_from_span(
+            text, extraction.start, extraction.end)
+        return extraction
 
     def _get_variable(self, document_id: int, variable_name: str, variable_value: str) -> int:
         variable_id = get_variable_id(
@@ -54,10 +158,8 @@ class ElicitLogger:
         if variable_id >= 0:
             return variable_id
         else:
-            var_id = get_next_id(self.db, 'variable')
-            self.db.execute(
-                "INSERT INTO variable (variable_id, variable_name, variable_value, document_id) VALUES (?, ?, ?, ?)", (var_id, variable_name, variable_value, document_id))
-            return var_id
+            return self.db.execute(
+                "INSERT INTO variable (variable_name, variable_value, document_id) VALUES (?, ?, ?)", (variable_name, variable_value, document_id)).lastrowid
 
     def _get_extraction(self, document_id: int, variable_id: int, method: str) -> int:
         """
@@ -65,18 +167,29 @@ class ElicitLogger:
         :param document_id: The ID of the document.
         :param variable_id: The ID of the variable.
         :param method: The method of the extraction.
-        :return: The ID of the extraction.
+        :return: The ID of the extraction, or -1 if there is no such extraction.
         """
-        extraction_id = get_extraction_id(
-            self.db, method, variable_id, document_id)
-        if extraction_id >= 0:
-            return extraction_id
-        else:
-            return get_next_id(self.db, 'extraction')
+        return get_extraction_id(self.db, method, variable_id, document_id)
+
+    def _get_evidence_index(self, document_id: int, variable_id: int) -> EvidenceIndex:
+        """
+        Get the evidence index of a document variable, built from the database the first time it is used.
+        :param document_id: The ID of the document.
+        :param variable_id: The ID of the variable.
+        :return: The evidence index.
+        """
+        index = self._evidence_indexes.get((document_id, variable_id))
+        if index is None:
+            index = self.evidence_index()
+            for row in self.db.execute("SELECT extraction_id, exact_context, local_context, wider_context, start_char, end_char, document_hash FROM extraction WHERE variable_id = ? AND document_id = ? ORDER BY extraction_id", (variable_id, document_id)):
+                index.add(row[0], Extraction(
+                    None, row[1], row[2], row[3], None, None, None, row[4], row[5], row[6]))
+            self._evidence_indexes[(document_id, variable_id)] = index
+        return index
 
     def find_matching_evidence(self, document_id: int, variable_id: int, extraction: "Extraction"):
         """
-        Check the database to see if any extractions have previously identified the same evidence.
+        Check whether any extractions have previously identified the same evidence.
         :param document_id: The ID of the document.
         :param variable_id: The ID of the variable.
         :param evidence: The evidence to match.
@@ -84,14 +197,14 @@ class ElicitLogger:
         """
         if extraction.exact_context is None:
             return -1
-        for row in self.db.execute("SELECT extraction_id, exact_context, local_context, wider_context FROM extraction WHERE variable_id = ? AND document_id = ?", (variable_id, document_id)):
-            if row[1] is None:
-                continue
-            if row[1] in extraction.local_context or extraction.exact_context in row[2] or similar(row[3], extraction.wider_context) > 0.7:
-                return row[0]
-        return -1
+        return self._get_evidence_index(document_id, variable_id).find(extraction)
 
     def _check_duplicate(self, extraction_id: int, method: str, extraction: "Extraction"):
+        key = (extraction_id, method)
+        if key in self._pending_raw_extractions:
+            self._pending_raw_extractions[key] = max(
+                self._pending_raw_extractions[key], extraction.confidence)
+            return True
         row = query_db(
             self.db, "SELECT confidence FROM raw_extraction WHERE extraction_id = ? AND method = ?", (extraction_id, method))
         if len(row) > 0:
@@ -111,13 +224,23 @@ class ElicitLogger:
         extraction_id = self.find_matching_evidence(
             document_id, variable_id, extraction)
         if extraction_id < 0:
-            extraction_id = get_next_id(self.db, 'extraction')
-            self.db.execute(
-                "INSERT INTO extraction (extraction_id, exact_context, local_context, wider_context, variable_id, document_id, valid) VALUES (?, ?, ?, ?, ?, ?, ?)", (extraction_id, extraction.exact_context, extraction.local_context, extraction.wider_context, variable_id, document_id, extraction.valid))
-        if not self._check_duplicate(extraction_id, method, extraction):
-            raw_extraction_id = get_next_id(self.db, 'raw_extraction')
-            self.db.execute("INSERT INTO raw_extraction (raw_extraction_id, extraction_id, method, confidence) VALUES (?, ?, ?, ?)",
-                            (raw_extraction_id, extraction_id, method, extraction.confidence))
+            local_context, wider_context = self._stored_contexts(
+                document_id, extraction)
+            extraction_id = self.db.execute(
+                "INSERT INTO extraction (exact_context, local_context, wider_context, start_char, end_char, document_hash, variable_id, document_id, valid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (extraction.exact_context, local_context, wider_context, extraction.start, extraction.end, extraction.document_hash, variable_id, document_id, extraction.valid)).lastrowid
+            # a missing index is built from the database, which already holds the new row
+            index = self._evidence_indexes.get((document_id, variable_id))
+            if index is not None:
+                index.add(extraction_id, extraction)
+        if self._check_duplicate(extraction_id, method, extraction):
+            return
+        if self._transaction_depth > 0:
+            self._pending_raw_extractions[(
+                extraction_id, method)] = extraction.confidence
+        else:
+            self.db.execute("INSERT INTO raw_extraction (extraction_id, method, confidence) VALUES (?, ?, ?)",
+                            (extraction_id, method, extraction.confidence))
 
     def push_variable(self, document_name: str, variable_name: str, variable_value: str) -> None:
         """
@@ -130,7 +253,44 @@ class ElicitLogger:
         var_id = self._get_variable(doc_id, variable_name, variable_value)
         self._push_evidence(doc_id, var_id, Extraction.not_present(
             variable_value), "manual")
-        self.db.commit()
+        self._commit()
+
+    def push_variables(self, document_name: str, variables: List[Tuple[str, str]]) -> None:
+        """
+        Push many values for a document at once, each with an empty manual extraction.
+        Values already in the database are skipped.
+        :param document_name: The name of the document.
+        :param variables: List of (variable name, variable value).
+        """
+        # buffered raw extractions must be visible to the inserts below
+        self.flush()
+        doc_id = self._get_doc(document_name)
+        existing = {(row[0], row[1]) for row in self.db.execute(
+            "SELECT variable_name, variable_value FROM variable WHERE document_id = ?", (doc_id,))}
+        new_variables = list(dict.fromkeys(
+            v for v in variables if v not in existing))
+        if new_variables:
+            self.db.executemany(
+                "INSERT INTO variable (variable_name, variable_value, document_id) VALUES (?, ?, ?)",
+                [(name, value, doc_id) for name, value in new_variables])
+            # ids are assigned by SQLite, the new rows are the ones without evidence yet
+            self.db.execute(
+                """
+                    INSERT INTO extraction (variable_id, document_id)
+                    SELECT variable.variable_id, variable.document_id FROM variable
+                    LEFT JOIN extraction
+                    ON extraction.variable_id = variable.variable_id
+                    WHERE variable.document_id = ? AND extraction.extraction_id IS NULL
+                """, (doc_id,))
+            self.db.execute(
+                """
+                    INSERT INTO raw_extraction (extraction_id, method, confidence)
+                    SELECT extraction.extraction_id, 'manual', 0 FROM extraction
+                    LEFT JOIN raw_extraction
+                    ON raw_extraction.extraction_id = extraction.extraction_id
+                    WHERE extraction.document_id = ? AND raw_extraction.raw_extraction_id IS NULL
+                """, (doc_id,))
+        self._commit()
 
     def push(self, document_name: str, variable_name: str, extraction: "Extraction", method: str):
         """
@@ -145,7 +305,7 @@ class ElicitLogger:
         doc_id = self._get_doc(document_name)
         var_id = self._get_variable(doc_id, variable_name, extraction.value)
         self._push_evidence(doc_id, var_id, extraction, method)
-        self.db.commit()
+        self._commit()
 
     def get_validated_document_names(self, variable: str, include_negative: bool) -> List[str]:
         """
@@ -177,14 +337,14 @@ class ElicitLogger:
         cond = "= 'TRUE'" if not include_negative else "IS NOT NULL"
         cursor = self.db.execute(
             f"""
-                SELECT DISTINCT document.document_name, variable.variable_value, extraction.exact_context, extraction.local_context, extraction.wider_context, extraction.meta_confidence, extraction.valid, extraction.validated_context FROM extraction 
+                SELECT DISTINCT document.document_name, document.document_id, variable.variable_value, extraction.exact_context, extraction.local_context, extraction.wider_context, extraction.meta_confidence, extraction.valid, extraction.validated_context, extraction.start_char, extraction.end_char, extraction.document_hash FROM extraction 
                 LEFT JOIN variable
                 ON extraction.variable_id = variable.variable_id 
                 LEFT JOIN document 
                 ON document.document_id = variable.document_id  
                 WHERE extraction.valid {cond} AND variable.variable_name = '{variable}'
             """)
-        return [Extraction(row[1], row[2], row[3], row[4], row[5], row[6], row[7]) for row in cursor if row[0] in document_names]
+        return [self._materialise(row[1], Extraction(*row[2:])) for row in cursor.fetchall() if row[0] in document_names]
 
 
 class LabellingFunctionBase(ABC):
@@ -204,6 +364,33 @@ class LabellingFunctionBase(ABC):
         """
         pass
 
+    def unload(self) -> None:
+        """
+        Release whatever was acquired in `load`.
+        Override to free models, the default only marks the function as unloaded.
+        """
+        self.loaded = False
+
+    @property
+    def memory_footprint(self) -> float:
+        """
+        Approximate memory (MB) held once loaded.
+        Used by the extractor to decide which labelling functions can be resident together.
+        """
+        return 0
+
+    def shared_models(self, model_directory: Path, device: Union[int, str]) -> Set[Hashable]:
+        """
+        Keys of the models `load` acquires from the model registry.
+        The extractor keeps labelling functions sharing a model loaded, and runs them over each document, together.
+
+        :param model_directory: Directory the labelling function will be loaded from.
+        :param device: Device the labelling function will be loaded on.
+
+        :return: Set of model registry keys.
+        """
+        return set()
+
     def get_schema(self, schema_name: str, variable: str = None) -> dict:
         """Get the schema for the given schema name."""
         try:
@@ -254,8 +441,9 @@ class LabellingFunctionBase(ABC):
             extraction_list, key=lambda x: x.confidence, reverse=True)
         if self.top_k > 0:
             sorted_extractions = sorted_extractions[:self.top_k]
-        for extraction in sorted_extractions:
-            self.push(document_name, variable_name, extraction)
+        with self.logger.transaction():
+            for extraction in sorted_extractions:
+                self.push(document_name, variable_name, extraction)
 
     @property
     @abstractmethod
@@ -277,6 +465,19 @@ class LabellingFunctionBase(ABC):
         """Use the labelling function to extract a label from a document."""
         pass
 
+    def extract_many(self, document_name: str, variables: List[str], document_text: str) -> None:
+        """
+        Use the labelling function to extract labels for many variables from a document.
+        Override to share per-document work (tokenisation, chunking, embedding) between variables,
+        the default extracts each variable in turn.
+
+        :param document_name: The name of the document.
+        :param variables: The names of the variables.
+        :param document_text: The text of the document.
+        """
+        for variable_name in variables:
+            self.extract(document_name, variable_name, document_text)
+
 
 class CategoricalLabellingFunction(LabellingFunctionBase):
 
@@ -389,6 +590,9 @@ class Extraction:
     confidence: float
     valid: bool
     validated_context: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+    document_hash: Optional[str] = None
 
     @staticmethod
     def sanitize(string: str) -> str:
@@ -422,14 +626,13 @@ class Extraction:
 
         :return: An Extraction object.
         """
-        exact_context = context_from_doc_char(doc, start, end, padding=0)
-        mid = (start + end) // 2
-        local_context = context_from_doc_char(doc, start, end, local_padding)
-        wider_context = context_from_doc_char(doc, start, end, wider_padding)
+        exact_context, local_context, wider_context = contexts_from_span(
+            doc, start, end, local_padding, wider_padding)
         exact_context = cls.sanitize(exact_context)
         local_context = cls.sanitize(local_context)
         wider_context = cls.sanitize(wider_context)
-        return cls(value, exact_context, local_context, wider_context, confidence, None, None)
+        return cls(value, exact_context, local_context, wider_context, confidence, None, None,
+                   start, end, text_hash(doc))
 
     @classmethod
     def from_string(cls, string: str, value: str, confidence: float, exact_chars: int = 100, local_padding: int = 100, wider_padding: int = 500) -> "Extraction":
@@ -479,7 +682,9 @@ class Extraction:
         exact_context = cls.sanitize(exact_context.text)
         local_context = cls.sanitize(local_context.text)
         wider_context = cls.sanitize(wider_context.text)
-        return cls(value, exact_context, local_context, wider_context, confidence, None, None)
+        span = doc[start:end]
+        return cls(value, exact_context, local_context, wider_context, confidence, None, None,
+                   span.start_char, span.end_char, text_hash(doc.text))
 
     @classmethod
     def from_spacy_multiple(cls, doc: Language, value: str, confidence: float, evidence_list: List[Tuple[str, int, int]], wider_padding: int = 20) -> "Extraction":
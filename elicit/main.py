@@ -3,7 +3,9 @@ import subprocess
 from pathlib import Path
 import click
 
+from database.db_utils import connect_db, schema_version
 from elicit.extractor import Extractor
+from elicit.utils.cache import PlaintextCache
 
 
 def launch_ui(*, db_path: Path = None, extractor: Extractor = None, test: bool = False, output: bool = False):
@@ -93,5 +95,35 @@ def kill_ui_cmd():
     _kill_ui()
 
 
+@main.command(name="clear_cache")
+@click.option("--cache_dir", required=True, help="Directory of the plaintext cache.")
+@click.option("--document", default=None, help="Only invalidate the cached text of this document.")
+def clear_cache_cmd(cache_dir: str, document: str):
+    """
+    Invalidate the plaintext cache of parsed documents.
+
+    :param cache_dir: Directory of the plaintext cache.
+    :param document: Path of a single document to invalidate.
+
+    """
+    cache = PlaintextCache(Path(cache_dir))
+    removed = cache.invalidate(Path(document) if document else None)
+    print(f"Removed {removed} cached documents")
+
+
+@main.command(name="migrate")
+@click.option("--db_path", required=True, help="Path of the database to upgrade.")
+def migrate_cmd(db_path: str):
+    """
+    Upgrade an extraction database to the latest schema version.
+
+    :param db_path: path of database to upgrade.
+
+    """
+    db = connect_db(Path(db_path))
+    print(f"Database at schema version {schema_version(db)}")
+    db.close()
+
+
 if __name__ == "__main__":
     main()
@@ -1 +1 @@
-from .utils import context_from_doc_char
\ No newline at end of file
+from .utils import context_from_doc_char, context_span, contexts_from_span, text_hash
@@ -0,0 +1,140 @@
+"""Script containing an on-disk cache for extracted document text."""
+import hashlib
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash the contents of a file.
+
+    :param path: Path to the file.
+    :param chunk_size: Number of bytes read at a time.
+
+    :return: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PlaintextCache:
+    """
+    Content addressed cache of plaintext extracted from documents.
+    Entries are keyed by the hash of the source file and the loading kwargs, stored zlib compressed,
+    and evicted least recently used first once the cache exceeds `max_bytes`.
+    The size of the cache is scanned once and then kept as a running total, so the directory is only
+    scanned again when the total exceeds `max_bytes` (or after `invalidate`).
+    """
+
+    suffix = ".txt.z"
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # running total of the size of the entries, None until first needed
+        self._size: Optional[int] = None
+
+    def _entry(self, source_hash: str, kwargs: dict) -> Path:
+        kwargs_hash = hashlib.sha256(json.dumps(
+            kwargs, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return self.cache_dir / f"{source_hash}-{kwargs_hash}{self.suffix}"
+
+    def _entries(self) -> List[Path]:
+        return list(self.cache_dir.glob(f"*{self.suffix}"))
+
+    def get(self, path: Path, kwargs: dict = {}, source_hash: Optional[str] = None) -> Optional[str]:
+        """
+        Get the cached text for a document.
+
+        :param path: Path to the source document.
+        :param kwargs: Keyword arguments the text was loaded with.
+        :param source_hash: Hash of the source document (see `file_hash`), if already known.
+
+        :return: The cached text, or None if it isn't cached.
+        """
+        entry = self._entry(source_hash or file_hash(path), kwargs)
+        try:
+            with open(entry, "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except (FileNotFoundError, zlib.error):
+            return None
+        # mark as recently used
+        os.utime(entry)
+        return text
+
+    def put(self, path: Path, text: str, kwargs: dict = {}, source_hash: Optional[str] = None) -> None:
+        """
+        Cache the text of a document.
+
+        :param path: Path to the source document.
+        :param text: Text extracted from the document.
+        :param kwargs: Keyword arguments the text was loaded with.
+        :param source_hash: Hash of the source document (see `file_hash`), if already known, e.g. from `get`.
+        """
+        if self._size is None:
+            self._size = self.size
+        entry = self._entry(source_hash or file_hash(path), kwargs)
+        data = zlib.compress(text.encode("utf-8"))
+        try:
+            # the entry is being replaced
+            self._size -= entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, entry)
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    @property
+    def size(self) -> int:
+        """Total size of the cache in bytes."""
+        size = 0
+        for entry in self._entries():
+            try:
+                size += entry.stat().st_size
+            except FileNotFoundError:
+                continue
+        return size
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+        self._size = total
+
+    def invalidate(self, path: Optional[Path] = None) -> int:
+        """
+        Remove cached text.
+
+        :param path: Only remove entries for this document. If None the whole cache is cleared.
+
+        :return: Number of entries removed.
+        """
+        pattern = f"{file_hash(path)}-*{self.suffix}" if path is not None else f"*{self.suffix}"
+        removed = 0
+        for entry in self.cache_dir.glob(pattern):
+            entry.unlink(missing_ok=True)
+            removed += 1
+        self._size = None
+        return removed
@@ -0,0 +1,111 @@
+"""Script containing the chunker which splits documents into windows for transformer models."""
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from elicit.utils.utils import LRUCache, text_hash
+
+
+@dataclass
+class Chunk:
+    """
+    Window of a document, with its character offsets in the document.
+    """
+    text: str
+    start: int
+    end: int
+
+
+def chunk_characters(text: str, max_length: int = 512, min_length: int = 100, separators: Sequence[str] = (".", ",", "\n")) -> List[Chunk]:
+    """
+    Split a text into max_length (or smaller) character chunks, splitting on the last separator of each chunk
+    unless it would leave a chunk shorter than min_length.
+
+    :param text: Text to split.
+    :param max_length: Maximum length of each chunk.
+    :param min_length: Minimum length of a chunk ending at a separator.
+    :param separators: Characters to split on.
+
+    :return: List of chunks.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > max_length:
+        idx = max(text[start:start + max_length].rfind(s) for s in separators)
+        if idx < min_length:
+            idx = max_length
+        chunks.append(Chunk(text[start:start + idx], start, start + idx))
+        start += idx
+    chunks.append(Chunk(text[start:], start, len(text)))
+    return chunks
+
+
+class TokenChunker:
+    """
+    Splits documents into windows of at most `max_tokens` tokens of a model's tokenizer, overlapping by `stride` tokens,
+    so each window fills the model's input alongside a question of up to `question_tokens` tokens.
+    Windows end at a sentence boundary when one falls in their last quarter.
+    The tokenisation of recent documents is cached.
+    """
+
+    def __init__(self, tokenizer, max_length: Optional[int] = None, question_tokens: int = 64, stride: int = 64, cache_size: int = 8):
+        """
+        :param tokenizer: A fast (offset mapping) tokenizer of the model.
+        :param max_length: Maximum input length of the model, defaults to the tokenizer's (capped at 512).
+        :param question_tokens: Tokens reserved for the question and special tokens.
+        :param stride: Number of tokens consecutive windows overlap by.
+        :param cache_size: Number of document tokenisations kept in memory.
+        """
+        self.tokenizer = tokenizer
+        if max_length is None:
+            max_length = min(getattr(tokenizer, "model_max_length", 512), 512)
+        self.max_length = max_length
+        self.question_tokens = question_tokens
+        self.max_tokens = max_length - question_tokens
+        if self.max_tokens <= stride:
+            raise ValueError(
+                f"Windows of {self.max_tokens} tokens can't overlap by {stride} tokens.")
+        self.stride = stride
+        self._offsets = LRUCache(cache_size)
+
+    def offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Character offsets of each token of a text.
+
+        :param text: The text.
+
+        :return: List of (start, end) for each token.
+        """
+        key = text_hash(text)
+        offsets = self._offsets.get(key)
+        if offsets is None:
+            offsets = [tuple(o) for o in self.tokenizer(
+                text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]]
+            self._offsets[key] = offsets
+        return offsets
+
+    def chunks(self, text: str) -> List[Chunk]:
+        """
+        Split a text into token windows.
+
+        :param text: The text.
+
+        :return: List of chunks, with character offsets in the text.
+        """
+        offsets = self.offsets(text)
+        if len(offsets) <= self.max_tokens:
+            return [Chunk(text, 0, len(text))]
+        chunks = []
+        first = 0
+        while True:
+            last = min(first + self.max_tokens, len(offsets))
+            if last < len(offsets):
+                # prefer ending the window after a full stop in its last quarter
+                for i in range(last - 1, last - 1 - self.max_tokens // 4, -1):
+                    if text[offsets[i][0]:offsets[i][1]].endswith("."):
+                        last = i + 1
+                        break
+            start, end = offsets[first][0], offsets[last - 1][1]
+            chunks.append(Chunk(text[start:end], start, end))
+            if last == len(offsets):
+                return chunks
+            first = max(last - self.stride, first + 1)
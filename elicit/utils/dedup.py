@@ -0,0 +1,157 @@
+"""Script containing indexes used to find evidence which has already been extracted for a document variable."""
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+import zlib
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from elicit.interface import Extraction
+
+
+class EvidenceIndex(ABC):
+    """
+    In-memory index of the evidence stored for a single (document, variable).
+    Used by the logger to merge extractions which identify the same evidence.
+
+    Evidence matches when either exact context is contained in the other's local context,
+    or when the wider contexts have a SequenceMatcher ratio over the threshold.
+    The first matching evidence, in insertion order, is returned.
+    """
+
+    def __init__(self, threshold: float = 0.7):
+        self.threshold = threshold
+        self.entries: List[Tuple[int, str, str, str, Optional[int], Optional[int], Optional[str]]] = []
+
+    def add(self, extraction_id: int, extraction: "Extraction") -> None:
+        """
+        Add stored evidence to the index.
+
+        :param extraction_id: The ID of the stored extraction.
+        :param extraction: The extraction.
+        """
+        if extraction.exact_context is None:
+            return
+        self.entries.append((extraction_id, extraction.exact_context,
+                            extraction.local_context, extraction.wider_context,
+                            extraction.start, extraction.end, extraction.document_hash))
+        self._add(len(self.entries) - 1, extraction)
+
+    def _add(self, position: int, extraction: "Extraction") -> None:
+        pass
+
+    @abstractmethod
+    def _candidates(self, extraction: "Extraction") -> Optional[Set[int]]:
+        """Positions of the entries whose wider context may be similar, None for all of them."""
+        pass
+
+    def _match_span(self, start: Optional[int], end: Optional[int], document_hash: Optional[str], extraction: "Extraction") -> Optional[bool]:
+        """Whether the stored span matches the extraction, None to fall back to comparing contexts."""
+        return None
+
+    def _similar(self, stored: str, wider: str) -> bool:
+        length = len(stored) + len(wider)
+        # cheap upper bound of the ratio (SequenceMatcher.real_quick_ratio)
+        if length == 0 or 2.0 * min(len(stored), len(wider)) / length <= self.threshold:
+            return False
+        return SequenceMatcher(None, stored, wider).ratio() > self.threshold
+
+    def find(self, extraction: "Extraction") -> int:
+        """
+        Find stored evidence matching the extraction.
+
+        :param extraction: The extraction to match.
+
+        :return: The ID of the matching extraction, or -1 if there is none.
+        """
+        if extraction.exact_context is None:
+            return -1
+        exact, local, wider = extraction.exact_context, extraction.local_context, extraction.wider_context
+        candidates = self._candidates(extraction) if wider is not None else set()
+        for position, (extraction_id, stored_exact, stored_local, stored_wider, *span) in enumerate(self.entries):
+            span_match = self._match_span(*span, extraction)
+            if span_match is not None:
+                if span_match:
+                    return extraction_id
+                continue
+            if (local is not None and stored_exact in local) or (stored_local is not None and exact in stored_local):
+                return extraction_id
+            if stored_wider is None or (candidates is not None and position not in candidates):
+                continue
+            if self._similar(stored_wider, wider):
+                return extraction_id
+        return -1
+
+
+class ExhaustiveEvidenceIndex(EvidenceIndex):
+    """Compares the wider context against every stored entry."""
+
+    def _candidates(self, extraction: "Extraction") -> Optional[Set[int]]:
+        return None
+
+
+class ContextEvidenceIndex(EvidenceIndex):
+    """
+    Only compares wider contexts which share a locality sensitive hashing band of their
+    MinHash signatures (over character shingles), i.e. which have a reasonable shingle overlap.
+    Contexts similar enough to pass the SequenceMatcher threshold share a band with high probability,
+    so decisions match the exhaustive comparison at a fraction of the cost.
+    """
+
+    _prime = (1 << 31) - 1
+
+    def __init__(self, threshold: float = 0.7, shingle_size: int = 5, bands: int = 32, rows: int = 2, seed: int = 0):
+        super().__init__(threshold)
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, self._prime, size=bands * rows,
+                             dtype=np.uint64)
+        self.b = rng.randint(0, self._prime, size=bands * rows,
+                             dtype=np.uint64)
+        self.buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        MinHash signature of the character shingles of a text.
+
+        :param text: The text.
+
+        :return: Array of `bands * rows` minimum hashes.
+        """
+        k = self.shingle_size
+        shingles = {text[i:i + k]
+                    for i in range(max(1, len(text) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self.a) + self.b) % self._prime).min(axis=0)
+
+    def _bands(self, text: str):
+        signature = self.signature(text)
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _add(self, position: int, extraction: "Extraction") -> None:
+        if extraction.wider_context is None:
+            return
+        for band in self._bands(extraction.wider_context):
+            self.buckets[band].append(position)
+
+    def _candidates(self, extraction: "Extraction") -> Optional[Set[int]]:
+        return {position for band in self._bands(extraction.wider_context)
+                for position in self.buckets.get(band, [])}
+
+
+class SpanEvidenceIndex(ContextEvidenceIndex):
+    """
+    Evidence with character offsets into the same document text matches when the spans overlap,
+    without comparing contexts. Evidence missing offsets is compared by context.
+    """
+
+    def _match_span(self, start: Optional[int], end: Optional[int], document_hash: Optional[str], extraction: "Extraction") -> Optional[bool]:
+        if start is None or extraction.start is None or document_hash != extraction.document_hash:
+            return None
+        return start < extraction.end and extraction.start < end
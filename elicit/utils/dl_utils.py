@@ -12,8 +12,9 @@ class QADataset(Dataset):
             for vi in value:
                 qus = questions[key]
                 self.contexts += [vi.wider_context] * len(qus)
+                # without an explanation the exact span is the answer
                 self.answers += [self.get_answer_start_end(
-                    vi.validated_context, vi.wider_context)] * len(qus)
+                    vi.validated_context or vi.exact_context, vi.wider_context)] * len(qus)
                 self.questions += qus
         self.encodings = self.prepare_train_features(tokenizer)
 
@@ -159,3 +160,19 @@ def extraction_to_input_examples(extraction, questions: list, negative_val: floa
         ) for context in [extraction.local_context, extraction.exact_context]
     ]
     return question_examples + category_examples
+
+
+def torch_device(device) -> str:
+    """
+    Torch device name for a pipeline style device, -1 (or "cpu") for the CPU, otherwise a GPU index.
+    Falls back to the CPU when CUDA isn't available.
+
+    :param device: The device.
+
+    :return: Name of the torch device.
+    """
+    if isinstance(device, str):
+        return device if device == "cpu" or torch.cuda.is_available() else "cpu"
+    if device < 0 or not torch.cuda.is_available():
+        return "cpu"
+    return f"cuda:{device}"
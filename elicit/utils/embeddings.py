@@ -0,0 +1,231 @@
+"""Script containing an on-disk cache of text embeddings, keyed by model and text."""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+
+def model_identity(model_name_or_path: Union[str, Path]) -> str:
+    """
+    Identity of a model, for models stored on disk this changes whenever the model is saved again (e.g. fine-tuned).
+
+    :param model_name_or_path: Name of a pretrained model, or path to a saved model.
+
+    :return: The identity of the model.
+    """
+    path = Path(model_name_or_path)
+    if not path.exists():
+        return str(model_name_or_path)
+    digest = hashlib.sha1()
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        stat = file.stat()
+        digest.update(
+            f"{file.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return f"{path.resolve()}@{digest.hexdigest()[:16]}"
+
+
+def text_key(text: str) -> str:
+    """
+    Key of a text in an embedding store.
+
+    :param text: The text.
+
+    :return: Hex digest of the text.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append only store of the embeddings of a single model.
+    Embeddings are rows of a memory mapped array, found through an index of text hashes.
+    """
+
+    def __init__(self, directory: Path, model_id: str, dtype: np.dtype = np.float32):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self.index: Dict[str, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        if self.meta_path.exists():
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+        if self.keys_path.exists():
+            with open(self.keys_path, "r") as f:
+                for row, key in enumerate(f.read().split()):
+                    self.index[key] = row
+
+    @property
+    def meta_path(self) -> Path:
+        return self.directory / "meta.json"
+
+    @property
+    def keys_path(self) -> Path:
+        return self.directory / "keys.txt"
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.directory / "vectors.bin"
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _memmap(self) -> np.memmap:
+        if self._vectors is None or len(self._vectors) != len(self.index):
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                                      shape=(len(self.index), self.dim))
+        return self._vectors
+
+    def add(self, keys: List[str], embeddings: np.ndarray) -> None:
+        """
+        Add embeddings to the store.
+
+        :param keys: Keys of the embedded texts.
+        :param embeddings: Embeddings, one row per key.
+        """
+        embeddings = np.asarray(embeddings, dtype=self.dtype).reshape(len(keys), -1)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.meta_path, "w") as f:
+                json.dump({"model_id": self.model_id, "dim": self.dim,
+                          "dtype": self.dtype.str}, f)
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Embeddings have dimension {embeddings.shape[1]}, store for {self.model_id} has {self.dim}.")
+        # rows past the indexed ones are left over from an interrupted write
+        with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "wb") as f:
+            f.seek(len(self.index) * self.dim * self.dtype.itemsize)
+            f.write(embeddings.tobytes())
+            f.truncate()
+        with open(self.keys_path, "a") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+        for key in keys:
+            self.index[key] = len(self.index)
+
+    def encode(self, texts: List[str], encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of the texts, only texts missing from the store are passed to the encoder.
+
+        :param texts: The texts to embed.
+        :param encoder: Function embedding a list of texts.
+
+        :return: Array with a row per text.
+        """
+        keys = [text_key(text) for text in texts]
+        missing = {key: text for key, text in zip(
+            keys, texts) if key not in self.index}
+        if missing:
+            self.add(list(missing), encoder(list(missing.values())))
+        if self.keys_path.exists():
+            # mark as recently used
+            os.utime(self.keys_path)
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.asarray(self._memmap()[[self.index[key] for key in keys]], dtype=np.float32)
+
+
+class EmbeddingCache:
+    """
+    Embedding stores of each model, under a cache directory.
+    Stores are evicted least recently used first once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 4 * 1024 ** 3, dtype: np.dtype = np.float32):
+        """
+        :param cache_dir: Directory to store the embeddings in.
+        :param max_bytes: Maximum size of the cache.
+        :param dtype: Type the embeddings are stored as, float16 halves the size of the cache.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self._stores: Dict[str, EmbeddingStore] = {}
+
+    def _directory(self, model_id: str) -> Path:
+        return self.cache_dir / hashlib.sha1(model_id.encode("utf-8")).hexdigest()[:16]
+
+    def store(self, model_id: str) -> EmbeddingStore:
+        """
+        Get the embedding store of a model.
+
+        :param model_id: Identity of the model, see `model_identity`.
+
+        :return: The embedding store.
+        """
+        store = self._stores.get(model_id)
+        if store is None or not store.directory.exists():
+            store = EmbeddingStore(self._directory(model_id), model_id, self.dtype)
+            self._stores[model_id] = store
+        return store
+
+    def encode(self, model_id: str, texts: List[str], encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of the texts by a model, only texts which aren't cached are passed to the encoder.
+
+        :param model_id: Identity of the model, see `model_identity`.
+        :param texts: The texts to embed.
+        :param encoder: Function embedding a list of texts with the model.
+
+        :return: Array with a row per text.
+        """
+        store = self.store(model_id)
+        size = len(store)
+        embeddings = store.encode(texts, encoder)
+        if len(store) > size:
+            self.evict(keep=model_id)
+        return embeddings
+
+    @property
+    def size(self) -> int:
+        """Total size of the cache in bytes."""
+        return sum(f.stat().st_size for f in self.cache_dir.rglob("*") if f.is_file())
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove least recently used stores until the cache fits in `max_bytes`.
+
+        :param keep: Identity of a model whose store is never removed.
+        """
+        stores = []
+        for directory in self.cache_dir.iterdir():
+            if not directory.is_dir() or (keep is not None and directory == self._directory(keep)):
+                continue
+            files = [f for f in directory.iterdir() if f.is_file()]
+            used = max((f.stat().st_mtime for f in files), default=0)
+            stores.append(
+                (used, sum(f.stat().st_size for f in files), directory))
+        total = self.size
+        for _, size, directory in sorted(stores):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+    def invalidate(self, model_id: Optional[str] = None) -> int:
+        """
+        Remove cached embeddings, e.g. once a model has been fine-tuned.
+
+        :param model_id: Only remove the embeddings of this model. If None the whole cache is cleared.
+
+        :return: Number of stores removed.
+        """
+        if model_id is not None:
+            directories = [self._directory(model_id)]
+            self._stores.pop(model_id, None)
+        else:
+            directories = [d for d in self.cache_dir.iterdir() if d.is_dir()]
+            self._stores = {}
+        removed = 0
+        for directory in directories:
+            if directory.exists():
+                shutil.rmtree(directory)
+                removed += 1
+        return removed
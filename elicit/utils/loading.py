@@ -3,13 +3,17 @@ from pdfminer.pdfinterp import PDFPageInterpreter
 from pdfminer.converter import PDFPageAggregator, PDFResourceManager
 from pdfminer.layout import LAParams, LTTextBoxHorizontal
 from pdfminer.pdfpage import PDFPage
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from collections import deque
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Iterator, List, Optional, Tuple, Union
 import logging
 import warnings
 import yaml
 import re
 
+from elicit.utils.cache import PlaintextCache, file_hash
+
 logging.getLogger('pdfminer').setLevel(logging.ERROR)
 
 
@@ -43,17 +47,26 @@ def load_pdf(path: Path, pages: Optional[List[int]] = None) -> str:
     return doc
 
 
-def load_document(document_location: Path, pdf_kwargs: dict = {}):
+def load_document(document_location: Path, pdf_kwargs: dict = {}, cache: Optional[PlaintextCache] = None):
     """
     Load a document from a PDF or txt file.
 
     :param document_location: Path to the document.
     :param pdf_kwargs: Keyword arguments to pass to pdf_to_plaintext.
+    :param cache: Plaintext cache, if given PDFs are only parsed when their text isn't cached.
 
     :return: Document as a string.
     """
     if document_location.suffix == ".pdf":
-        return pdf_to_plaintext(document_location, **pdf_kwargs)
+        if cache is None:
+            return pdf_to_plaintext(document_location, **pdf_kwargs)
+        # hash the document once, for both the lookup and the insert
+        source_hash = file_hash(document_location)
+        text = cache.get(document_location, pdf_kwargs, source_hash)
+        if text is None:
+            text = pdf_to_plaintext(document_location, **pdf_kwargs)
+            cache.put(document_location, text, pdf_kwargs, source_hash)
+        return text
     elif document_location.suffix == ".txt":
         with open(document_location, "r") as f:
             text = f.read()
@@ -63,6 +76,77 @@ def load_document(document_location: Path, pdf_kwargs: dict = {}):
         raise ValueError(f"Unknown file type {document_location.suffix}")
 
 
+def _submit_document(pool: Executor, document: Path, pdf_kwargs: dict, cache: Optional[PlaintextCache]) -> Tuple[Future, Optional[str]]:
+    """
+    Submit a document to the pool, unless its text is cached.
+    The cache is only read (and written) by the calling process, workers just parse.
+
+    :param pool: Pool of worker processes.
+    :param document: Path to the document.
+    :param pdf_kwargs: Keyword arguments to pass to pdf_to_plaintext.
+    :param cache: Plaintext cache to read parsed PDFs from.
+
+    :return: Future of the document text, and the hash of the document if its text should be cached.
+    """
+    if cache is not None and document.suffix == ".pdf":
+        source_hash = file_hash(document)
+        text = cache.get(document, pdf_kwargs, source_hash)
+        if text is not None:
+            future = Future()
+            future.set_result(text)
+            return future, None
+        return pool.submit(load_document, document, pdf_kwargs), source_hash
+    return pool.submit(load_document, document, pdf_kwargs), None
+
+
+def iter_documents(documents: List[Path], workers: int = 0, prefetch: int = 8, pdf_kwargs: dict = {}, cache: Optional[PlaintextCache] = None, pool: Optional[Executor] = None) -> Iterator[Tuple[Path, str]]:
+    """
+    Load documents in order, parsing ahead of the consumer in a pool of worker processes.
+    At most `prefetch` documents are parsed (or waiting to be consumed) at once.
+    Cache lookups and inserts happen in the calling process, workers only parse the documents which aren't cached.
+
+    :param documents: Paths to the documents.
+    :param workers: Number of worker processes. 0 loads documents in the calling process.
+    :param prefetch: Maximum number of documents loaded ahead of the consumer.
+    :param pdf_kwargs: Keyword arguments to pass to pdf_to_plaintext.
+    :param cache: Plaintext cache to read parsed PDFs from (and write them to).
+    :param pool: Pool of worker processes to parse with, kept open for the caller to reuse.
+        If None, a pool of `workers` processes is created and shut down when the documents are exhausted.
+
+    :return: Iterator of (path, document text).
+    """
+    if pool is None and workers <= 0:
+        for document in documents:
+            yield document, load_document(document, pdf_kwargs, cache)
+        return
+    owned = pool is None
+    if owned:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    remaining = iter(documents)
+    try:
+        for document in remaining:
+            pending.append((document, *_submit_document(pool, document, pdf_kwargs, cache)))
+            if len(pending) >= max(prefetch, 1):
+                break
+        while pending:
+            document, future, source_hash = pending.popleft()
+            next_document = next(remaining, None)
+            if next_document is not None:
+                pending.append((next_document, *_submit_document(pool, next_document, pdf_kwargs, cache)))
+            text = future.result()
+            if source_hash is not None:
+                cache.put(document, text, pdf_kwargs, source_hash)
+            yield document, text
+    finally:
+        if owned:
+            pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            # the caller's pool outlives this pass, drop the documents parsed ahead of an early exit
+            for _, future, _ in pending:
+                future.cancel()
+
+
 def pdf_to_plaintext(pdf_location: Path, pages: Optional[List[int]] = None, newlines: bool = False, raw: bool = False) -> str:
     """
     Load a PDF file into a string. Contains some minor post-processing.
@@ -0,0 +1,85 @@
+"""Script containing the model profiles the transformer labelling functions can be loaded with."""
+from dataclasses import dataclass, replace
+from pathlib import Path
+import re
+from typing import Dict, Union
+
+import torch
+
+DEFAULT_QA_CHECKPOINT = "deepset/roberta-base-squad2"
+DEFAULT_SEQ_CHECKPOINT = "facebook/bart-large-mnli"
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """
+    Checkpoints the transformer labelling functions load, and how.
+    Checkpoints are names of pretrained models or paths to local directories.
+    Quantised models run with int8 weights on the CPU, and can't be fine-tuned.
+    """
+    name: str
+    qa_checkpoint: Union[str, Path] = DEFAULT_QA_CHECKPOINT
+    seq_checkpoint: Union[str, Path] = DEFAULT_SEQ_CHECKPOINT
+    quantize: bool = False
+    # approximate memory (MB) of the loaded models
+    qa_footprint: float = 500
+    seq_footprint: float = 1600
+
+    def fine_tuned(self, model_directory: Path, model_name: str) -> Path:
+        """
+        Directory the checkpoint of a model is saved in once fine-tuned.
+        Named after the checkpoint rather than the profile, so quantised profiles load the weights fine-tuned
+        with their unquantised base, and profiles with an overridden checkpoint don't share another checkpoint's weights.
+
+        :param model_directory: Directory where (fine-tuned) models are stored.
+        :param model_name: Name of the model, "qna_model" or "seq_model".
+
+        :return: Path of the fine-tuned model.
+        """
+        checkpoint, default = {
+            "qna_model": (self.qa_checkpoint, DEFAULT_QA_CHECKPOINT),
+            "seq_model": (self.seq_checkpoint, DEFAULT_SEQ_CHECKPOINT),
+        }[model_name]
+        if str(checkpoint) == default:
+            return Path(model_directory) / model_name
+        return Path(model_directory) / f"{model_name}_{re.sub(r'[^A-Za-z0-9]+', '-', str(checkpoint)).strip('-')}"
+
+
+PROFILES: Dict[str, ModelProfile] = {
+    "default": ModelProfile("default"),
+    "quantized": ModelProfile("quantized", quantize=True, qa_footprint=200, seq_footprint=650),
+    "distilled": ModelProfile("distilled", qa_checkpoint="deepset/tinyroberta-squad2",
+                              seq_checkpoint="valhalla/distilbart-mnli-12-1", qa_footprint=330, seq_footprint=900),
+    "distilled-quantized": ModelProfile("distilled-quantized", qa_checkpoint="deepset/tinyroberta-squad2",
+                                        seq_checkpoint="valhalla/distilbart-mnli-12-1", quantize=True,
+                                        qa_footprint=130, seq_footprint=380),
+}
+
+
+def get_profile(profile: Union[str, ModelProfile], **overrides) -> ModelProfile:
+    """
+    Get a model profile by name.
+
+    :param profile: Name of a profile in PROFILES, or a profile.
+    :param overrides: Fields of the profile to replace, e.g. a local `qa_checkpoint` directory.
+
+    :return: The model profile.
+    """
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(
+                f"Unknown model profile {profile}, expected one of {list(PROFILES)}.")
+        profile = PROFILES[profile]
+    return replace(profile, **overrides) if overrides else profile
+
+
+def quantize(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Dynamically quantise the linear layers of a model to int8, for inference on the CPU.
+
+    :param model: The model.
+
+    :return: The quantised model.
+    """
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
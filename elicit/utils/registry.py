@@ -0,0 +1,61 @@
+"""Script containing the registry of models shared by the labelling functions of an extractor."""
+from typing import Any, Callable, Dict, Hashable
+
+from elicit.utils.utils import LRUCache
+
+
+class ModelRegistry:
+    """
+    Hands out one loaded model per key (e.g. checkpoint and device) to the labelling functions which acquire it.
+    A model is freed once every labelling function holding it has released it.
+
+    Results computed with a model are memoised in `results`, keyed by (model key, result key),
+    which outlive the model itself so labelling functions run one after another still share them.
+    """
+
+    def __init__(self, result_cache_size: int = 65536):
+        """
+        :param result_cache_size: Number of memoised results kept.
+        """
+        self._models: Dict[Hashable, Any] = {}
+        self._holders: Dict[Hashable, int] = {}
+        self.results = LRUCache(result_cache_size)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._models
+
+    def acquire(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get the model for a key, loading it if no labelling function holds it.
+
+        :param key: Key identifying the model.
+        :param loader: Function loading the model.
+
+        :return: The model.
+        """
+        if key not in self._models:
+            self._models[key] = loader()
+        self._holders[key] = self._holders.get(key, 0) + 1
+        return self._models[key]
+
+    def release(self, key: Hashable) -> None:
+        """
+        Release a model, freeing it if no other labelling function holds it.
+
+        :param key: Key identifying the model.
+        """
+        if key not in self._holders:
+            return
+        self._holders[key] -= 1
+        if self._holders[key] == 0:
+            del self._holders[key]
+            del self._models[key]
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Forget the results computed with a model, e.g. once it has been fine-tuned.
+
+        :param key: Key identifying the model.
+        """
+        for stale in [k for k in self.results if k[0] == key]:
+            del self.results[stale]
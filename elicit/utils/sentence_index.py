@@ -0,0 +1,298 @@
+"""Script containing an approximate nearest neighbour index of the sentences of a corpus."""
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class SentenceIndex:
+    """
+    Inverted file (IVF) index of sentence embeddings, persisted in a directory.
+    Sentences are appended as documents are ingested. Once the index holds `train_factor * n_lists`
+    sentences the embeddings are clustered with k-means, and queries only score the sentences of the
+    `n_probe` clusters closest to the query. Until then, and for small indexes, every sentence is scored.
+    Scores are dot products, as in semantic search.
+    """
+
+    _row_columns = 5  # document, start char, end char, text start byte, text end byte
+
+    def __init__(self, directory: Path, n_lists: int = 256, n_probe: int = 16, train_factor: int = 32, dtype: np.dtype = np.float16, seed: int = 0):
+        """
+        :param directory: Directory the index is stored in.
+        :param n_lists: Number of clusters.
+        :param n_probe: Number of clusters searched per query.
+        :param train_factor: Sentences per cluster needed before clustering.
+        :param dtype: Type the embeddings are stored as.
+        :param seed: Seed for k-means.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_factor = train_factor
+        self.dtype = np.dtype(dtype)
+        self.seed = seed
+        self.dim: Optional[int] = None
+        if self._path("meta.json").exists():
+            with open(self._path("meta.json"), "r") as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+        # documents in ingestion order, a document ingested again supersedes its earlier rows
+        self.document_names: List[str] = []
+        self.documents: Dict[str, Tuple[int, str]] = {}
+        if self._path("documents.txt").exists():
+            with open(self._path("documents.txt"), "r") as f:
+                for line in f.read().splitlines():
+                    name, document_hash = line.rsplit("\t", 1)
+                    self.documents[name] = (
+                        len(self.document_names), document_hash)
+                    self.document_names.append(name)
+        # rows past the last document are left over from an interrupted write
+        rows = self._read_rows()
+        self.size = int(np.searchsorted(
+            rows[:, 0], len(self.document_names))) if len(rows) else 0
+        # end byte of the text of the last sentence
+        self._text_end = int(rows[self.size - 1, 4]) if self.size else 0
+        self._rows: Optional[np.memmap] = None
+        self._vectors: Optional[np.memmap] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.assignment = np.zeros(0, dtype=np.int32)
+        # assignments of the sentences added since, consolidated into `assignment` on search or save
+        self._pending_assignments: List[np.ndarray] = []
+        self.trained_size = 0
+        if self._path("ivf.npz").exists():
+            ivf = np.load(self._path("ivf.npz"))
+            self.centroids = ivf["centroids"]
+            self.assignment = ivf["assignment"][:self.size]
+            self.trained_size = int(ivf["trained_size"])
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._current: Optional[np.ndarray] = None
+        if self.centroids is not None and len(self.assignment) < self.size:
+            self.assignment = np.concatenate([self.assignment, self._assign(
+                np.arange(len(self.assignment), self.size))])
+
+    @classmethod
+    def for_database(cls, db_path: Path, **kwargs) -> "SentenceIndex":
+        """
+        Index stored next to an extraction database.
+
+        :param db_path: Path to the extraction database.
+
+        :return: The sentence index.
+        """
+        db_path = Path(db_path)
+        return cls(db_path.with_name(f"{db_path.stem}_sentences"), **kwargs)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / name
+
+    def _read_rows(self) -> np.ndarray:
+        if not self._path("rows.bin").exists():
+            return np.zeros((0, self._row_columns), dtype=np.int64)
+        return np.fromfile(self._path("rows.bin"), dtype=np.int64).reshape(-1, self._row_columns)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, document_name: str) -> bool:
+        return document_name in self.documents
+
+    @property
+    def rows(self) -> np.ndarray:
+        if self._rows is None or len(self._rows) != self.size:
+            self._rows = np.memmap(self._path("rows.bin"), dtype=np.int64, mode="r",
+                                   shape=(self.size, self._row_columns))
+        return self._rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None or len(self._vectors) != self.size:
+            self._vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r",
+                                      shape=(self.size, self.dim))
+        return self._vectors
+
+    def _append(self, name: str, data: bytes, offset: int) -> None:
+        path = self._path(name)
+        with open(path, "r+b" if path.exists() else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+
+    def add(self, document_name: str, document_hash: str, sentences: List[str], spans: List[Tuple[int, int]], embeddings: np.ndarray) -> bool:
+        """
+        Add the sentences of a document. Documents already indexed with the same text are skipped.
+
+        :param document_name: The name of the document.
+        :param document_hash: Hash of the document text.
+        :param sentences: The sentences of the document.
+        :param spans: Character start and end of each sentence in the document.
+        :param embeddings: Embedding of each sentence.
+
+        :return: Whether the document was added.
+        """
+        if self.documents.get(document_name, (None, None))[1] == document_hash:
+            return False
+        embeddings = np.asarray(embeddings)
+        keep = [i for i, sentence in enumerate(sentences) if sentence.strip()]
+        if self.dim is None and keep:
+            self.dim = embeddings.shape[1]
+            with open(self._path("meta.json"), "w") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.str}, f)
+        document_id = len(self.document_names)
+        text_offset = self._text_end
+        encoded = [sentences[i].encode("utf-8") for i in keep]
+        ends = text_offset + np.cumsum([len(e) for e in encoded], dtype=np.int64)
+        rows = np.zeros((len(keep), self._row_columns), dtype=np.int64)
+        rows[:, 0] = document_id
+        rows[:, 1:3] = np.asarray([spans[i] for i in keep],
+                                  dtype=np.int64).reshape(-1, 2)
+        rows[:, 3] = ends - [len(e) for e in encoded]
+        rows[:, 4] = ends
+        if keep:
+            self._append("texts.bin", b"".join(encoded), text_offset)
+            self._append("vectors.bin", embeddings[keep].astype(self.dtype).tobytes(),
+                         self.size * self.dim * self.dtype.itemsize)
+        self._append("rows.bin", rows.tobytes(),
+                     self.size * self._row_columns * 8)
+        # the document line marks the rows as written
+        with open(self._path("documents.txt"), "a") as f:
+            f.write(f"{document_name}\t{document_hash}\n")
+        self.documents[document_name] = (document_id, document_hash)
+        self.document_names.append(document_name)
+        self._current = None
+        self.size += len(keep)
+        if keep:
+            self._text_end = int(ends[-1])
+        if self.centroids is None and self.size >= self.train_factor * self.n_lists:
+            self.train()
+        elif self.centroids is not None and self.size > 4 * self.trained_size:
+            self.train()
+        elif self.centroids is not None and keep:
+            # assigned from the embeddings in memory, as stored, rather than re-reading the vectors
+            vectors = embeddings[keep].astype(self.dtype).astype(np.float32)
+            self._pending_assignments.append(
+                (vectors @ self.centroids.T).argmax(axis=1).astype(np.int32))
+            self._lists = None
+        return True
+
+    def _consolidate(self) -> np.ndarray:
+        if self._pending_assignments:
+            self.assignment = np.concatenate(
+                [self.assignment, *self._pending_assignments])
+            self._pending_assignments = []
+        return self.assignment
+
+    def _batches(self, rows: np.ndarray, batch_size: int = 65536):
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            yield batch, np.asarray(self.vectors[batch], dtype=np.float32)
+
+    def _assign(self, rows: np.ndarray) -> np.ndarray:
+        assignment = np.zeros(len(rows), dtype=np.int32)
+        position = 0
+        for batch, vectors in self._batches(rows):
+            assignment[position:position + len(batch)] = (
+                vectors @ self.centroids.T).argmax(axis=1)
+            position += len(batch)
+        return assignment
+
+    def train(self, iterations: int = 10, sample_size: Optional[int] = None) -> None:
+        """
+        Cluster the embeddings with (dot product) k-means and assign every sentence to its closest cluster.
+
+        :param iterations: Number of k-means iterations.
+        :param sample_size: Number of sentences the clusters are fitted on, defaults to 256 per cluster.
+        """
+        rng = np.random.RandomState(self.seed)
+        sample_size = sample_size or 256 * self.n_lists
+        n_lists = min(self.n_lists, self.size)
+        sample = np.sort(rng.choice(self.size, min(
+            self.size, sample_size), replace=False))
+        vectors = np.asarray(self.vectors[sample], dtype=np.float32)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = (vectors @ centroids.T).argmax(axis=1)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            centroids[empty] = vectors[rng.choice(
+                len(vectors), int(empty.sum()))]
+        self.centroids = centroids
+        self.assignment = self._assign(np.arange(self.size))
+        self._pending_assignments = []
+        self.trained_size = self.size
+        self._lists = None
+        self.save()
+
+    def save(self) -> None:
+        """Persist the clustering, the sentences themselves are written as they are added."""
+        if self.centroids is None:
+            return
+        np.savez(self._path("ivf.npz"), centroids=self.centroids,
+                 assignment=self._consolidate(), trained_size=self.trained_size)
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._lists is None:
+            assignment = self._consolidate()
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.searchsorted(
+                assignment[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.arange(self.size)
+        order, offsets = self._inverted_lists()
+        probe = np.argsort(-(self.centroids @ query))[:self.n_probe]
+        return np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe]))
+
+    def _current_documents(self) -> np.ndarray:
+        # rows of documents which have since been ingested again are stale
+        if self._current is None:
+            current = np.zeros(len(self.document_names), dtype=bool)
+            current[[document_id for document_id, _ in self.documents.values()]] = True
+            self._current = current
+        return self._current
+
+    def sentence(self, row: int) -> str:
+        """
+        Text of an indexed sentence.
+
+        :param row: Row of the sentence.
+
+        :return: The sentence.
+        """
+        start, end = self.rows[row, 3:5]
+        with open(self._path("texts.bin"), "rb") as f:
+            f.seek(int(start))
+            return f.read(int(end - start)).decode("utf-8")
+
+    def search(self, query_embeddings: np.ndarray, k: int = 10) -> List[Tuple[str, str, int, int, float]]:
+        """
+        Find the sentences of the corpus most similar to the queries, scored by dot product averaged over the queries.
+
+        :param query_embeddings: Embedding of each query.
+        :param k: Number of sentences to return.
+
+        :return: List of (document name, sentence, start char, end char, score), best first.
+        """
+        if self.size == 0:
+            return []
+        query = np.asarray(query_embeddings, dtype=np.float32).reshape(
+            -1, self.dim).mean(axis=0)
+        candidates = self._candidates(query)
+        candidates = candidates[self._current_documents()[self.rows[candidates, 0]]]
+        scores = np.concatenate([vectors @ query for _, vectors in self._batches(candidates)]) \
+            if len(candidates) else np.zeros(0, dtype=np.float32)
+        top = np.argsort(-scores, kind="stable")[:k]
+        results = []
+        for i in top:
+            row = candidates[i]
+            document_id, start, end = (int(v) for v in self.rows[row, :3])
+            results.append((self.document_names[document_id], self.sentence(row),
+                            start, end, float(scores[i])))
+        return results
@@ -1,8 +1,9 @@
 """Script containing various utility functions."""
 import functools
+import hashlib
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Set
-from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Set, Tuple
+from collections import Counter, OrderedDict
 import warnings
 
 
@@ -11,43 +12,40 @@ from spacy.matcher import Matcher
 import spacy
 
 
-def split_doc(doc: str, max_length: int = 512, token: str = ".") -> list:
-    """Split a document into sentences.
-    Splitting on the last period <Token> before the max length.
+class LRUCache(OrderedDict):
+    """Dictionary which drops its least recently used items once it holds more than `maxsize`."""
 
-    Args:
-        doc (str): Document to split.
-        max_length (int): Maximum length of each sentence.
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self.maxsize = maxsize
 
-    Returns:
-        list: List of sentences.
-    """
-    sections = []
-    current_end = 0
-    while current_end <= len(doc):
-        if current_end + max_length >= len(doc):
-            sections.append(doc[current_end:])
-            break
-        section_end = doc[current_end:current_end +
-                          max_length].rfind(token) + current_end
-        sections += [doc[current_end:section_end]]
-        current_end = section_end
-    return sections
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
 
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
 
-def context_from_doc_char(doc: str, start_idx: int, end_idx: int, padding: int = 100) -> str:
+
+def context_span(doc: str, start_idx: int, end_idx: int, padding: int = 100) -> Tuple[int, int]:
     """
-    Extracts the context from the document based on the start and end indices.
+    Character span of the context around the start and end indices,
+    widened to the surrounding sentence / clause boundaries.
 
     :param doc: The document.
     :param start_idx: The start index.
     :param end_idx: The end index.
     :param padding: The padding to add to the start and end indices.
 
-    :return: The context as a string.
+    :return: The start and end indices of the context.
     """
     if padding == 0:
-        return doc[start_idx:end_idx]
+        return start_idx, end_idx
     start_idx = max(0, start_idx - (padding // 2))
     end_idx = min(len(doc), end_idx + (padding // 2))
 
@@ -55,9 +53,54 @@ def context_from_doc_char(doc: str, start_idx: int, end_idx: int, padding: int =
                     for s in [".", ",", "\n"]]]) + 1
     end_idx = min([len(doc), *[idx + end_idx for idx in [doc[end_idx:].find(s) for s in [".", ",", "\n"]] if idx != 0]])
 
+    return start_idx, end_idx
+
+
+def context_from_doc_char(doc: str, start_idx: int, end_idx: int, padding: int = 100) -> str:
+    """
+    Extracts the context from the document based on the start and end indices.
+
+    :param doc: The document.
+    :param start_idx: The start index.
+    :param end_idx: The end index.
+    :param padding: The padding to add to the start and end indices.
+
+    :return: The context as a string.
+    """
+    start_idx, end_idx = context_span(doc, start_idx, end_idx, padding)
     return doc[start_idx: end_idx]
 
 
+def contexts_from_span(doc: str, start_idx: int, end_idx: int, local_padding: int = 75, wider_padding: int = 300) -> Tuple[str, str, str]:
+    """
+    Slices the exact, local and wider contexts of a span from the document.
+
+    :param doc: The document.
+    :param start_idx: The start index.
+    :param end_idx: The end index.
+    :param local_padding: The padding for the local context.
+    :param wider_padding: The padding for the wider context.
+
+    :return: The exact, local and wider contexts.
+    """
+    return (doc[start_idx:end_idx],
+            context_from_doc_char(doc, start_idx, end_idx, local_padding),
+            context_from_doc_char(doc, start_idx, end_idx, wider_padding))
+
+
+@functools.lru_cache(maxsize=32)
+def text_hash(text: str) -> str:
+    """
+    Hash of a document's text, used to check character offsets refer to the same text.
+    Cached, as every extraction from a document hashes the same text.
+
+    :param text: The document text.
+
+    :return: Hex digest of the text.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
 def is_remarks(doc: str, filename: str) -> str:
     """
     Extracts whether the document is sentencing remarks.
@@ -0,0 +1,72 @@
+"""Script which times the hot paths of the WeaSuL label model on a synthetic label matrix."""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from user_interface.server.label_model import LabelModel
+
+
+def timed(name: str, fn, repeat: int):
+    """
+    Run a function, printing the best time of its repeats.
+
+    :param name: Name printed with the time.
+    :param fn: Function taking no arguments.
+    :param repeat: Number of times to run the function.
+
+    :return: Result of the last run.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28}{best:>10.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--lfs", type=int, default=10,
+                        help="Number of weak labels (labelling functions).")
+    parser.add_argument("--abstain", type=float, default=0.3,
+                        help="Probability a weak label abstains.")
+    parser.add_argument("--epochs", type=int, default=5,
+                        help="Epochs of the active learning fit.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    torch.manual_seed(0)
+    vote = (1 - args.abstain) / 2
+    label_matrix = rng.choice([-1, 0, 1], size=(args.rows, args.lfs),
+                              p=[args.abstain, vote, vote])
+    labels = np.where(rng.random(args.rows) < 0.01,
+                      rng.integers(0, 2, args.rows), -1)
+    cliques = [[i] for i in range(args.lfs)]
+    class_balance = np.array([0.5, 0.5])
+    print(f"{args.rows} rows x {args.lfs} weak labels")
+
+    model = LabelModel(n_epochs=args.epochs, hide_progress_bar=True)
+    model.init_label_model(label_matrix, cliques, class_balance)
+    timed("get_psi", lambda: model.get_psi(
+        label_matrix, cliques, args.lfs), args.repeat)
+    timed("create_mask", model.create_mask, args.repeat)
+
+    model.fit(label_matrix, cliques, class_balance)
+    new_matrix = label_matrix.copy()
+    timed("predict (new data)", lambda: model.predict(
+        new_matrix, model.mu, model.E_S), args.repeat)
+
+    def active_fit():
+        model.active_learning = True
+        model.ground_truth_labels = labels
+        model.fit(label_matrix, cliques, class_balance, labels)
+    timed(f"active fit ({args.epochs} epochs)", active_fit, 1)
+
+
+if __name__ == "__main__":
+    main()
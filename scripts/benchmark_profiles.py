@@ -0,0 +1,100 @@
+"""Script which compares the throughput and agreement of the model profiles on the test documents."""
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from elicit.extractor import Extractor
+from elicit.generic_labelling_functions import NLILabellingFunction, SimilarityLabellingFunction
+from elicit.utils.profiles import PROFILES
+
+root = Path(__file__).parent.parent
+document_path = root / "tests" / "test_documents"
+schema_path = root / "schema"
+
+
+def top_values(db_path: Path) -> Dict[Tuple[str, str, str], str]:
+    """
+    Most confident value of each (document, variable, labelling function).
+
+    :param db_path: Path to the extraction database.
+
+    :return: Dictionary of (document, variable, method): value.
+    """
+    db = sqlite3.connect(db_path)
+    rows = db.execute("""
+        SELECT document.document_name, variable.variable_name, raw_extraction.method, variable.variable_value,
+               SUM(CAST(raw_extraction.confidence AS REAL)) AS confidence
+        FROM raw_extraction
+        JOIN extraction ON extraction.extraction_id = raw_extraction.extraction_id
+        JOIN variable ON variable.variable_id = extraction.variable_id
+        JOIN document ON document.document_id = variable.document_id
+        GROUP BY document.document_name, variable.variable_name, raw_extraction.method, variable.variable_value
+        ORDER BY confidence
+    """).fetchall()
+    db.close()
+    # ordered by confidence, so the most confident value is written last
+    return {(document, variable, method): value for document, variable, method, value, _ in rows}
+
+
+def run_profile(profile: str, documents: List[Path], db_path: Path, device: int) -> float:
+    """
+    Extract the documents with the NLI and similarity labelling functions of a profile.
+
+    :param profile: Name of the model profile.
+    :param documents: Paths of the documents.
+    :param db_path: Path to the extraction database.
+    :param device: Device to run the models on.
+
+    :return: Seconds taken to extract the documents, excluding loading the models.
+    """
+    extractor = Extractor(db_path=db_path, device=device, top_k=3)
+    extractor.register_schema(schema_path / "questions.yml", "questions")
+    extractor.register_schema(schema_path / "categories.yml", "categories")
+    extractor.register_schema(schema_path / "keywords.yml", "keywords")
+    extractor.register_labelling_function(
+        NLILabellingFunction, {"model_profile": profile})
+    extractor.register_labelling_function(
+        SimilarityLabellingFunction, {"model_profile": profile})
+    extractor._prepare_db(documents)
+    for lf_obj in extractor.lfs:
+        lf_obj.load(extractor.model_path, device)
+    start = time.perf_counter()
+    with extractor.logger.transaction():
+        for doc, text in extractor._load_documents(documents):
+            for lf_obj in extractor.lfs:
+                extractor._extract_document(lf_obj, doc.stem, text)
+    elapsed = time.perf_counter() - start
+    for lf_obj in extractor.lfs:
+        lf_obj.unload()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES),
+                        choices=list(PROFILES))
+    parser.add_argument("--device", type=int, default=-1,
+                        help="Device to run the models on, -1 for the CPU.")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of times each test document is extracted.")
+    args = parser.parse_args()
+    profiles = ["default"] + [p for p in args.profiles if p != "default"]
+    documents = sorted(document_path.glob("*.txt")) * args.repeat
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for profile in profiles:
+            db_path = Path(directory) / f"{profile}.sqlite"
+            elapsed = run_profile(profile, documents, db_path, args.device)
+            results[profile] = (elapsed, top_values(db_path))
+    reference = results["default"][1]
+    print(f"{'profile':<22}{'seconds':>10}{'docs/s':>10}{'agreement':>12}")
+    for profile, (elapsed, values) in results.items():
+        agreement = sum(values.get(key) == value for key, value in reference.items()) / max(1, len(reference))
+        print(f"{profile:<22}{elapsed:>10.2f}{len(documents) / elapsed:>10.2f}{agreement:>12.2%}")
+
+
+if __name__ == "__main__":
+    main()
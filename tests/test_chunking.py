@@ -0,0 +1,64 @@
+import re
+
+import pytest
+
+from elicit.utils.chunking import TokenChunker, chunk_characters
+
+
+class WhitespaceTokenizer:
+    """Tokenizes on whitespace, returning offsets like a fast tokenizer."""
+
+    model_max_length = 512
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False):
+        self.calls += 1
+        offsets = [m.span() for m in re.finditer(r"\S+", text)]
+        return {"input_ids": list(range(len(offsets))), "offset_mapping": offsets}
+
+
+def test_short_document_single_chunk():
+    chunker = TokenChunker(WhitespaceTokenizer(), max_length=20, question_tokens=4, stride=4)
+    chunks = chunker.chunks("A short document.")
+    assert [(c.text, c.start, c.end) for c in chunks] == [("A short document.", 0, 17)]
+
+
+def test_windows_fill_budget_and_overlap():
+    text = " ".join(f"w{i}" for i in range(100))
+    tokenizer = WhitespaceTokenizer()
+    chunker = TokenChunker(tokenizer, max_length=20, question_tokens=4, stride=4)
+    chunks = chunker.chunks(text)
+    for chunk in chunks:
+        assert text[chunk.start:chunk.end] == chunk.text
+        assert len(chunk.text.split()) <= 16
+    assert all(len(c.text.split()) == 16 for c in chunks[:-1])
+    # consecutive windows share `stride` tokens and together cover the document
+    for a, b in zip(chunks, chunks[1:]):
+        assert a.text.split()[-4:] == b.text.split()[:4]
+    assert chunks[0].start == 0 and chunks[-1].end == len(text)
+    # the tokenisation is cached
+    chunker.chunks(text)
+    assert tokenizer.calls == 1
+
+
+def test_windows_end_at_sentences():
+    text = " ".join(f"w{i}." if i % 3 == 2 else f"w{i}" for i in range(60))
+    chunker = TokenChunker(WhitespaceTokenizer(), max_length=20, question_tokens=4, stride=2)
+    chunks = chunker.chunks(text)
+    assert all(c.text.endswith(".") for c in chunks[:-1])
+    assert chunks[-1].end == len(text)
+
+
+def test_stride_must_fit():
+    with pytest.raises(ValueError):
+        TokenChunker(WhitespaceTokenizer(), max_length=20, question_tokens=10, stride=10)
+
+
+def test_chunk_characters():
+    text = ("The defendant pleaded guilty to theft. " * 30)
+    chunks = chunk_characters(text, max_length=100, min_length=10)
+    assert "".join(c.text for c in chunks) == text
+    assert all(len(c.text) <= 100 for c in chunks)
+    assert all(text[c.start:c.end] == c.text for c in chunks)
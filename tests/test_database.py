@@ -1,10 +1,12 @@
 """Functions to test the DB utils."""
 from venv import create
 import pytest
+import sqlite3
 from io import StringIO
 
 import pandas as pd
 
+from database.db_utils import build_tables, connect_db, migrate, migrations_path, query_db, schema_path, schema_version
 from user_interface.server.app import create_app
 from .common import database
 
@@ -26,3 +28,31 @@ def test_download_data(server):
     assert all(data.columns == ["document_name",
                *[f"var_{i}" for i in range(2)]])
     assert len(data) == 100
+
+
+def _latest_version():
+    return max(int(p.name.split("_")[0]) for p in migrations_path.glob("*.sql"))
+
+
+def test_new_database_is_migrated(tmp_path):
+    db = connect_db(tmp_path / "new.sqlite")
+    assert schema_version(db) == _latest_version()
+    indexes = [row[0] for row in query_db(
+        db, "SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert "idx_variable_name_value_document" in indexes
+    assert "idx_raw_extraction_extraction_method" in indexes
+
+
+def test_existing_database_is_upgraded(tmp_path):
+    db_path = tmp_path / "old.sqlite"
+    db = sqlite3.connect(db_path)
+    build_tables(db, schema_path)
+    db.execute(
+        "INSERT INTO document (document_id, document_name) VALUES (0, 'doc')")
+    db.commit()
+    assert schema_version(db) == 0
+    db.close()
+    db = connect_db(db_path)
+    assert schema_version(db) == _latest_version()
+    assert query_db(db, "SELECT document_name FROM document") == [("doc",)]
+    assert migrate(db) == _latest_version()
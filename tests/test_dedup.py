@@ -0,0 +1,79 @@
+from difflib import SequenceMatcher
+import random
+
+from elicit.interface import Extraction
+import pytest
+
+from elicit.utils.dedup import ContextEvidenceIndex, ExhaustiveEvidenceIndex, SpanEvidenceIndex
+
+TEXT = (
+    "The defendant pleaded guilty to the offence at the first opportunity. "
+    "He has previous convictions for theft and burglary. The victim suffered "
+    "serious injuries and was taken to hospital. The offence was committed in "
+    "breach of a suspended sentence order. I take into account his remorse. "
+) * 3
+
+
+def _brute_force(rows, extraction):
+    """Reference matching, comparing against every stored row."""
+    for extraction_id, exact, local, wider in rows:
+        if exact in extraction.local_context or extraction.exact_context in local \
+                or SequenceMatcher(None, wider, extraction.wider_context).ratio() > 0.7:
+            return extraction_id
+    return -1
+
+
+def _random_extraction(rng):
+    start = rng.randrange(0, len(TEXT) - 40)
+    end = start + rng.randrange(5, 30)
+    return Extraction.from_character_startend(TEXT, "value", 0.5, start, end)
+
+
+@pytest.mark.parametrize("index_type", [ExhaustiveEvidenceIndex, ContextEvidenceIndex])
+def test_index_matches_brute_force(index_type):
+    rng = random.Random(0)
+    index = index_type()
+    rows = []
+    for i in range(300):
+        extraction = _random_extraction(rng)
+        expected = _brute_force(rows, extraction)
+        assert index.find(extraction) == expected
+        if expected < 0:
+            rows.append((i, extraction.exact_context,
+                        extraction.local_context, extraction.wider_context))
+            index.add(i, extraction)
+
+
+def test_context_index_similar_wider_context():
+    index = ContextEvidenceIndex()
+    index.add(0, Extraction("value", "guilty", "pleaded guilty",
+                            TEXT[:150], 0.5, None, None))
+    same = Extraction("value", "remorse", "his remorse",
+                      TEXT[5:150], 0.5, None, None)
+    different = Extraction("value", "remorse", "his remorse",
+                           "completely unrelated wider context " * 5, 0.5, None, None)
+    assert index.find(same) == 0
+    assert index.find(different) == -1
+
+
+def test_span_index_overlap():
+    index = SpanEvidenceIndex()
+    index.add(0, Extraction.from_character_startend(TEXT, "value", 0.5, 4, 30))
+    overlapping = Extraction.from_character_startend(TEXT, "value", 0.5, 20, 40)
+    # same text further on in the document, a context match but a different span
+    repeated = Extraction.from_character_startend(
+        TEXT, "value", 0.5, 4 + len(TEXT) // 3, 30 + len(TEXT) // 3)
+    assert index.find(overlapping) == 0
+    assert index.find(repeated) == -1
+
+    context_index = ContextEvidenceIndex()
+    context_index.add(0, Extraction.from_character_startend(TEXT, "value", 0.5, 4, 30))
+    assert context_index.find(repeated) == 0
+
+
+def test_span_index_falls_back_to_context():
+    index = SpanEvidenceIndex()
+    index.add(0, Extraction("value", "guilty", "pleaded guilty",
+                            None, 0.5, None, None))
+    assert index.find(Extraction.from_character_startend(
+        TEXT, "value", 0.5, 23, 29)) == 0
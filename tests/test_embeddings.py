@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+
+from elicit.utils.embeddings import EmbeddingCache, model_identity
+
+
+class CountingEncoder:
+    def __init__(self, dim: int = 8):
+        self.dim = dim
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded += texts
+        return np.stack([np.full(self.dim, len(text), dtype=np.float32) for text in texts])
+
+
+def test_only_new_text_is_embedded(tmp_path):
+    encoder = CountingEncoder()
+    cache = EmbeddingCache(tmp_path)
+    first = cache.encode("model", ["a", "bb", "a"], encoder)
+    assert encoder.encoded == ["a", "bb"]
+    assert first.shape == (3, 8) and first[0, 0] == 1 and first[1, 0] == 2
+    # a new cache over the same directory reads the stored embeddings
+    second = EmbeddingCache(tmp_path).encode("model", ["bb", "ccc"], encoder)
+    assert encoder.encoded == ["a", "bb", "ccc"]
+    assert np.array_equal(second[:, 0], [2, 3])
+
+
+def test_models_are_kept_apart(tmp_path):
+    encoder = CountingEncoder()
+    cache = EmbeddingCache(tmp_path, dtype=np.float16)
+    cache.encode("model", ["a"], encoder)
+    cache.encode("other", ["a"], encoder)
+    assert encoder.encoded == ["a", "a"]
+    assert cache.invalidate("model") == 1
+    cache.encode("model", ["a"], encoder)
+    cache.encode("other", ["a"], encoder)
+    assert encoder.encoded == ["a", "a", "a"]
+
+
+def test_eviction(tmp_path):
+    encoder = CountingEncoder(dim=256)
+    cache = EmbeddingCache(tmp_path, max_bytes=4096)
+    cache.encode("old", ["a", "b"], encoder)
+    cache.encode("new", ["c", "d"], encoder)
+    # the least recently used store is evicted to make room
+    assert not cache._directory("old").exists()
+    assert cache._directory("new").exists()
+
+
+def test_model_identity(tmp_path):
+    assert model_identity("all-MiniLM-L6-v2") == "all-MiniLM-L6-v2"
+    (tmp_path / "weights.bin").write_bytes(b"weights")
+    before = model_identity(tmp_path)
+    os.utime(tmp_path / "weights.bin", ns=(0, 0))
+    assert model_identity(tmp_path) != before
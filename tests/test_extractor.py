@@ -1,10 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Union
 
 import pytest
 
+from elicit import extractor as extractor_module
 from elicit.extractor import Extractor
 from elicit.interface import CategoricalLabellingFunction, Extraction
+from elicit.utils import loading
 
 
 class ExampleLabellingFunction(CategoricalLabellingFunction):
@@ -101,3 +104,115 @@ def test_loading(extractor):
 def test_training(extractor):
     assert "Hello." in extractor.schemas["keywords"]["variable1"]["cat1"]
     assert "Goodbye." in extractor.schemas["keywords"]["variable2"]["cat2"]
+
+
+class LargeExampleLabellingFunction(ExampleLabellingFunction):
+    @property
+    def memory_footprint(self) -> float:
+        return 10
+
+
+def test_document_major_schedule(tmp_path):
+    schema_path = Path(__file__).parent / "test_schema"
+    document_path = Path(__file__).parent / "test_documents"
+
+    extractor = Extractor(tmp_path / "document_major.sqlite")
+    extractor.register_schema(
+        schema_path / "test_categories.yml", "categories")
+    extractor.register_schema(schema_path / "test_keywords.yml", "keywords")
+    extractor.register_labelling_function(LargeExampleLabellingFunction)
+    extractor.register_labelling_function(LargeExampleLabellingFunction)
+    assert len(extractor._resident_groups(None)) == 1
+    assert len(extractor._resident_groups(15)) == 2
+    extractor.run(list(document_path.glob("*.txt")),
+                  schedule="document", memory_budget=15)
+    assert extractor.logger.db.execute(
+        "SELECT COUNT(*) FROM extraction").fetchone()[0] == 14
+
+
+def test_worker_pool_shared_by_passes(tmp_path, monkeypatch):
+    schema_path = Path(__file__).parent / "test_schema"
+    documents = list((Path(__file__).parent / "test_documents").glob("*.txt"))
+    pools = []
+
+    class CountedPool(ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+    monkeypatch.setattr(extractor_module, "ProcessPoolExecutor", CountedPool)
+    monkeypatch.setattr(loading, "ProcessPoolExecutor", None)
+
+    extractor = Extractor(tmp_path / "pool.sqlite", workers=2)
+    extractor.register_schema(
+        schema_path / "test_categories.yml", "categories")
+    extractor.register_schema(schema_path / "test_keywords.yml", "keywords")
+    extractor.register_labelling_function(ExampleLabellingFunction)
+    extractor.register_labelling_function(ExampleLabellingFunction)
+    extractor.run(documents)
+    # one pool for both labelling function passes, shut down with the run
+    assert len(pools) == 1
+    assert extractor._pool is None
+    assert extractor.logger.db.execute(
+        "SELECT COUNT(*) FROM extraction").fetchone()[0] == 14
+
+
+class BatchedExampleLabellingFunction(ExampleLabellingFunction):
+    calls = []
+
+    def extract_many(self, document_name: str, variables: List[str], document_text: str) -> None:
+        self.calls.append((document_name, variables))
+        super().extract_many(document_name, variables, document_text)
+
+
+def test_extract_many(tmp_path):
+    schema_path = Path(__file__).parent / "test_schema"
+    documents = list((Path(__file__).parent / "test_documents").glob("*.txt"))
+
+    extractor = Extractor(tmp_path / "extract_many.sqlite")
+    extractor.register_schema(
+        schema_path / "test_categories.yml", "categories")
+    extractor.register_schema(schema_path / "test_keywords.yml", "keywords")
+    extractor.register_labelling_function(BatchedExampleLabellingFunction)
+    extractor.run(documents)
+    # one call per document, covering every variable
+    assert len(BatchedExampleLabellingFunction.calls) == len(documents)
+    assert all(variables == extractor.variables
+               for _, variables in BatchedExampleLabellingFunction.calls)
+    assert extractor.logger.db.execute(
+        "SELECT COUNT(*) FROM extraction").fetchone()[0] == 14
+
+
+class IndexedExampleLabellingFunction(ExampleLabellingFunction):
+    def __init__(self, schemas, logger, sentence_index=None, **kwargs):
+        super().__init__(schemas, logger, **kwargs)
+        self.sentence_index = sentence_index
+
+
+def test_sentence_index_passed_to_labelling_functions(tmp_path):
+    schema_path = Path(__file__).parent / "test_schema"
+    extractor = Extractor(tmp_path / "indexed.sqlite", sentence_index=True)
+    extractor.register_schema(
+        schema_path / "test_categories.yml", "categories")
+    extractor.register_schema(schema_path / "test_keywords.yml", "keywords")
+    extractor.register_labelling_function(IndexedExampleLabellingFunction)
+    extractor.register_labelling_function(ExampleLabellingFunction)
+    assert extractor.lfs[0].sentence_index is extractor.sentence_index
+    assert extractor.sentence_index.directory == tmp_path / "indexed_sentences"
+
+
+class SharedModelExampleLabellingFunction(ExampleLabellingFunction):
+    def __init__(self, schemas, logger, model_registry=None, **kwargs):
+        super().__init__(schemas, logger, **kwargs)
+        self.model_registry = model_registry
+
+
+def test_model_registry_shared_by_labelling_functions(tmp_path):
+    schema_path = Path(__file__).parent / "test_schema"
+    extractor = Extractor(tmp_path / "shared.sqlite")
+    extractor.register_schema(
+        schema_path / "test_categories.yml", "categories")
+    extractor.register_schema(schema_path / "test_keywords.yml", "keywords")
+    extractor.register_labelling_function(SharedModelExampleLabellingFunction)
+    extractor.register_labelling_function(SharedModelExampleLabellingFunction)
+    assert extractor.lfs[0].model_registry is extractor.model_registry
+    assert extractor.lfs[1].model_registry is extractor.model_registry
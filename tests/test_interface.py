@@ -25,6 +25,18 @@ def test_extract_from_char_startend():
     assert extract.wider_context == "This is a test"
 
 
+def test_extract_keeps_offsets():
+    """
+    Tests that extractions from a character start and end index keep the offsets into the document.
+    """
+    doc = "This is a test"
+    extract = Extraction.from_character_startend(doc, "test", 1, 10, 14)
+    assert (extract.start, extract.end) == (10, 14)
+    assert doc[extract.start:extract.end] == extract.exact_context
+    assert extract.document_hash == Extraction.from_character_startend(
+        doc, "test", 1, 0, 4).document_hash
+
+
 def test_extract_from_spacy():
     """
     Tests that the case_extraction.case.extraction class can handle extract from a spacy object.
@@ -0,0 +1,55 @@
+import pytest
+
+from elicit.generic_labelling_functions.keyword_search import KeywordMatchLF, exact_match, load_tokenizer
+from elicit.interface import ElicitLogger
+
+
+class BlankKeywordMatchLF(KeywordMatchLF):
+    spacy_model = "blank:en"
+
+
+TEXT = "The defendant pleaded Guilty to theft. He was guilty of burglary before."
+
+SCHEMAS = {
+    "keywords": {
+        "plea": {"guilty": ["guilty", "pleaded guilty"], "not guilty": ["not guilty"]},
+        "offence": {"theft": ["theft"], "burglary": ["burglary"]},
+    },
+    "categories": {
+        "plea": ["guilty", "not guilty"],
+        "offence": ["theft", "burglary"],
+    },
+}
+
+
+def test_keyword_match_all_variables(tmp_path):
+    logger = ElicitLogger(tmp_path / "keywords.sqlite")
+    lf = BlankKeywordMatchLF(SCHEMAS, logger)
+    lf.load(tmp_path, "cpu")
+    lf.extract("doc", "plea", TEXT)
+    lf.extract("doc", "offence", TEXT)
+    # the document is tokenised and matched once for both variables
+    assert len(lf._document_matches) == 1
+    values = {row[0] for row in logger.db.execute(
+        "SELECT DISTINCT variable_value FROM variable")}
+    assert values == {"guilty", "theft", "burglary"}
+    exact = {row[0] for row in logger.db.execute(
+        "SELECT exact_context FROM extraction")}
+    assert {"pleaded Guilty", "theft", "burglary"} <= exact
+    lf.unload()
+    assert not lf.loaded and lf.matcher is None
+
+
+def test_keyword_match_unknown_variable(tmp_path):
+    lf = BlankKeywordMatchLF(SCHEMAS, ElicitLogger(tmp_path / "keywords.sqlite"))
+    lf.load(tmp_path, "cpu")
+    with pytest.raises(KeyError):
+        lf.extract("doc", "pleas", TEXT)
+
+
+def test_exact_match_single_field(monkeypatch):
+    monkeypatch.setattr(
+        "elicit.generic_labelling_functions.keyword_search.load_tokenizer",
+        lambda: load_tokenizer("blank:en"))
+    extractions = exact_match(TEXT, {"theft": ["THEFT"]})
+    assert [(e.value, e.exact_context) for e in extractions] == [("theft", "theft")]
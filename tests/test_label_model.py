@@ -0,0 +1,101 @@
+import itertools
+
+import numpy as np
+import pytest
+import torch
+
+from user_interface.server import label_model
+from user_interface.server.label_model import LabelModel
+
+
+def reference_psi(label_matrix, nr_wl):
+    psi_list = []
+    wl_idx = {}
+    col_counter = 0
+    for i in range(nr_wl):
+        wl = label_matrix[:, i]
+        wl_onehot = np.array([wl[:, None], 1 - wl[:, None]]).squeeze().T
+        psi_list.append(wl_onehot)
+        wl_idx[str(i)] = list(range(col_counter, col_counter + wl_onehot.shape[1]))
+        col_counter += wl_onehot.shape[1]
+    return np.hstack(psi_list), wl_idx
+
+
+def reference_mask(wl_idx):
+    size = max(max(wl_idx.values())) + 1
+    mask = np.ones((size, size))
+    for key in wl_idx.keys():
+        mask[wl_idx[key][0]: wl_idx[key][-1] + 1, wl_idx[key][0]: wl_idx[key][-1] + 1] = 0
+        key = key.split("_")
+        clique_list = list(itertools.chain.from_iterable(
+            itertools.combinations(key, r) for r in range(len(key) + 1) if r > 0))
+        for pair in itertools.permutations(["_".join(clique) for clique in clique_list], r=2):
+            i = wl_idx[pair[0]]
+            j = wl_idx[pair[1]]
+            mask[i[0]:i[-1] + 1, j[0]:j[-1] + 1] = 0
+    return mask
+
+
+def reference_marginals(label_matrix):
+    N, nr_wl = label_matrix.shape
+    lambda_combs, lambda_index, lambda_counts = (
+        np.unique(label_matrix, axis=0, return_counts=True, return_inverse=True))
+    new_counts = lambda_counts.copy()
+    rows_not_abstain, cols_not_abstain = np.where(lambda_combs != -1)
+    for i, comb in enumerate(lambda_combs):
+        nr_non_abstain = (comb != -1).sum()
+        if nr_non_abstain < nr_wl:
+            if nr_non_abstain == 0:
+                new_counts[i] = 0
+            else:
+                cols = cols_not_abstain[rows_not_abstain == i]
+                match_rows = np.where((lambda_combs[:, cols] == lambda_combs[i, cols]).all(axis=1))
+                new_counts[i] = lambda_counts[match_rows].sum()
+    return (new_counts / N)[lambda_index.reshape(-1)]
+
+
+@pytest.fixture
+def label_matrix():
+    rng = np.random.default_rng(0)
+    return rng.choice([-1, 0, 1], size=(2000, 5), p=[0.3, 0.35, 0.35])
+
+
+def test_psi_parity(label_matrix):
+    model = LabelModel()
+    psi, wl_idx = model.get_psi(label_matrix, [[i] for i in range(5)], 5)
+    expected_psi, expected_idx = reference_psi(label_matrix, 5)
+    np.testing.assert_array_equal(psi, expected_psi)
+    assert psi.dtype == expected_psi.dtype
+    assert wl_idx == expected_idx
+
+
+@pytest.mark.parametrize("cliques", [[[i] for i in range(5)], [[0, 1], [2, 3, 4]]])
+def test_mask_parity(label_matrix, cliques):
+    model = LabelModel()
+    _, model.wl_idx = model.get_psi(label_matrix, cliques, 5)
+    np.testing.assert_array_equal(model.create_mask(), reference_mask(model.wl_idx))
+
+
+@pytest.mark.parametrize("dense", [True, False])
+@pytest.mark.parametrize("values", [[-1, 0, 1], [-1, 0.25, 0.5, 1.0]])
+def test_marginal_parity(values, dense, monkeypatch):
+    if not dense:
+        monkeypatch.setattr(label_model, "MAX_DENSE_COUNTS", 0)
+    rng = np.random.default_rng(1)
+    label_matrix = rng.choice(values, size=(3000, 6))
+    np.testing.assert_allclose(LabelModel().marginal_probs(label_matrix), reference_marginals(label_matrix))
+    # a subset, estimated from the counts of the whole dataset
+    subset = label_matrix[[3, 10, 500, 2999]]
+    np.testing.assert_allclose(
+        LabelModel().marginal_probs(subset, LabelModel.combination_counts(label_matrix)),
+        reference_marginals(label_matrix)[[3, 10, 500, 2999]])
+
+
+def test_fit_predict(label_matrix):
+    torch.manual_seed(0)
+    model = LabelModel(n_epochs=20, hide_progress_bar=True)
+    model.fit(label_matrix, [[i] for i in range(5)], np.array([0.5, 0.5]))
+    preds = model.predict()
+    # predicting the train label matrix as a new dataset gives the same labels
+    np.testing.assert_allclose(
+        model.predict(label_matrix.copy(), model.mu, model.E_S).detach().numpy(), preds.detach().numpy())
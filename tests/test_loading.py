@@ -0,0 +1,108 @@
+from pathlib import Path
+
+from elicit.utils import loading
+from elicit.utils.cache import PlaintextCache
+from elicit.utils.loading import iter_documents, load_document
+
+document_path = Path(__file__).parent / "test_documents"
+
+
+def test_iter_documents_in_process():
+    documents = sorted(document_path.glob("*.txt"))
+    loaded = list(iter_documents(documents))
+    assert [doc for doc, _ in loaded] == documents
+    assert [text for _, text in loaded] == [
+        load_document(doc) for doc in documents]
+
+
+def test_iter_documents_worker_pool():
+    documents = sorted(document_path.glob("*.txt")) * 5
+    serial = list(iter_documents(documents))
+    parallel = list(iter_documents(documents, workers=2, prefetch=3))
+    assert parallel == serial
+
+
+def test_plaintext_cache(tmp_path):
+    cache = PlaintextCache(tmp_path / "cache")
+    document = document_path / "test1.txt"
+    assert cache.get(document) is None
+    cache.put(document, "some text", {"pages": [1]})
+    assert cache.get(document) is None
+    assert cache.get(document, {"pages": [1]}) == "some text"
+    assert cache.invalidate(document) == 1
+    assert cache.get(document, {"pages": [1]}) is None
+
+
+def test_plaintext_cache_eviction(tmp_path):
+    cache = PlaintextCache(tmp_path / "cache", max_bytes=0)
+    cache.put(document_path / "test1.txt", "some text")
+    assert cache.size == 0
+
+
+def test_plaintext_cache_scans_once(tmp_path, monkeypatch):
+    cache = PlaintextCache(tmp_path / "cache")
+    scans = []
+    entries = cache._entries
+
+    def counted_entries():
+        scans.append(1)
+        return entries()
+    monkeypatch.setattr(cache, "_entries", counted_entries)
+    for i in range(5):
+        cache.put(document_path / "test1.txt", f"some text {i}", {"pages": [i]})
+    # the running size is initialised once, no eviction scans while under budget
+    assert len(scans) == 1
+    assert cache._size == sum(entry.stat().st_size for entry in entries())
+    cache.max_bytes = cache._size
+    cache.put(document_path / "test1.txt", "more text", {"pages": [5]})
+    assert cache.size <= cache.max_bytes
+
+
+def test_load_document_uses_cache(tmp_path, monkeypatch):
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4 not really a pdf")
+    calls = []
+
+    def fake_pdf_to_plaintext(path, **kwargs):
+        calls.append(path)
+        return "parsed text"
+    monkeypatch.setattr(loading, "pdf_to_plaintext", fake_pdf_to_plaintext)
+    cache = PlaintextCache(tmp_path / "cache")
+    assert load_document(pdf, cache=cache) == "parsed text"
+    assert load_document(pdf, cache=cache) == "parsed text"
+    assert len(calls) == 1
+
+
+def test_iter_documents_workers_share_parent_cache(tmp_path, monkeypatch):
+    pdfs = []
+    for i in range(6):
+        pdf = tmp_path / f"doc{i}.pdf"
+        pdf.write_bytes(f"%PDF-1.4 not really a pdf {i}".encode())
+        pdfs.append(pdf)
+    # workers are forked, so they parse with the fake too
+    monkeypatch.setattr(loading, "pdf_to_plaintext",
+                        lambda path, **kwargs: f"parsed {path.name}")
+
+    pickled = []
+
+    def getstate(self):
+        pickled.append(self)
+        return {k: v for k, v in self.__dict__.items() if k != "_entries"}
+    monkeypatch.setattr(PlaintextCache, "__getstate__", getstate, raising=False)
+    cache = PlaintextCache(tmp_path / "cache")
+    scans = []
+    entries = cache._entries
+
+    def counted_entries():
+        scans.append(1)
+        return entries()
+    monkeypatch.setattr(cache, "_entries", counted_entries)
+    loaded = list(iter_documents(pdfs, workers=2, prefetch=3, cache=cache))
+    assert loaded == [(pdf, f"parsed {pdf.name}") for pdf in pdfs]
+    # the parent keeps the running size, the directory is scanned once rather than per document
+    assert len(scans) == 1
+    assert len(entries()) == len(pdfs)
+    assert not pickled
+    # cached documents aren't parsed again
+    monkeypatch.setattr(loading, "pdf_to_plaintext", None)
+    assert list(iter_documents(pdfs, workers=2, cache=cache)) == loaded
@@ -1,7 +1,8 @@
 from pathlib import Path
 import pytest
 
-from elicit.interface import ElicitLogger
+from database.db_utils import connect_db
+from elicit.interface import ElicitLogger, Extraction
 
 from .common import database
 
@@ -47,3 +48,55 @@ def test_get_validated_extractions_negative(logger: ElicitLogger):
         doc_names_neg, "var_0", True)
     assert len(extractions) < len(extractions_neg)
     assert any([extraction.valid == "FALSE" for extraction in extractions_neg])
+
+
+def test_transaction_batches_writes(tmp_path):
+    logger = ElicitLogger(tmp_path / "transaction.sqlite")
+    reader = connect_db(tmp_path / "transaction.sqlite")
+    with logger.transaction():
+        logger.push_variables("doc", [("var", "a"), ("var", "b")])
+        logger.push("doc", "var", Extraction("a", "x", "x", "x", 0.5, None, None), "method")
+        logger.push("doc", "var", Extraction("a", "x", "x", "x", 0.9, None, None), "method")
+        assert reader.execute(
+            "SELECT COUNT(*) FROM raw_extraction").fetchone()[0] == 0
+    assert reader.execute(
+        "SELECT COUNT(*) FROM raw_extraction").fetchone()[0] == 3
+    assert float(reader.execute(
+        "SELECT confidence FROM raw_extraction WHERE method = 'method'").fetchone()[0]) == 0.9
+
+
+def test_transaction_rolls_back(tmp_path):
+    logger = ElicitLogger(tmp_path / "rollback.sqlite")
+    with pytest.raises(RuntimeError):
+        with logger.transaction():
+            logger.push_variables("doc", [("var", "a")])
+            raise RuntimeError()
+    assert not logger.doc_in("doc")
+
+
+def test_offsets_persisted(tmp_path):
+    logger = ElicitLogger(tmp_path / "offsets.sqlite")
+    extraction = Extraction.from_character_startend(
+        "The defendant pleaded guilty.", "guilty", 0.5, 22, 28)
+    logger.push("doc", "var", extraction, "method")
+    logger.db.execute("UPDATE extraction SET valid = 'TRUE'")
+    stored, = logger.get_validated_extractions(["doc"], "var", False)
+    assert (stored.start, stored.end, stored.document_hash) == (
+        22, 28, extraction.document_hash)
+
+
+def test_offsets_only(tmp_path):
+    logger = ElicitLogger(tmp_path / "offsets_only.sqlite", store_contexts=False)
+    text = "The defendant pleaded guilty. He has previous convictions for theft. " * 10
+    extraction = Extraction.from_character_startend(text, "guilty", 0.5, 22, 28)
+    logger.push_document_text("doc", text)
+    logger.push("doc", "var", extraction, "method")
+    # overlapping span, merged with the first
+    logger.push("doc", "var", Extraction.from_character_startend(
+        text, "guilty", 0.5, 14, 28), "other")
+    assert logger.db.execute(
+        "SELECT COUNT(*), local_context, wider_context FROM extraction").fetchone() == (1, None, None)
+    logger.db.execute("UPDATE extraction SET valid = 'TRUE'")
+    stored, = logger.get_validated_extractions(["doc"], "var", False)
+    assert (stored.exact_context, stored.local_context, stored.wider_context) == (
+        extraction.exact_context, extraction.local_context, extraction.wider_context)
@@ -1,4 +1,5 @@
 from pathlib import Path
+import shutil
 import pytest
 
 from database.db_utils import connect_db, query_db
@@ -16,8 +17,10 @@ def db():
 
 
 @pytest.yield_fixture(scope="session")
-def db_catdog():
-    db_path = Path(__file__).parent / "catdog.sqlite"
+def db_catdog(tmp_path_factory):
+    # connecting migrates the database in place, so work on a copy of the fixture
+    db_path = tmp_path_factory.mktemp("catdog") / "catdog.sqlite"
+    shutil.copy(Path(__file__).parent / "catdog.sqlite", db_path)
     db = connect_db(db_path)
     yield db
 
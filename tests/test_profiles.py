@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+import torch
+
+from elicit.utils.profiles import PROFILES, get_profile, quantize
+
+
+def test_get_profile():
+    assert get_profile("default") is PROFILES["default"]
+    local = get_profile("distilled", qa_checkpoint=Path("/models/tinyroberta"))
+    assert local.qa_checkpoint == Path("/models/tinyroberta")
+    assert local.seq_checkpoint == PROFILES["distilled"].seq_checkpoint
+    assert get_profile(local) is local
+    with pytest.raises(ValueError):
+        get_profile("tiny")
+
+
+def test_fine_tuned_directories():
+    assert PROFILES["default"].fine_tuned(Path("models"), "qna_model") == Path("models/qna_model")
+    assert PROFILES["distilled"].fine_tuned(Path("models"), "qna_model") == Path(
+        "models/qna_model_deepset-tinyroberta-squad2")
+    assert PROFILES["distilled"].fine_tuned(Path("models"), "seq_model") == Path(
+        "models/seq_model_valhalla-distilbart-mnli-12-1")
+    # quantised profiles load the weights fine-tuned with their unquantised base
+    for name in ["qna_model", "seq_model"]:
+        assert PROFILES["quantized"].fine_tuned(Path("models"), name) == PROFILES["default"].fine_tuned(Path("models"), name)
+        assert PROFILES["distilled-quantized"].fine_tuned(Path("models"), name) == \
+            PROFILES["distilled"].fine_tuned(Path("models"), name)
+    # an overridden checkpoint doesn't share the fine-tuned weights of the profile's checkpoint
+    local = get_profile("distilled", qa_checkpoint=Path("/models/tinyroberta"))
+    assert local.fine_tuned(Path("models"), "qna_model") == Path("models/qna_model_models-tinyroberta")
+
+
+def test_quantize():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(16, 32), torch.nn.ReLU(), torch.nn.Linear(32, 4))
+    inputs = torch.randn(8, 16)
+    expected = model(inputs)
+    quantized = quantize(model)
+    assert not any(type(m) is torch.nn.Linear for m in quantized.modules())
+    assert torch.allclose(quantized(inputs), expected, atol=0.05)
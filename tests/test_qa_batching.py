@@ -0,0 +1,186 @@
+import pytest
+
+from elicit.extractor import Extractor
+from elicit.interface import CategoricalLabellingFunction
+from elicit.utils.profiles import get_profile
+from elicit.utils.registry import ModelRegistry
+
+from .test_chunking import WhitespaceTokenizer
+
+try:
+    from elicit.generic_labelling_functions import qa_transformer
+except ImportError:
+    pytest.skip("Transformer libraries not available.", allow_module_level=True)
+
+
+class FakeQAPipeline:
+    """Answers each question with the first occurrence of its last word in the context."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, inputs, top_k=1, batch_size=1, **kwargs):
+        self.calls.append((len(inputs), batch_size))
+        outputs = []
+        for qa_input in inputs:
+            word = qa_input["question"].split()[-1]
+            start = qa_input["context"].find(word)
+            score = 0.9 if start >= 0 else 0.0
+            outputs.append([{"answer": word, "score": score, "start": start, "end": start + len(word)}])
+        # like the transformers pipeline, a single input isn't wrapped in a list
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def test_answers_remapped_to_document():
+    document = ("The defendant pleaded guilty to theft. " * 20) + "The victim was injured. " * 20
+    pipeline = FakeQAPipeline()
+    results = qa_transformer.extract_answers_documents(
+        [document, "Nothing about theft here, injured."],
+        {"plea": ["what did they plead guilty"], "harm": ["was the victim injured"]},
+        pipeline, threshold=0.5, batch_size=8)
+    # every pair of every document went through a single call
+    assert pipeline.calls == [(len(qa_transformer.split_context(document)) * 2 + 2, 8)]
+    for answer, score, start, end in results[0]["plea"] + results[0]["harm"]:
+        assert document[start:end] == answer
+    assert [a[0] for a in results[1]["harm"]] == ["injured"]
+    assert results[1]["plea"] == []
+
+
+def test_extract_answers_single_question():
+    pipeline = FakeQAPipeline()
+    answers = qa_transformer.extract_answers(
+        "A short guilty plea.", ["plea guilty"], pipeline, threshold=0.5)
+    assert answers == [("guilty", 0.9, 8, 14)]
+
+
+class FeatureCountingQAPipeline(FakeQAPipeline):
+    """Counts the features the transformers pipeline would split each (whitespace tokenized) input into."""
+
+    def __init__(self):
+        super().__init__()
+        self.features = []
+
+    def __call__(self, inputs, top_k=1, batch_size=1, max_seq_len=384, max_question_len=64, doc_stride=128):
+        for qa_input in inputs:
+            question = min(len(qa_input["question"].split()), max_question_len)
+            # room for the context, next to the question and 3 special tokens
+            room = max_seq_len - question - 3
+            overflow = max(len(qa_input["context"].split()) - room, 0)
+            self.features.append(1 + -(-overflow // (room - doc_stride)))
+        return super().__call__(inputs, top_k, batch_size)
+
+
+def test_packed_window_single_feature():
+    chunker = qa_transformer.TokenChunker(WhitespaceTokenizer(), max_length=512, question_tokens=64, stride=64)
+    document = " ".join(f"w{i}" for i in range(1000))
+    pipeline = FeatureCountingQAPipeline()
+    qa_transformer.extract_answers(document, ["where is w5"], pipeline, chunker=chunker)
+    windows = chunker.chunks(document)
+    assert max(len(window.text.split()) for window in windows) > 384
+    # each window fills the model input once, the pipeline doesn't split it again
+    assert pipeline.features == [1] * len(windows)
+
+
+class SharedQALabellingFunction(qa_transformer.SharedQAMixin):
+    """Minimal labelling function answering the questions schema through a model registry."""
+
+    def __init__(self, model_registry):
+        self.model_registry = model_registry
+        self.model_profile = get_profile("default")
+        self.chunk_stride = 64
+        self.qna_threshold = 0.5
+        self.qa_batch_size = 8
+
+    def get_schema(self, schema_name, variable=None):
+        return {"plea": ["plea guilty"], "harm": ["victim injured"]}[variable]
+
+
+def test_shared_model_and_answers(monkeypatch):
+    loaded = []
+
+    def load_qa_pipeline(model_directory, device, chunk_stride=64, profile=None):
+        loaded.append(model_directory)
+        return qa_transformer.QAModel(None, None, FakeQAPipeline(), None)
+
+    monkeypatch.setattr(qa_transformer, "load_qa_pipeline", load_qa_pipeline)
+    registry = ModelRegistry()
+    first, second = SharedQALabellingFunction(registry), SharedQALabellingFunction(registry)
+    first._load_qa("models", 0)
+    second._load_qa("models", 0)
+    assert loaded == ["models"] and first.qna_pipeline is second.qna_pipeline
+    document = "A guilty plea, the victim was injured."
+    answers = first._answers(document, ["plea", "harm"])
+    # the second labelling function reuses the answers of the first
+    assert second._answers(document, ["harm", "plea"]) == answers
+    assert first.qna_pipeline.calls == [(2, 8)]
+    registry.invalidate(first.qa_key)
+    second._answers(document, ["plea"])
+    assert first.qna_pipeline.calls == [(2, 8), (1, 8)]
+    first._unload_qa()
+    assert first.qa_key in registry
+    second._unload_qa()
+    assert second.qa_key not in registry
+
+
+class RegisteredQALabellingFunction(qa_transformer.SharedQAMixin, CategoricalLabellingFunction):
+    """Labelling function answering the questions schema, registered with an extractor."""
+
+    def __init__(self, schemas, logger, model_registry=None, **kwargs):
+        super().__init__(schemas, logger, **kwargs)
+        self.model_registry = model_registry
+        self.model_profile = get_profile("default")
+        self.chunk_stride = 64
+        self.qna_threshold = 0.5
+        self.qa_batch_size = 8
+
+    def load(self, model_directory, device):
+        self._load_qa(model_directory, device)
+
+    def unload(self):
+        self._unload_qa()
+        super().unload()
+
+    def extract(self, document_name, variable_name, document_text):
+        self.extract_many(document_name, [variable_name], document_text)
+
+    def extract_many(self, document_name, variables, document_text):
+        self._answers(document_text, variables)
+
+    def train(self, data):
+        pass
+
+    @property
+    def labelling_method(self):
+        return type(self).__name__
+
+
+class OtherQALabellingFunction(RegisteredQALabellingFunction):
+    pass
+
+
+def test_lf_major_shares_model_across_corpus(tmp_path, monkeypatch):
+    loaded, pipelines = [], []
+
+    def load_qa_pipeline(model_directory, device, chunk_stride=64, profile=None):
+        loaded.append(model_directory)
+        pipelines.append(FakeQAPipeline())
+        return qa_transformer.QAModel(None, None, pipelines[-1], None)
+
+    monkeypatch.setattr(qa_transformer, "load_qa_pipeline", load_qa_pipeline)
+    variables = {"plea": ["guilty", "not guilty"], "harm": ["injured", "unharmed"]}
+    extractor = Extractor(tmp_path / "shared_qa.sqlite", model_path=tmp_path / "models")
+    # far fewer memoised answers than (document, variable) pairs
+    extractor.model_registry = ModelRegistry(result_cache_size=2)
+    extractor.register_schema(variables, "categories")
+    extractor.register_schema({"plea": ["plea guilty"], "harm": ["victim injured"]}, "questions")
+    extractor.register_labelling_function(RegisteredQALabellingFunction)
+    extractor.register_labelling_function(OtherQALabellingFunction)
+    assert extractor._shared_groups() == [extractor.lfs]
+    documents = []
+    for i in range(4 * extractor.model_registry.results.maxsize // len(variables)):
+        documents.append(tmp_path / f"document{i}.txt")
+        documents[-1].write_text(f"Document {i}, a guilty plea, the victim was injured.")
+    extractor.run(documents)
+    # the model is loaded once, and each (document, variable) answered once, for both labelling functions
+    assert len(loaded) == 1
+    assert sum(n for n, _ in pipelines[0].calls) == len(documents) * len(variables)
@@ -0,0 +1,31 @@
+from elicit.utils.registry import ModelRegistry
+
+
+def test_models_shared_until_released():
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return object()
+
+    first = registry.acquire(("qa", "models"), loader)
+    second = registry.acquire(("qa", "models"), loader)
+    assert first is second and len(loads) == 1
+    registry.release(("qa", "models"))
+    assert ("qa", "models") in registry
+    registry.release(("qa", "models"))
+    assert ("qa", "models") not in registry
+    # released again, e.g. by a labelling function which never loaded
+    registry.release(("qa", "models"))
+    assert registry.acquire(("qa", "models"), loader) is not first
+    assert len(loads) == 2
+
+
+def test_invalidate_results():
+    registry = ModelRegistry()
+    registry.results[("qa", "a")] = 1
+    registry.results[("qa", "b")] = 2
+    registry.results[("sim", "a")] = 3
+    registry.invalidate("qa")
+    assert dict(registry.results) == {("sim", "a"): 3}
@@ -0,0 +1,107 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from elicit.generic_labelling_functions.semantic_search import SemanticSearchLF, match_levels, sentence_similarities, split_sentences
+from elicit.interface import ElicitLogger
+from elicit.utils.embeddings import EmbeddingCache
+from elicit.utils.sentence_index import SentenceIndex
+
+TEXT = (
+    "The defendant pleaded guilty. He has previous convictions for theft. "
+    "The victim suffered serious injuries. He pleaded guilty. I take into account his remorse."
+)
+
+
+class BagOfWordsModel:
+    """Deterministic stand-in for a SentenceTransformer."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def _encode(self, text: str) -> np.ndarray:
+        embedding = np.zeros(16, dtype=np.float32)
+        for word in text.lower().split():
+            embedding[zlib.crc32(word.encode()) % 16] += 1
+        return embedding / max(1.0, np.linalg.norm(embedding))
+
+    def encode(self, texts):
+        if isinstance(texts, str):
+            self.encoded += 1
+            return self._encode(texts)
+        self.encoded += len(texts)
+        return np.stack([self._encode(t) for t in texts]) if texts else np.zeros((0, 16), dtype=np.float32)
+
+
+def _reference_similarities(queries, sentences, model, k=5):
+    """Per query scoring, as the search was originally written."""
+    sentence_scores = {}
+    for query in queries:
+        scores = model.encode(sentences) @ model.encode(query)
+        for sentence, score in zip(sentences, scores):
+            sentence_scores[sentence] = sentence_scores.get(sentence, 0) + float(score)
+    for sentence in sentence_scores:
+        sentence_scores[sentence] /= len(queries)
+    return dict(sorted(sentence_scores.items(), key=lambda x: x[1], reverse=True)[:k])
+
+
+def test_sentence_similarities_matches_reference():
+    model = BagOfWordsModel()
+    queries = ["did the defendant plead guilty", "previous convictions"]
+    sentences = split_sentences(TEXT)
+    expected = _reference_similarities(queries, sentences, model)
+    result = sentence_similarities(queries, sentences, model)
+    assert list(result) == list(expected)
+    assert list(result.values()) == pytest.approx(list(expected.values()))
+
+
+def test_match_levels():
+    model = BagOfWordsModel()
+    scores = {"The defendant pleaded guilty": 1.0, " The victim suffered serious injuries": 0.01}
+    levels, sentences, level_scores = match_levels(scores, ["guilty", "injuries"], model, 0.1)
+    assert levels == ["guilty"]
+    assert sentences == ["The defendant pleaded guilty"]
+
+
+def test_document_encoded_once(tmp_path):
+    schemas = {
+        "questions": {"plea": ["did the defendant plead guilty"], "injury": ["was the victim injured"]},
+        "categories": {"plea": ["guilty", "not guilty"], "injury": ["serious injuries", "no injuries"]},
+    }
+    lf = SemanticSearchLF(schemas, ElicitLogger(tmp_path / "semantic.sqlite"))
+    lf.model = model = BagOfWordsModel()
+    lf.extract_many("doc", ["plea", "injury"], TEXT)
+    lf.extract("doc", "plea", TEXT)
+    # sentences once, then each question and category list once
+    assert model.encoded == len(split_sentences(TEXT)) + 2 + 4
+    assert lf.logger.db.execute("SELECT COUNT(*) FROM extraction").fetchone()[0] > 0
+
+
+def test_embedding_cache_across_runs(tmp_path):
+    schemas = {"questions": {"plea": ["did the defendant plead guilty"]},
+               "categories": {"plea": ["guilty", "not guilty"]}}
+    logger = ElicitLogger(tmp_path / "semantic.sqlite")
+    cache = EmbeddingCache(tmp_path / "embeddings")
+    models = []
+    for _ in range(2):
+        lf = SemanticSearchLF(schemas, logger, embedding_cache=cache)
+        lf.model, lf.model_id = BagOfWordsModel(), "bag-of-words"
+        lf.extract("doc", "plea", TEXT)
+        models.append(lf.model)
+    assert models[0].encoded > 0
+    assert models[1].encoded == 0
+
+
+def test_corpus_search(tmp_path):
+    schemas = {"questions": {"plea": ["did the defendant plead guilty"]},
+               "categories": {"plea": ["guilty", "not guilty"]}}
+    index = SentenceIndex.for_database(tmp_path / "semantic.sqlite")
+    lf = SemanticSearchLF(schemas, ElicitLogger(tmp_path / "semantic.sqlite"), sentence_index=index)
+    lf.model = BagOfWordsModel()
+    lf.extract("doc_a", "plea", TEXT)
+    lf.extract("doc_b", "plea", "Nothing relevant here. The weather was fine.")
+    document, sentence, start, end, _ = lf.search_corpus(["pleaded guilty"], k=1)[0]
+    assert document == "doc_a"
+    assert TEXT[start:end] == sentence
+    assert "guilty" in sentence
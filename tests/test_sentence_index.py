@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from elicit.utils.sentence_index import SentenceIndex
+
+
+def _corpus(rng, n_documents=40, n_sentences=30, dim=16):
+    centres = rng.normal(size=(8, dim))
+    documents = []
+    for d in range(n_documents):
+        embeddings = centres[rng.randint(0, 8, n_sentences)] + 0.1 * rng.normal(size=(n_sentences, dim))
+        sentences = [f"document {d} sentence {i}" for i in range(n_sentences)]
+        spans = [(i * 30, i * 30 + len(s)) for i, s in enumerate(sentences)]
+        documents.append((f"doc_{d}", f"hash_{d}", sentences, spans, embeddings.astype(np.float32)))
+    return documents
+
+
+def _brute_force(documents, query, k):
+    scored = [(name, sentence, float(e @ query)) for name, _, sentences, _, embeddings in documents
+              for sentence, e in zip(sentences, embeddings.astype(np.float16).astype(np.float32))]
+    return sorted(scored, key=lambda x: -x[2])[:k]
+
+
+def test_flat_search_is_exact(tmp_path):
+    rng = np.random.RandomState(0)
+    documents = _corpus(rng, n_documents=5)
+    index = SentenceIndex(tmp_path / "index", n_lists=64)
+    for document in documents:
+        assert index.add(*document)
+    assert index.centroids is None
+    query = rng.normal(size=16).astype(np.float32)
+    expected = _brute_force(documents, query, 5)
+    results = index.search(query[None], k=5)
+    assert [(r[0], r[1]) for r in results] == [(e[0], e[1]) for e in expected]
+    assert [r[4] for r in results] == pytest.approx([e[2] for e in expected], rel=1e-5)
+
+
+def test_ivf_recall_and_persistence(tmp_path):
+    rng = np.random.RandomState(1)
+    documents = _corpus(rng)
+    index = SentenceIndex(tmp_path / "index", n_lists=8, n_probe=3, train_factor=16)
+    for document in documents:
+        index.add(*document)
+    assert index.centroids is not None
+    query = documents[3][4][0]
+    expected = {(e[0], e[1]) for e in _brute_force(documents, query, 10)}
+    found = {(r[0], r[1]) for r in index.search(query[None], k=10)}
+    assert len(found & expected) >= 8
+    # reopened from disk, already indexed documents are skipped
+    reopened = SentenceIndex(tmp_path / "index", n_lists=8, n_probe=3, train_factor=16)
+    assert len(reopened) == len(index)
+    assert not reopened.add(*documents[0])
+    assert reopened.search(query[None], k=10) == index.search(query[None], k=10)
+
+
+def test_reingested_document_replaces_rows(tmp_path):
+    index = SentenceIndex(tmp_path / "index")
+    embedding = np.ones((1, 4), dtype=np.float32)
+    index.add("doc", "old", ["old sentence"], [(0, 12)], embedding)
+    index.add("doc", "new", ["new sentence"], [(0, 12)], embedding)
+    assert [r[1] for r in index.search(embedding, k=5)] == ["new sentence"]
+
+
+def test_add_after_training_defers_assignment(tmp_path):
+    rng = np.random.RandomState(2)
+    documents = _corpus(rng)
+    index = SentenceIndex(tmp_path / "index", n_lists=8, train_factor=16)
+    for document in documents[:10]:
+        index.add(*document)
+    assert index.centroids is not None
+    vectors, rows = index._vectors, index._rows
+    pending = len(index._pending_assignments)
+    for document in documents[10:15]:
+        index.add(*document)
+    # adding neither re-reads the stored vectors nor remaps the rows
+    assert index._vectors is vectors and index._rows is rows
+    assert len(index._pending_assignments) == pending + 5
+    index.search(documents[0][4][:1], k=1)
+    np.testing.assert_array_equal(index.assignment, index._assign(np.arange(len(index))))
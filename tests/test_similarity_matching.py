@@ -0,0 +1,72 @@
+import zlib
+
+import numpy as np
+import pytest
+
+try:
+    from elicit.generic_labelling_functions import similarity_transformer
+except ImportError:
+    pytest.skip("Transformer libraries not available.", allow_module_level=True)
+
+
+class BagOfWordsModel:
+    """Deterministic stand-in for a SentenceTransformer, counting the batches it encodes."""
+
+    def __init__(self):
+        self.batches = []
+
+    def _encode(self, text: str) -> np.ndarray:
+        embedding = np.zeros(16, dtype=np.float32)
+        for word in text.lower().split():
+            embedding[zlib.crc32(word.encode()) % 16] += 1
+        return embedding
+
+    def encode(self, texts):
+        self.batches.append(len(texts))
+        return np.stack([self._encode(t) for t in texts])
+
+
+def _reference_match(answers, levels, model, filter_threshold):
+    """Per answer cosine similarity, as matching was originally written."""
+    candidates = []
+    for answer, score, start, end in answers:
+        embeddings = model.encode([f"this is a {t}" for t in [answer, *levels, ""]])
+        for level, embedding in zip([*levels, ""], embeddings[1:]):
+            s = float(embedding @ embeddings[0] /
+                      (np.linalg.norm(embedding) * np.linalg.norm(embeddings[0])))
+            if s > filter_threshold:
+                candidates.append((level, s * score, start, end))
+    return [c for c in candidates if c[1] > 0.1 and c[0] != ""]
+
+
+DOCUMENT = "The defendant pleaded guilty to theft. The victim was hurt badly."
+ANSWERS = [("pleaded guilty", 0.9, 14, 28), ("guilty to theft", 0.6, 22, 37), ("pleaded guilty", 0.5, 14, 28)]
+LEVELS = ["guilty plea", "not guilty plea"]
+
+
+def test_matches_reference():
+    model = BagOfWordsModel()
+    extractions = similarity_transformer.match_similarity(
+        ANSWERS, DOCUMENT, LEVELS, model, filter_threshold=0.5, threshold=0.1)
+    expected = _reference_match(ANSWERS, LEVELS, BagOfWordsModel(), 0.5)
+    assert expected
+    assert [(e.value, e.start, e.end) for e in extractions] == [(c[0], c[2], c[3]) for c in expected]
+    assert [e.confidence for e in extractions] == pytest.approx([c[1] for c in expected], rel=1e-5)
+    # levels and (unique) answers are each encoded in one batch
+    assert model.batches == [3, 2]
+
+
+def test_many_variables_single_batch():
+    model = BagOfWordsModel()
+    levels = {"plea": LEVELS, "harm": ["hurt", "unharmed"]}
+    level_embeddings = {variable: similarity_transformer.encode_levels(variable_levels, model.encode)
+                        for variable, variable_levels in levels.items()}
+    model.batches = []
+    answers = {"plea": ANSWERS, "harm": [("was hurt badly", 0.8, 50, 64), ("pleaded guilty", 0.4, 14, 28)]}
+    results = similarity_transformer.match_similarity_many(
+        answers, DOCUMENT, levels, model, filter_threshold=0.5, threshold=0.1, level_embeddings=level_embeddings)
+    assert model.batches == [3]
+    for variable, variable_answers in answers.items():
+        expected = similarity_transformer.match_similarity(
+            variable_answers, DOCUMENT, levels[variable], BagOfWordsModel(), filter_threshold=0.5, threshold=0.1)
+        assert [(e.value, e.start) for e in results[variable]] == [(e.value, e.start) for e in expected]
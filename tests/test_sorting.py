@@ -1,9 +1,17 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
 import pytest
 
+from elicit.interface import ElicitLogger, Extraction
+
 from database.db_utils import connect_db, query_db
 from .common import database
 
-from user_interface.server.sorting import learn_meta_classifier, set_meta_confidence, get_data, get_variable_data, update_confidence
+import user_interface.server.sorting as sorting
+
+from user_interface.server.sorting import FittedModel, _weasul, _weasul_predict, dirty_partitions, learn_meta_classifier, load_data, load_models, partition_data, rescore, score_unscored, set_meta_confidence, set_meta_confidences, get_data, get_variable_data, update_confidence
 
 
 @pytest.yield_fixture(scope="session")
@@ -15,11 +23,12 @@ def db():
 
 
 def test_set_meta_confidence(db):
-    set_meta_confidence(db, 0, 0.5)
-    assert float(query_db(db, "SELECT meta_confidence FROM extraction WHERE extraction_id=0")[
+    extraction_id = query_db(db, "SELECT MIN(extraction_id) FROM extraction")[0][0]
+    set_meta_confidence(db, extraction_id, 0.5)
+    assert float(query_db(db, "SELECT meta_confidence FROM extraction WHERE extraction_id=?", (extraction_id,))[
         0][0]) == 0.5
-    set_meta_confidence(db, 0, 0.6)
-    assert float(query_db(db, "SELECT meta_confidence FROM extraction WHERE extraction_id=0")[
+    set_meta_confidence(db, extraction_id, 0.6)
+    assert float(query_db(db, "SELECT meta_confidence FROM extraction WHERE extraction_id=?", (extraction_id,))[
         0][0]) == 0.6
 
 
@@ -41,3 +50,129 @@ def test_update_confidence(db):
     meta_confidences = query_db(db, "SELECT meta_confidence FROM extraction")
     assert all(c[0] is not None for c in val_confidences)
     assert all(c[0] is not None for c in meta_confidences)
+
+
+def test_update_confidence_lr_without_validations(tmp_path):
+    logger = ElicitLogger(tmp_path / "partial.sqlite")
+    rng = np.random.RandomState(0)
+    for i in range(20):
+        # value_a has validations of both classes, value_b none, and value_c only valid ones
+        for value, valid in [("value_a", ["TRUE", "FALSE"][i % 2]), ("value_b", None), ("value_c", "TRUE")]:
+            for method in ["method_1", "method_2"]:
+                logger.push(f"doc_{i}", "var_0", Extraction(value, "test", "test", None, rng.rand(), valid, None), method)
+    logger.db.commit()
+    update_confidence(logger.db, method="lr")
+    assert all(c[0] is not None for c in query_db(logger.db, "SELECT meta_confidence FROM extraction"))
+    methods = {value: model.method for (_, value), model in load_models(logger.db, "extraction").items()}
+    assert methods == {"value_a": "lr", "value_b": "weasul", "value_c": "weasul"}
+
+
+def test_load_data_dtypes(db):
+    data = load_data(db)
+    assert data.confidence.dtype == float
+    assert data.meta_confidence.dtype == float
+    partitions = dict(partition_data(data, include_value=False))
+    assert set(partitions) == {"var_0", "var_1"}
+    assert len(partitions["var_0"]) == len(get_data(db, "var_0", include_value=False))
+
+
+def test_update_confidence_single_read(db):
+    statements = []
+    db.set_trace_callback(statements.append)
+    try:
+        update_confidence(db, method="lr")
+        learn_meta_classifier(db)
+    finally:
+        db.set_trace_callback(None)
+    # one read of the tables per call, not one per variable
+    assert sum("FROM raw_extraction" in s for s in statements) == 2
+
+
+def test_set_meta_confidences(db):
+    extraction_ids = [r[0] for r in query_db(db, "SELECT extraction_id FROM extraction ORDER BY extraction_id LIMIT 5")]
+    statements = []
+    db.set_trace_callback(statements.append)
+    try:
+        set_meta_confidences(db, np.array(extraction_ids), np.array([0.1, 0.2, 0.3, 0.4, "?"], dtype=object))
+    finally:
+        db.set_trace_callback(None)
+    assert sum(s == "COMMIT" for s in statements) == 1
+    stored = query_db(db, f"SELECT meta_confidence FROM extraction WHERE extraction_id IN ({','.join('?' * 5)}) ORDER BY extraction_id",
+                      extraction_ids)
+    assert [None if r[0] is None else float(r[0]) for r in stored] == [0.1, 0.2, 0.3, 0.4, None]
+
+
+def test_rescore_dirty_partitions(db):
+    rescore(db, method="lr", full=True)
+    assert dirty_partitions(db) == {}
+    assert rescore(db, method="lr") == []
+    extraction_id, name, value, valid = query_db(db, """
+        SELECT extraction.extraction_id, variable.variable_name, variable.variable_value, extraction.valid
+        FROM extraction JOIN variable ON variable.variable_id = extraction.variable_id
+        ORDER BY extraction.extraction_id LIMIT 1""")[0]
+    db.execute("UPDATE extraction SET valid=? WHERE extraction_id=?",
+               ("FALSE" if valid == "TRUE" else "TRUE", extraction_id))
+    db.commit()
+    assert set(dirty_partitions(db)) == {(name, value)}
+    # extraction scores of the other partitions, and value scores of the other variables, are left as they are
+    other_extractions = """SELECT extraction.extraction_id, extraction.meta_confidence
+        FROM extraction JOIN variable ON variable.variable_id = extraction.variable_id
+        WHERE NOT (variable.variable_name=? AND variable.variable_value=?)"""
+    other_variables = "SELECT variable_id, value_confidence FROM variable WHERE variable_name<>?"
+    before = query_db(db, other_extractions, (name, value)), query_db(db, other_variables, (name,))
+    assert rescore(db, method="lr") == [(name, value)]
+    assert before == (query_db(db, other_extractions, (name, value)), query_db(db, other_variables, (name,)))
+    assert dirty_partitions(db) == {}
+
+
+@pytest.mark.parametrize("levels", [None, [0.0, 0.5, 1.0]])
+def test_weasul_persisted_parity(levels):
+    rng = np.random.default_rng(0)
+    label_matrix = rng.random((200, 3)) if levels is None else rng.choice(levels, size=(200, 3))
+    labels = rng.choice([-1, 0, 1], size=200)
+    confidence, state = _weasul(label_matrix, np.array([0.5, 0.5]), labels)
+    model = FittedModel.from_bytes("weasul", "v", FittedModel("weasul", ["a", "b", "c"], state, "v").to_bytes())
+    np.testing.assert_allclose(model.predict(pd.DataFrame(label_matrix, columns=["a", "b", "c"])), confidence, rtol=1e-6)
+    # a few new rows are scored as they are within the data the model was fitted to
+    subset = [0, 7, 42, 199, 3]
+    np.testing.assert_allclose(_weasul_predict(model.model, label_matrix[subset]), confidence[subset], rtol=1e-6)
+    # warm started from the previous fit
+    warm, _ = _weasul(label_matrix, np.array([0.5, 0.5]), labels, model.model)
+    assert warm.shape == confidence.shape
+
+
+def test_unloadable_model_is_refit(db):
+    update_confidence(db, method="lr")
+    db.execute("UPDATE fitted_model SET model=? WHERE kind='extraction' AND variable_name='var_0' AND variable_value='value_1'",
+               (b"not a model",))
+    db.commit()
+    assert ("var_0", "value_1") not in load_models(db, "extraction")
+    update_confidence(db, method="lr")
+    assert ("var_0", "value_1") in load_models(db, "extraction")
+
+
+def test_persisted_models(db, monkeypatch):
+    update_confidence(db, method="lr")
+    learn_meta_classifier(db)
+    models = load_models(db, "extraction")
+    assert ("var_0", "value_1") in models
+    assert set(load_models(db, "value")) == {("var_0", ""), ("var_1", "")}
+    # unchanged data isn't refit
+    def refit(*args):
+        raise AssertionError("refit unchanged data")
+    monkeypatch.setattr(sorting, "_logistic_regression", refit)
+    update_confidence(db, method="lr")
+    monkeypatch.undo()
+
+    db_path = Path(db.execute("PRAGMA database_list").fetchone()[2])
+    logger = ElicitLogger(db_path)
+    logger.push("doc_new", "var_0", Extraction("value_1", "test", "test", None, 0.9, None, None), "method_1")
+    logger.push("doc_new", "var_0", Extraction("value_1", "test", "test", None, 0.8, None, None), "method_2")
+    logger.db.commit()
+    assert score_unscored(db) == 1
+    scored = query_db(db, """
+        SELECT extraction.meta_confidence, variable.value_confidence
+        FROM extraction JOIN document ON document.document_id = extraction.document_id
+        JOIN variable ON variable.variable_id = extraction.variable_id
+        WHERE document.document_name = 'doc_new'""")
+    assert all(c is not None for row in scored for c in row)
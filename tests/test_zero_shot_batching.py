@@ -0,0 +1,58 @@
+import pytest
+
+from elicit.utils.utils import LRUCache
+
+try:
+    from elicit.generic_labelling_functions import nli_transformer
+except ImportError:
+    pytest.skip("Transformer libraries not available.", allow_module_level=True)
+
+
+class FakeZeroShotPipeline:
+    """Scores a label 0.9 when it is a word of the sequence, sorted best first like the transformers pipeline."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, sequences, candidate_labels, multi_label=False, batch_size=1):
+        self.calls.append((list(sequences), batch_size))
+        outputs = []
+        for sequence in sequences:
+            scores = [0.9 if label and label in sequence.split() else 0.1 for label in candidate_labels]
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])
+            outputs.append({"sequence": sequence, "labels": [candidate_labels[i] for i in order],
+                            "scores": [scores[i] for i in order]})
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+DOCUMENT = "The defendant pleaded guilty. The victim was hurt, the defendant was not."
+
+
+def test_answers_deduplicated_and_batched():
+    classifier = FakeZeroShotPipeline()
+    answers = [("pleaded guilty", 0.8, 14, 28), ("pleaded guilty", 0.6, 14, 28), ("guilty", 0.5, 22, 28)]
+    extractions = nli_transformer.match_classify(
+        answers, DOCUMENT, ["guilty", "not"], classifier, filter_threshold=0.5, threshold=0.1, batch_size=4)
+    # "guilty" is a level, the repeated answer is classified once
+    assert classifier.calls == [(["pleaded guilty"], 4)]
+    assert [(e.value, round(e.confidence, 2)) for e in extractions] == [
+        ("guilty", 0.72), ("guilty", 0.54), ("guilty", 0.5)]
+
+
+def test_cache_across_documents_and_variables():
+    classifier = FakeZeroShotPipeline()
+    cache = LRUCache(16)
+    levels = {"plea": ["guilty", "not"], "plea_again": ["guilty", "not"], "harm": ["hurt", "unharmed"]}
+    answers = {"plea": [("the defendant", 0.9, 0, 13)],
+               "plea_again": [("pleaded guilty", 0.9, 14, 28)],
+               "harm": [("the defendant", 0.9, 0, 13), ("was hurt", 0.9, 41, 49)]}
+    results = nli_transformer.match_classify_many(
+        answers, DOCUMENT, levels, classifier, filter_threshold=0.5, threshold=0.1, cache=cache)
+    # one call per set of levels
+    assert [c[0] for c in classifier.calls] == [["the defendant", "pleaded guilty"], ["the defendant", "was hurt"]]
+    assert results["plea"][0].value == "ABSTAIN"
+    assert [e.value for e in results["plea_again"]] == ["guilty"]
+    assert [e.value for e in results["harm"]] == ["hurt"]
+    nli_transformer.match_classify_many(
+        answers, DOCUMENT, levels, classifier, filter_threshold=0.5, threshold=0.1, cache=cache)
+    assert len(classifier.calls) == 2
@@ -4,8 +4,9 @@ from flask_cors import CORS, cross_origin
 from pathlib import Path
 import pandas as pd
 
-from database.db_utils import connect_db, query_db
-from user_interface.server.sorting import update_confidence
+from database.db_utils import connect_db, get_document_text, query_db
+from elicit.utils import contexts_from_span, text_hash
+from user_interface.server.sorting import rescore
 
 import click
 
@@ -30,6 +31,29 @@ def close_db():
         db.close()
 
 
+def materialise_contexts(db, rows: List[dict]) -> List[dict]:
+    """
+    Slice the contexts of extractions stored as offsets only from their document's text.
+
+    :param db: Connection to the database.
+    :param rows: Extraction rows, with document_id, start_char, end_char and document_hash.
+
+    :return: The rows, with contexts filled in.
+    """
+    texts = {}
+    for row in rows:
+        if row["local_context"] is not None or row["start_char"] is None:
+            continue
+        if row["document_id"] not in texts:
+            texts[row["document_id"]] = get_document_text(db, row["document_id"])
+        text = texts[row["document_id"]]
+        if text is None or text_hash(text) != row["document_hash"]:
+            continue
+        row["exact_context"], row["local_context"], row["wider_context"] = contexts_from_span(
+            text, row["start_char"], row["end_char"])
+    return rows
+
+
 def clean_title(title: str) -> str:
     title = title.replace("_", " ").title()
     title = title.replace("-", "").replace(" V ", " v ")
@@ -69,7 +93,7 @@ def create_app(db_path: Path, test_config=None):
         for doc, var in zip(*(iter(doc_var_ids),) * 2):
             output = query_db(
                 db, f"SELECT * FROM extraction WHERE document_id='{doc}' AND variable_id='{var}'")
-            evidence += output
+            evidence += materialise_contexts(db, output)
         return jsonify(evidence)
 
     @app.route('/api/document_extractions/<document_name>/<variable_name>', methods=['GET'])
@@ -82,6 +106,8 @@ def create_app(db_path: Path, test_config=None):
             SELECT extraction.extraction_id as extraction_id, extraction.meta_confidence AS meta_confidence,
             extraction.exact_context AS exact_context, extraction.local_context AS local_context,
             extraction.wider_context AS wider_context, extraction.valid AS valid,
+            extraction.start_char AS start_char, extraction.end_char AS end_char,
+            extraction.document_id AS document_id, extraction.document_hash AS document_hash,
             extraction.alert AS alert, variable.variable_name AS variable_name,
             variable.variable_value AS variable_value, variable.value_confidence AS confidence
             FROM extraction AS extraction
@@ -92,6 +118,7 @@ def create_app(db_path: Path, test_config=None):
             WHERE document.document_name='{document_name}'
             AND variable.variable_name='{variable_name}'"""
         )
+        output = materialise_contexts(db, output)
 
         unique_lfs = len(
             query_db(db, f"SELECT DISTINCT method FROM raw_extraction"))
@@ -112,6 +139,8 @@ def create_app(db_path: Path, test_config=None):
                 "exact_context": row["exact_context"],
                 "local_context": row["local_context"],
                 "wider_context": row["wider_context"],
+                "start_char": row["start_char"],
+                "end_char": row["end_char"],
                 "valid": row["valid"],
                 "alert": row["alert"],
             }
@@ -190,7 +219,8 @@ def create_app(db_path: Path, test_config=None):
     @cross_origin(origin='*', headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Origin'])
     def update_conf():
         db = get_db()
-        update_confidence(db)
+        # only partitions with validations since the last update are rescored
+        rescore(db)
         return "OK"
 
     @app.route('/api/get_cases', methods=['GET'])
@@ -5,6 +5,9 @@ import torch.nn as nn
 from tqdm import tqdm_notebook as tqdm
 from typing import Optional
 
+# Largest table of weak label output combination counts marginalised densely in LabelModel.marginal_probs
+MAX_DENSE_COUNTS = 1 << 22
+
 
 class LabelModel():
     """Fit label model using Matrix Completion approach (Ratner et al. 2019).
@@ -76,47 +79,18 @@ class LabelModel():
     def create_mask(self):
         """Create mask to encode graph structure in covariance matrix"""
 
-        mask = np.ones(
-            (
-                max(
-                    max(
-                        self.wl_idx.values()
-                    )
-                ) + 1,
-                max(
-                    max(
-                        self.wl_idx.values()
-                    )
-                ) + 1
-            )
-        )
+        size = max(max(self.wl_idx.values())) + 1
+        mask = np.ones((size, size))
         for key in self.wl_idx.keys():
-            # Mask diagonal blocks
-            mask[
-                self.wl_idx[key][0]: self.wl_idx[key][-1] + 1,
-                self.wl_idx[key][0]: self.wl_idx[key][-1] + 1
-            ] = 0
             key = key.split("_")
-
-            # Create all possible subsets of clique
-            clique_list = list(
-                itertools.chain.from_iterable(
-                    itertools.combinations(key, r) for r in range(len(key) + 1) if r > 0
-                )
-            )
-            # Create all pairs of subsets of clique
-            clique_pairs = list(
-                itertools.permutations(
-                    [
-                        "_".join(clique) for clique in clique_list
-                    ], r=2
-                )
-            )
-            # Mask all pairs of subsets that are in the same clique
-            for pair in clique_pairs:
-                i = self.wl_idx[pair[0]]
-                j = self.wl_idx[pair[1]]
-                mask[i[0]:i[-1] + 1, j[0]:j[-1] + 1] = 0
+            # Columns of all possible subsets of clique, including the clique itself
+            cols = np.concatenate([
+                self.wl_idx["_".join(clique)]
+                for r in range(1, len(key) + 1)
+                for clique in itertools.combinations(key, r)
+            ])
+            # Mask all pairs of subsets that are in the same clique, and the diagonal block
+            mask[np.ix_(cols, cols)] = 0
         return mask
 
     def get_psi(self, label_matrix=None, cliques=None, nr_wl=None):
@@ -138,20 +112,13 @@ class LabelModel():
 
         # label_matrix = (label_matrix > 0).astype(int)
 
-        psi_list = []
-        col_counter = 0
-        wl_idx = {}
-
-        # Compute psi for individual weak labels
-        for i in range(nr_wl):
-            wl = label_matrix[:, i]
-            wl_onehot = np.array([wl[:, None], 1 - wl[:, None]]).squeeze().T
-            psi_list.append(wl_onehot)
-            wl_idx[str(i)] = list(
-                range(col_counter, col_counter + wl_onehot.shape[1]))
-            col_counter += wl_onehot.shape[1]
-
-        psi = np.hstack(psi_list)
+        # Compute psi for individual weak labels, columns (wl, 1 - wl) per weak label
+        wl = np.asarray(label_matrix)[:, :nr_wl]
+        psi = np.empty((len(wl), 2 * nr_wl), dtype=np.result_type(wl, 1))
+        psi[:, 0::2] = wl
+        psi[:, 1::2] = 1 - wl
+        wl_idx = {str(i): [2 * i, 2 * i + 1] for i in range(nr_wl)}
+        col_counter = 2 * nr_wl
 
         # Compute psi for cliques
         psi_int_list = []
@@ -206,6 +173,7 @@ class LabelModel():
         self.label_matrix = label_matrix
         self.cliques = cliques
         self.class_balance = class_balance
+        self._P_lambda = None
 
         self.N, self.nr_wl = label_matrix.shape
         self.y_set = np.array([0, 1])  # array of classes
@@ -289,13 +257,15 @@ class LabelModel():
         self.mu = self.calculate_mu(self.cov_OS)  # .clamp(0, 1)
         return self
 
-    def predict(self, label_matrix=None, mu=None, P_Y=None, assign_train_labels=False):
+    def predict(self, label_matrix=None, mu=None, P_Y=None, assign_train_labels=False, reference=None):
         """Predict probabilistic labels for a dataset from given parameters and class balance
 
         Args:
             label_matrix (numpy.array): Array with labeling function outputs on dataset
             mu (torch.Tensor): Tensor with label model parameters
             P_Y (float): Estimated probability of Y=1 for dataset
+            reference (tuple, optional): Combination counts (see `combination_counts`) of the dataset
+                the marginal weak label probabilities are estimated from, e.g. the train set. Defaults to label_matrix
 
         Returns:
             torch.Tensor: Tensor with probabilistic labels for given dataset
@@ -308,8 +278,12 @@ class LabelModel():
             assign_train_labels = True
 
         N = label_matrix.shape[0]
-        psi, _ = self.get_psi(label_matrix=label_matrix,
-                              cliques=self.cliques, nr_wl=self.nr_wl)
+        if label_matrix is getattr(self, "label_matrix", None):
+            # psi of the train label matrix is computed once, in init_label_model
+            psi = self.psi
+        else:
+            psi, _ = self.get_psi(label_matrix=label_matrix,
+                                  cliques=self.cliques, nr_wl=self.nr_wl)
 
         cliques_joined = self.cliques.copy()
         for i, clique in enumerate(cliques_joined):
@@ -339,26 +313,7 @@ class LabelModel():
         P_joint_lambda_Y[(clique_probs == 1).all(axis=0)] = np.nan
 
         # Marginal weak label probabilities
-        lambda_combs, lambda_index, lambda_counts = (
-            np.unique(label_matrix, axis=0, return_counts=True, return_inverse=True))
-        new_counts = lambda_counts.copy()
-        rows_not_abstain, cols_not_abstain = np.where(lambda_combs != -1)
-        for i, comb in enumerate(lambda_combs):
-            nr_non_abstain = (comb != -1).sum()
-            if nr_non_abstain < self.nr_wl:
-                if nr_non_abstain == 0:
-                    new_counts[i] = 0
-                else:
-                    match_rows = np.where(
-                        (
-                            lambda_combs[:,
-                                         cols_not_abstain[rows_not_abstain == i]]
-                            == lambda_combs[i, cols_not_abstain[rows_not_abstain == i]]
-                        ).all(axis=1)
-                    )
-                    new_counts[i] = lambda_counts[match_rows].sum()
-
-        self.P_lambda = torch.Tensor((new_counts/N)[lambda_index][:, None])
+        self.P_lambda = torch.Tensor(self.marginal_probs(label_matrix, reference)[:, None])
 
         # Conditional label probability
         P_Y_given_lambda = (
@@ -372,6 +327,96 @@ class LabelModel():
 
         return prob_labels
 
+    @staticmethod
+    def combination_counts(label_matrix):
+        """Unique combinations of weak label outputs in a dataset, and how often each occurs
+
+        Args:
+            label_matrix (numpy.array): Array with labeling function outputs on dataset
+
+        Returns:
+            numpy.array: Array of unique combinations
+            numpy.array: Array with the number of data points with each combination
+        """
+        return np.unique(label_matrix, axis=0, return_counts=True)
+
+    def marginal_probs(self, label_matrix, reference=None):
+        """Probability of the non-abstaining weak labels of each data point
+
+        Args:
+            label_matrix (numpy.array): Array with labeling function outputs on dataset
+            reference (tuple, optional): Combination counts (see `combination_counts`) of the dataset
+                the probabilities are estimated from. Defaults to label_matrix
+
+        Returns:
+            numpy.array: Array with, for each data point, the fraction of data points (of the reference)
+                with the same outputs for its non-abstaining weak labels (0 if all abstain)
+        """
+        if reference is None and label_matrix is getattr(self, "label_matrix", None) \
+                and getattr(self, "_P_lambda", None) is not None:
+            return self._P_lambda
+
+        lambda_combs, lambda_index, lambda_counts = (
+            np.unique(label_matrix, axis=0, return_counts=True, return_inverse=True))
+        lambda_index = lambda_index.reshape(-1)
+        if reference is None:
+            N = label_matrix.shape[0]
+            combs, weights, query = lambda_combs, lambda_counts, np.arange(len(lambda_combs))
+        else:
+            # Combinations of the dataset are counted as in the reference, where they may not occur at all
+            ref_combs, ref_counts = reference
+            N = ref_counts.sum()
+            combs, comb_index = np.unique(
+                np.concatenate([lambda_combs, ref_combs]), axis=0, return_inverse=True)
+            comb_index = comb_index.reshape(-1)
+            query = comb_index[:len(lambda_combs)]
+            weights = np.bincount(
+                comb_index[len(lambda_combs):], weights=ref_counts, minlength=len(combs))
+
+        # Encode the outputs of each weak label as integers, with abstain as the last code
+        not_abstain = combs != -1
+        codes = np.empty(combs.shape, dtype=np.int64)
+        shape = []
+        for j, col in enumerate(combs.T):
+            levels = np.unique(col[not_abstain[:, j]])
+            codes[:, j] = np.where(not_abstain[:, j], np.searchsorted(levels, col), len(levels))
+            # one extra code for "any output", the marginal over the weak label
+            shape.append(len(levels) + 2)
+
+        if np.prod(shape, dtype=float) <= MAX_DENSE_COUNTS:
+            # Dense table of combination counts, summed into the "any output" code of each weak label in turn
+            counts = np.bincount(
+                np.ravel_multi_index(codes.T, shape), weights=weights, minlength=int(np.prod(shape))
+            ).reshape(shape)
+            for j in range(len(shape)):
+                index = (slice(None),) * j
+                counts[index + (-1,)] = counts[index + (slice(0, -1),)].sum(axis=j)
+            # Abstaining weak labels match any output
+            marginal = np.where(not_abstain[query], codes[query], np.array(shape) - 1)
+            new_counts = counts[tuple(marginal.T)]
+        else:
+            # Too many combinations for a dense table: combinations abstaining on the same weak labels
+            # are marginalised together, summing the counts per code with bincount
+            new_counts = np.zeros(len(query))
+            patterns, pattern_index = np.unique(
+                not_abstain, axis=0, return_inverse=True)
+            pattern_index = pattern_index.reshape(-1)
+            for p, pattern in enumerate(patterns):
+                _, groups = np.unique(
+                    codes[:, pattern], axis=0, return_inverse=True)
+                groups = groups.reshape(-1)
+                in_pattern = pattern_index[query] == p
+                new_counts[in_pattern] = np.bincount(
+                    groups, weights=weights)[groups[query[in_pattern]]]
+        # Data points with abstains for all weak labels
+        new_counts[~not_abstain[query].any(axis=1)] = 0
+
+        P_lambda = (new_counts / N)[lambda_index]
+        if reference is None and label_matrix is getattr(self, "label_matrix", None):
+            # the train label matrix is predicted every epoch of an active learning fit
+            self._P_lambda = P_lambda
+        return P_lambda
+
     def predict_true(self, y_true, y_test=None, label_matrix=None):
         """Obtain training labels from optimal label model using ground truth labels"""
 
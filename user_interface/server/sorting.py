@@ -1,45 +1,112 @@
-from typing import Dict, List, Tuple, Union
+from dataclasses import dataclass
+import hashlib
+import io
+import json
+from typing import Any, Collection, Dict, List, Optional, Sequence, Tuple, Union
 from typing_extensions import Literal
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import OneHotEncoder
 import pandas as pd
 import numpy as np
+import torch
 from user_interface.server.label_model import LabelModel
 
 from database.db_utils import query_db
 
 
-def set_value_confidence(db, variable_id: int, confidence: float):
-    query_db(
-        db, f"UPDATE variable SET value_confidence={'NULL' if confidence == '?' else confidence} WHERE variable_id={variable_id}")
+def _confidence(confidence) -> Optional[float]:
+    return None if confidence == '?' or confidence is None else float(confidence)
+
+
+def set_value_confidences(db, variable_ids: Sequence[int], confidences: Sequence[float]):
+    """
+    Set the value confidence of many variables in a single transaction.
+
+    :param db: Connection to the database.
+    :param variable_ids: IDs of the variables.
+    :param confidences: Confidence of each variable, '?' or None for unknown.
+    """
+    db.executemany("UPDATE variable SET value_confidence=? WHERE variable_id=?",
+                   [(_confidence(c), int(i)) for i, c in zip(variable_ids, confidences)])
     db.commit()
 
 
-def set_meta_confidence(db, extraction_id: int, confidence: float):
-    query_db(
-        db, f"UPDATE extraction SET meta_confidence={'NULL' if confidence == '?' else confidence} WHERE extraction_id={extraction_id}")
+def set_meta_confidences(db, extraction_ids: Sequence[int], confidences: Sequence[float]):
+    """
+    Set the meta confidence of many extractions in a single transaction.
+
+    :param db: Connection to the database.
+    :param extraction_ids: IDs of the extractions.
+    :param confidences: Confidence of each extraction, '?' or None for unknown.
+    """
+    db.executemany("UPDATE extraction SET meta_confidence=? WHERE extraction_id=?",
+                   [(_confidence(c), int(i)) for i, c in zip(extraction_ids, confidences)])
     db.commit()
 
 
+def set_value_confidence(db, variable_id: int, confidence: float):
+    set_value_confidences(db, [variable_id], [confidence])
+
+
+def set_meta_confidence(db, extraction_id: int, confidence: float):
+    set_meta_confidences(db, [extraction_id], [confidence])
+
+
 def get_variables(db):
     variables = query_db(
         db, f"SELECT DISTINCT variable_name FROM variable")
     return [v[0] for v in variables]
 
 
-def get_data(db, variable_name: str, include_value: bool = True):
-    extraction_df = pd.read_sql(
-        "SELECT meta_confidence, valid, variable_id, document_id, extraction_id FROM extraction", db)
-    variable_df = pd.read_sql(
-        "SELECT variable_id, document_id, variable_name, variable_value, value_confidence FROM variable", db)
-    raw_extraction_df = pd.read_sql(
-        "SELECT raw_extraction_id, extraction_id, method, confidence FROM raw_extraction", db)
-    df = pd.merge(extraction_df, variable_df, on=[
-                  "variable_id", "document_id"], how="left")
-    df = pd.merge(raw_extraction_df, df, on=["extraction_id"], how="left")
-    df = df[df.variable_name == variable_name]
+DATA_QUERY = """
+    SELECT raw_extraction.raw_extraction_id, raw_extraction.extraction_id, raw_extraction.method,
+           CAST(raw_extraction.confidence AS REAL) AS confidence,
+           CAST(extraction.meta_confidence AS REAL) AS meta_confidence, extraction.valid,
+           extraction.variable_id, extraction.document_id,
+           variable.variable_name, variable.variable_value,
+           CAST(variable.value_confidence AS REAL) AS value_confidence
+    FROM raw_extraction
+    JOIN extraction ON extraction.extraction_id = raw_extraction.extraction_id
+    JOIN variable ON variable.variable_id = extraction.variable_id
+        AND variable.document_id = extraction.document_id
+"""
+
+
+def load_data(db, variables: Optional[Collection[str]] = None) -> pd.DataFrame:
+    """
+    Load every raw extraction, joined with its extraction and variable, in a single query.
+    Confidences are loaded as floats.
+
+    :param db: Connection to the database.
+    :param variables: Only load the raw extractions of these variables. None loads every variable.
+
+    :return: Dataframe with a row per raw extraction.
+    """
+    if variables is None:
+        return pd.read_sql(DATA_QUERY, db)
+    variables = list(variables)
+    return pd.read_sql(f"{DATA_QUERY} WHERE variable.variable_name IN ({','.join('?' * len(variables))})",
+                       db, params=variables)
+
+
+def partition_data(data: pd.DataFrame, include_value: bool = True):
+    """
+    Partition loaded data by variable, and optionally value, without further I/O.
+
+    :param data: Data from `load_data`.
+    :param include_value: Whether to partition each variable by its values.
+
+    :return: Iterator of (variable, data) or ((variable, value), data).
+    """
+    keys = ["variable_name", "variable_value"] if include_value else "variable_name"
+    return iter(data.groupby(keys, sort=False))
+
+
+def get_data(db, variable_name: str, include_value: bool = True, data: Optional[pd.DataFrame] = None):
+    data = load_data(db) if data is None else data
+    df = data[data.variable_name == variable_name]
     if include_value:
-        return [df[df.variable_value == variable_value] for variable_value in df.variable_value.unique()]
+        return [part for _, part in partition_data(df, include_value=True)]
     return df
 
 
@@ -59,25 +126,198 @@ def get_variable_data(ext_var_df: pd.DataFrame, training: bool = False):
     return df["extraction_id"], X, y
 
 
-def _logistic_regression(X_train, y_train, X_dep):
-    clf = LogisticRegression(solver="lbfgs")
-    clf.fit(X_train, y_train)
-    return clf.predict_proba(X_dep)[:, 1]
+@dataclass
+class FittedModel:
+    """
+    A model fitted by a sort: the confidence model of a (variable, value) partition, or the value meta-classifier of a variable.
+    Persisted in the database, to score new extractions without refitting and to warm start the next fit.
+    Only the parameters are persisted, as plain arrays, so loading a model never runs code from the database.
+    """
+    # "lr" or "weasul" for extraction confidence models, "meta" for value meta-classifiers
+    method: str
+    # feature columns, in the order the model was fitted with
+    columns: List[str]
+    model: Any
+    # hash of the data the model was fitted to
+    data_version: str
+    encoder: Optional[OneHotEncoder] = None
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        Confidence of each row, without refitting.
+
+        :param X: Features of the rows, columns missing from the model's data are ignored, and missing columns are 0.
+
+        :return: Array of confidences.
+        """
+        X = X.reindex(columns=self.columns, fill_value=0)
+        if self.method == "weasul":
+            return _weasul_predict(self.model, X.values.astype(float))
+        if self.method == "meta":
+            X = _meta_features(self.encoder, X, self.columns[1:])
+        return self.model.predict_proba(np.asarray(X, dtype=float))[:, 1]
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialise the parameters of the model as an npz archive.
+
+        :return: The serialised parameters.
+        """
+        arrays = {"columns": np.array(self.columns, dtype=str)}
+        if self.method == "weasul":
+            arrays.update({name: self.model[name] for name in _WEASUL_ARRAYS})
+            arrays["structure"] = np.array(json.dumps(
+                {name: self.model[name] for name in ("cliques", "wl_idx", "nr_wl")}))
+        else:
+            arrays.update(coef=self.model.coef_, intercept=self.model.intercept_,
+                          classes=self.model.classes_)
+        if self.encoder is not None:
+            arrays["categories"] = np.array(
+                self.encoder.categories_[0], dtype=str)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, method: str, data_version: str, data: bytes) -> "FittedModel":
+        """
+        Rebuild a model from its serialised parameters.
+
+        :param method: Method of the model.
+        :param data_version: Hash of the data the model was fitted to.
+        :param data: Parameters serialised by `to_bytes`.
+
+        :return: The model.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            columns = arrays["columns"].tolist()
+            if method == "weasul":
+                model = {name: arrays[name] for name in _WEASUL_ARRAYS}
+                model.update(json.loads(str(arrays["structure"])))
+            else:
+                model = LogisticRegression(solver="lbfgs")
+                model.coef_, model.intercept_, model.classes_ = arrays["coef"], arrays["intercept"], arrays["classes"]
+                model.n_features_in_ = model.coef_.shape[1]
+            encoder = None
+            if "categories" in arrays:
+                categories = arrays["categories"].tolist()
+                encoder = OneHotEncoder(categories=[categories], handle_unknown="ignore", sparse=False).fit(
+                    pd.DataFrame({"variable_value": categories}))
+        return cls(method, columns, model, data_version, encoder)
+
+
+# arrays of the state of a fitted WeaSuL label model
+_WEASUL_ARRAYS = ("z", "mu", "E_S", "combinations", "counts")
+
+
+def _data_version(*frames) -> str:
+    digest = hashlib.sha1()
+    for frame in frames:
+        digest.update(pd.util.hash_pandas_object(
+            pd.DataFrame(frame), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def save_models(db, kind: Literal['extraction', 'value'], models: Dict[Tuple[str, str], FittedModel]):
+    """
+    Persist fitted models in a single transaction, replacing those of the same partitions.
+
+    :param db: Connection to the database.
+    :param kind: "extraction" for confidence models, "value" for value meta-classifiers.
+    :param models: Dictionary of (variable, value): model. Value meta-classifiers have an empty value.
+    """
+    db.executemany("INSERT OR REPLACE INTO fitted_model (kind, variable_name, variable_value, method, data_version, model) VALUES (?, ?, ?, ?, ?, ?)",
+                   [(kind, variable, value, model.method, model.data_version, model.to_bytes())
+                    for (variable, value), model in models.items()])
+    db.commit()
+
+
+def load_models(db, kind: Literal['extraction', 'value'], variables: Optional[Collection[str]] = None) -> Dict[Tuple[str, str], FittedModel]:
+    """
+    Load persisted models. Models which can't be loaded are left out, so they are refit.
+
+    :param db: Connection to the database.
+    :param kind: "extraction" for confidence models, "value" for value meta-classifiers.
+    :param variables: Only load the models of these variables. None loads every variable.
+
+    :return: Dictionary of (variable, value): model. Value meta-classifiers have an empty value.
+    """
+    cur = db.cursor()
+    cur.row_factory = None
+    rows = cur.execute("SELECT variable_name, variable_value, method, data_version, model FROM fitted_model WHERE kind=?",
+                       (kind,)).fetchall()
+    cur.close()
+    models = {}
+    for variable, value, method, data_version, data in rows:
+        if variables is not None and variable not in variables:
+            continue
+        try:
+            models[(variable, value)] = FittedModel.from_bytes(
+                method, data_version, data)
+        except Exception as e:
+            print(
+                f"Couldn't load the {kind} model of {variable} {value}, it will be refit: {e}")
+    return models
+
+
+def _previous(models: Dict[Tuple[str, str], FittedModel], key: Tuple[str, str], method: str, columns: List[str]) -> Optional[FittedModel]:
+    previous = models.get(key)
+    if previous is None or previous.method != method or previous.columns != columns:
+        return None
+    return previous
+
+
+def _logistic_regression(X_train, y_train, X_dep, previous: Optional[LogisticRegression] = None):
+    """
+    :param previous: Model fitted to the same features, to warm start from.
+
+    :return: Confidence of each row of X_dep, and the fitted model.
+    """
+    if previous is None:
+        clf = LogisticRegression(solver="lbfgs")
+    else:
+        clf = previous.set_params(warm_start=True)
+    clf.fit(np.asarray(X_train, dtype=float), y_train)
+    return clf.predict_proba(np.asarray(X_dep, dtype=float))[:, 1], clf
+
 
+def _weasul(label_matrix, class_balance, labels, previous: Optional[dict] = None):
+    """
+    :param previous: State of a label model fitted to the same weak labels, to warm start from.
 
-def _weasul(label_matrix, class_balance, labels):
+    :return: Confidence of each row, and the state of the fitted label model.
+    """
     label_model = LabelModel()
     clique_matrix = [[i] for i in range(label_matrix.shape[1])]
-    label_model.fit(label_matrix, clique_matrix, class_balance, labels)
+    if previous is None:
+        label_model.fit(label_matrix, clique_matrix, class_balance, labels)
+    else:
+        # the unsupervised fit only initialises z, start from the previous fit instead
+        label_model.z = torch.nn.Parameter(
+            torch.tensor(previous["z"]), requires_grad=True)
     label_model.active_learning = True
     label_model.ground_truth_labels = labels
     label_model.penalty_strength = 0.1
     label_model.fit(label_matrix, clique_matrix,
                     class_balance, labels)
-    return label_model.predict()[:, 0]
+    # new data points are scored with the marginals of the data the model was fitted to
+    combinations, counts = LabelModel.combination_counts(label_matrix)
+    state = {"z": label_model.z.detach().numpy().copy(), "mu": label_model.mu.detach().numpy().copy(),
+             "E_S": np.asarray(label_model.E_S), "combinations": combinations, "counts": counts,
+             "cliques": label_model.cliques, "nr_wl": label_model.nr_wl, "wl_idx": label_model.wl_idx}
+    return label_model.predict()[:, 0].detach().numpy(), state
 
 
-def get_metaconf_data(db, k: int = 3):
+def _weasul_predict(state: dict, label_matrix) -> np.ndarray:
+    label_model = LabelModel()
+    label_model.cliques = state["cliques"]
+    label_model.nr_wl = state["nr_wl"]
+    label_model.wl_idx = state["wl_idx"]
+    return label_model.predict(label_matrix, torch.Tensor(state["mu"]), state["E_S"],
+                               reference=(state["combinations"], state["counts"]))[:, 0].detach().numpy()
+
+
+def get_metaconf_data(db, k: int = 3, data: Optional[pd.DataFrame] = None, variables: Optional[Collection[str]] = None):
     def _topk(df: pd.DataFrame):
         top_vals = df.sort_values(
             "meta_confidence", ascending=False).head(k).reset_index()
@@ -96,10 +336,10 @@ def get_metaconf_data(db, k: int = 3):
         else:
             return None
 
-    for variable in get_variables(db):
-        var_data = get_data(db, variable, include_value=False)
+    data = load_data(db, variables) if data is None else data
+    for _, var_data in partition_data(data, include_value=False):
+        var_data = var_data.copy()
         var_data["valid"] = var_data.valid.map({"TRUE": True, "FALSE": False})
-        var_data["meta_confidence"] = var_data.meta_confidence.astype(float)
         val_data = var_data.groupby(
             ["document_id", "variable_name", "variable_value"]).apply(_topk)
         val_data.fillna(0, inplace=True)
@@ -107,49 +347,201 @@ def get_metaconf_data(db, k: int = 3):
         yield val_train_data, val_data
 
 
-def learn_meta_classifier(db, k: int = 3):
-    for train_data, data in get_metaconf_data(db, k=k):
+def _meta_features(encoder: OneHotEncoder, data: pd.DataFrame, value_columns: List[str]) -> np.ndarray:
+    return np.concatenate([encoder.transform(data[["variable_value"]]), data[value_columns]], axis=1)
+
+
+def learn_meta_classifier(db, k: int = 3, data: Optional[pd.DataFrame] = None, variables: Optional[Collection[str]] = None):
+    value_columns = [f"value_{i}" for i in range(k)]
+    stored = load_models(db, "value", variables)
+    variable_ids, confidences, fitted = [], [], {}
+    for train_data, data in get_metaconf_data(db, k=k, data=data, variables=variables):
+        key = (data.variable_name.iloc[0], "")
+        data_version = _data_version(
+            train_data[["variable_value", *value_columns, "valid"]])
+        previous = _previous(stored, key, "meta", [
+                             "variable_value", *value_columns])
         try:
-            ohe = OneHotEncoder(handle_unknown="ignore", sparse=False)
-            X_val = ohe.fit_transform(train_data[["variable_value"]])
-            X = train_data[[f"value_{i}" for i in range(k)]]
-            y = train_data.valid.astype(int)
-            X = np.concatenate([X_val, X], axis=1)
-            clf = LogisticRegression(solver="lbfgs")
-            clf.fit(X, y)
-            X_dep = ohe.transform(data[["variable_value"]])
-            X_dep = np.concatenate(
-                [X_dep, data[[f"value_{i}" for i in range(k)]]], axis=1)
-            for i, idx in enumerate(data.id):
-                set_value_confidence(db, idx, clf.predict_proba(X_dep)[i, 1])
+            if previous is not None and previous.data_version == data_version:
+                model = previous
+            else:
+                ohe = OneHotEncoder(handle_unknown="ignore", sparse=False)
+                ohe.fit(train_data[["variable_value"]])
+                X = _meta_features(ohe, train_data, value_columns)
+                y = train_data.valid.astype(int)
+                clf = LogisticRegression(solver="lbfgs")
+                # warm start only when the values are encoded the same way
+                if previous is not None and all(np.array_equal(a, b) for a, b in
+                                                zip(previous.encoder.categories_, ohe.categories_)):
+                    clf = previous.model.set_params(warm_start=True)
+                clf.fit(X, y)
+                model = FittedModel(
+                    "meta", ["variable_value", *value_columns], clf, data_version, ohe)
+            confidence = model.predict(data)
         except:
             continue
+        fitted[key] = model
+        variable_ids.append(data.id.to_numpy())
+        confidences.append(confidence)
+    if variable_ids:
+        set_value_confidences(db, np.concatenate(
+            variable_ids), np.concatenate(confidences))
+    if fitted:
+        save_models(db, "value", fitted)
 
 
-def update_confidence(db, method: Literal['lr', 'weasul'] = "weasul", **kwargs):
-    for variable in get_variables(db):
-        for data in get_data(db, variable, True):
-            _, X_train, y_train = get_variable_data(
-                data, training=True)
-            ex_ids, X_dep, y_dep = get_variable_data(
-                data, training=False)
+def update_confidence(db, method: Literal['lr', 'weasul'] = "weasul", data: Optional[pd.DataFrame] = None, partitions: Optional[Collection[Tuple[str, str]]] = None, **kwargs):
+    variables = None if partitions is None else {
+        variable for variable, _ in partitions}
+    data = load_data(db, variables) if data is None else data
+    stored = load_models(db, "extraction", variables)
+    extraction_ids, confidences, fitted = [], [], {}
+    for (variable, value), data in partition_data(data, include_value=True):
+        if partitions is not None and (variable, value) not in partitions:
+            continue
+        _, X_train, y_train = get_variable_data(
+            data, training=True)
+        ex_ids, X_dep, y_dep = get_variable_data(
+            data, training=False)
 
-            if len(X_dep.columns) == 0:
-                continue
+        if len(X_dep.columns) == 0:
+            continue
 
-            if method == "lr":
-                confidence = _logistic_regression(X_train, y_train, X_dep)
-            if method == "weasul":
-                class_balance = kwargs.get("class_balance", None)
-                if class_balance is None:
-                    class_balance_var = np.array([0.5, 0.5])
-                else:
-                    class_balance_var = class_balance.get(variable, None)
-                    if class_balance_var is None:
-                        class_balance_var = np.array([1, 1])
-                confidence = _weasul(X_dep.values, class_balance_var, y_dep)
+        partition_method = method
+        if method == "lr" and y_train.nunique() < 2:
+            # logistic regression needs validations of both classes
+            partition_method = "weasul"
+        previous = _previous(stored, (variable, value),
+                             partition_method, list(X_dep.columns))
+        if partition_method == "lr":
+            data_version = _data_version(X_train, y_train)
+            if previous is not None and previous.data_version == data_version:
+                model = previous
+                confidence = model.predict(X_dep)
+            else:
+                confidence, clf = _logistic_regression(
+                    X_train, y_train, X_dep, previous and previous.model)
+                model = FittedModel(partition_method, list(
+                    X_dep.columns), clf, data_version)
+        elif partition_method == "weasul":
+            class_balance = kwargs.get("class_balance", None)
+            if class_balance is None:
+                class_balance_var = np.array([0.5, 0.5])
             else:
-                raise ValueError("Invalid method")
+                class_balance_var = class_balance.get(variable, None)
+                if class_balance_var is None:
+                    class_balance_var = np.array([1, 1])
+            data_version = _data_version(X_dep, y_dep, class_balance_var)
+            if previous is not None and previous.data_version == data_version:
+                model = previous
+                confidence = model.predict(X_dep)
+            else:
+                confidence, state = _weasul(
+                    X_dep.values, class_balance_var, y_dep, previous and previous.model)
+                model = FittedModel(partition_method, list(
+                    X_dep.columns), state, data_version)
+        else:
+            raise ValueError("Invalid method")
+
+        fitted[(variable, value)] = model
+        extraction_ids.append(ex_ids.to_numpy())
+        confidences.append(confidence)
+    if extraction_ids:
+        set_meta_confidences(db, np.concatenate(
+            extraction_ids), np.concatenate(confidences))
+    if fitted:
+        save_models(db, "extraction", fitted)
+
+
+def score_unscored(db, k: int = 3) -> int:
+    """
+    Score extractions, and values, without confidences (e.g. of newly extracted documents) with the
+    models persisted by the last sort, without refitting. Partitions without a persisted model are left unscored.
+
+    :param db: Connection to the database.
+    :param k: Number of top extraction confidences used by the value meta-classifier.
+
+    :return: Number of extractions scored.
+    """
+    data = load_data(db)
+    unscored = data[data.meta_confidence.isnull()]
+    stored = load_models(db, "extraction", set(unscored.variable_name))
+    extraction_ids, confidences = [], []
+    for key, part in partition_data(unscored, include_value=True):
+        if key not in stored:
+            continue
+        ex_ids, X, _ = get_variable_data(part, training=False)
+        extraction_ids.append(ex_ids.to_numpy())
+        confidences.append(stored[key].predict(X))
+    if not extraction_ids:
+        return 0
+    extraction_ids = np.concatenate(extraction_ids)
+    set_meta_confidences(db, extraction_ids, np.concatenate(confidences))
+
+    # the value meta-classifiers take the new extraction confidences as features
+    data = load_data(db, set(unscored.variable_name))
+    unscored_ids = set(data.variable_id[data.value_confidence.isnull()])
+    stored = load_models(db, "value", set(unscored.variable_name))
+    variable_ids, confidences = [], []
+    for _, var_data in get_metaconf_data(db, k=k, data=data):
+        model = stored.get((var_data.variable_name.iloc[0], ""))
+        var_data = var_data[var_data.id.isin(unscored_ids)]
+        if model is None or var_data.empty or len(model.columns) != k + 1:
+            continue
+        variable_ids.append(var_data.id.to_numpy())
+        confidences.append(model.predict(var_data))
+    if variable_ids:
+        set_value_confidences(db, np.concatenate(
+            variable_ids), np.concatenate(confidences))
+    return len(extraction_ids)
+
+
+def dirty_partitions(db) -> Dict[Tuple[str, str], int]:
+    """
+    (variable, value) partitions with new validations or raw extractions since they were last scored.
+
+    :param db: Connection to the database.
+
+    :return: Dictionary of (variable, value): version of the partition's changes.
+    """
+    cur = db.cursor()
+    cur.row_factory = None
+    rows = cur.execute(
+        "SELECT variable_name, variable_value, version FROM dirty_partition").fetchall()
+    cur.close()
+    return {(variable, value): version for variable, value, version in rows}
+
+
+def clear_dirty_partitions(db, partitions: Dict[Tuple[str, str], int]):
+    """
+    Mark partitions as scored, unless they changed again since `dirty_partitions` was read.
+
+    :param db: Connection to the database.
+    :param partitions: Partitions and their versions, from `dirty_partitions`.
+    """
+    db.executemany("DELETE FROM dirty_partition WHERE variable_name=? AND variable_value=? AND version=?",
+                   [(variable, value, version) for (variable, value), version in partitions.items()])
+    db.commit()
+
+
+def rescore(db, method: Literal['lr', 'weasul'] = "weasul", k: int = 3, full: bool = False, **kwargs) -> List[Tuple[str, str]]:
+    """
+    Refit and rescore only the (variable, value) partitions with new validations or raw extractions,
+    and the value meta-classifiers of their variables. Scores of other partitions are left as they are.
+
+    :param db: Connection to the database.
+    :param method: Method scoring the extractions of each partition.
+    :param k: Number of top extraction confidences used by the value meta-classifier.
+    :param full: Rescore every partition.
 
-            for i, ex_id in enumerate(ex_ids):
-                set_meta_confidence(db, ex_id, confidence[i])
+    :return: The rescored partitions.
+    """
+    dirty = dirty_partitions(db)
+    if not dirty and not full:
+        return []
+    partitions = None if full else dirty
+    variables = None if full else {variable for variable, _ in dirty}
+    update_confidence(db, method=method, partitions=partitions, **kwargs)
+    learn_meta_classifier(db, k=k, variables=variables)
+    clear_dirty_partitions(db, dirty)
+    return list(dirty)